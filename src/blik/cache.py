@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+from cryohub.utils.types import PoseSet
+from scipy.spatial.transform import Rotation
+
+from .utils import atomic_write, bin_image, column_to_array
+
+# bump this whenever the on-disk layout changes, so old entries are ignored
+CACHE_VERSION = 1
+DEFAULT_CACHE_SIZE = 2 * 1024**3
+
+
+def default_cache_dir():
+    """Cache directory set through the BLIK_CACHE_DIR environment variable, or ~/.cache/blik."""
+    return Path(os.environ.get("BLIK_CACHE_DIR", Path.home() / ".cache" / "blik"))
+
+
+def _hash(*items):
+    return hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def cache_key(path, **kwargs):
+    """
+    Generate the cache key for a file read with the given reader kwargs.
+
+    The key has three parts: the path, the file size and modification time, and the
+    kwargs. Any change to the file results in a new key with the same path part,
+    so stale entries can be found and removed.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    return _hash(str(path)), _hash(CACHE_VERSION, stat.st_size, stat.st_mtime_ns), _hash(kwargs)
+
+
+def _entry(cache_dir, path, suffix=".npz", **kwargs):
+    """Path of the cache entry for this file and kwargs, after removing entries from older versions of it."""
+    path_key, stat_key, kwargs_key = cache_key(path, **kwargs)
+    for entry in _entries(cache_dir, f"{path_key}-*"):
+        if not entry.stem.startswith(f"{path_key}-{stat_key}-"):
+            _remove(entry)
+    return Path(cache_dir) / f"{path_key}-{stat_key}-{kwargs_key}{suffix}"
+
+
+def _entries(cache_dir, pattern="*"):
+    return list(Path(cache_dir).glob(f"{pattern}.np[yz]"))
+
+
+def _remove(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        # another thread got there first
+        pass
+
+
+def evict(cache_dir, max_bytes=DEFAULT_CACHE_SIZE):
+    """Remove least recently used entries until the cache is smaller than max_bytes."""
+    entries = []
+    for entry in _entries(cache_dir):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(entry)
+        total -= size
+
+
+def load_posesets(cache_dir, path, **kwargs):
+    """Load the posesets parsed from path from the cache, or None if there is no valid entry."""
+    entry = _entry(cache_dir, path, **kwargs)
+    if not entry.exists():
+        return None
+
+    posesets = []
+    try:
+        with np.load(entry, allow_pickle=False) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            for i, pset in enumerate(meta):
+                features = None
+                if pset["features"] is not None:
+                    features = pd.DataFrame(
+                        {col: arrays[f"{i}/features/{j}"] for j, col in enumerate(pset["features"])}
+                    )
+                posesets.append(
+                    PoseSet(
+                        position=arrays[f"{i}/position"],
+                        shift=arrays[f"{i}/shift"] if pset["shift"] else None,
+                        orientation=Rotation.from_quat(arrays[f"{i}/orientation"]) if pset["orientation"] else None,
+                        experiment_id=pset["experiment_id"],
+                        pixel_spacing=pset["pixel_spacing"],
+                        source=pset["source"],
+                        features=features,
+                    )
+                )
+    except (OSError, ValueError, KeyError):
+        # corrupted or incompatible entry
+        _remove(entry)
+        return None
+
+    # mark as recently used
+    os.utime(entry)
+    return posesets
+
+
+def save_posesets(cache_dir, path, posesets, max_bytes=DEFAULT_CACHE_SIZE, **kwargs):
+    """
+    Store the posesets parsed from path in the cache as a flat npz of columns.
+
+    Returns False (and stores nothing) if some features cannot be stored without pickling.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    meta = []
+    arrays = {}
+    for i, pset in enumerate(posesets):
+        features = pset.features
+        if features is not None:
+            for j, col in enumerate(features.columns):
+                arr = column_to_array(features[col])
+                if arr is None:
+                    return False
+                arrays[f"{i}/features/{j}"] = arr
+        arrays[f"{i}/position"] = np.asarray(pset.position)
+        if pset.shift is not None:
+            arrays[f"{i}/shift"] = np.asarray(pset.shift)
+        if pset.orientation is not None:
+            arrays[f"{i}/orientation"] = pset.orientation.as_quat()
+        meta.append(
+            {
+                "experiment_id": str(pset.experiment_id),
+                "pixel_spacing": float(pset.pixel_spacing or 0),
+                "source": str(pset.source),
+                "shift": pset.shift is not None,
+                "orientation": pset.orientation is not None,
+                "features": None if features is None else [str(col) for col in features.columns],
+            }
+        )
+    arrays["meta"] = np.array(json.dumps(meta))
+
+    # concurrent readers never see partial entries
+    with atomic_write(_entry(cache_dir, path, **kwargs)) as f:
+        np.savez(f, **arrays)
+
+    evict(cache_dir, max_bytes)
+    return True
+
+
+def load_pyramid(cache_dir, path, factors, stack=False):
+    """
+    Load the binned levels of a multiscale pyramid from the cache as memory maps.
+
+    Returns None unless all the levels are present.
+    """
+    entries = [_entry(cache_dir, path, suffix=".npy", bin=factor, stack=stack) for factor in factors]
+    if not all(entry.exists() for entry in entries):
+        return None
+    levels = []
+    for entry in entries:
+        levels.append(np.load(entry, mmap_mode="r"))
+        os.utime(entry)
+    return levels
+
+
+def save_pyramid(cache_dir, path, data, factors, stack=False, max_bytes=DEFAULT_CACHE_SIZE):
+    """
+    Compute the binned levels of a multiscale pyramid and store them in the cache.
+
+    Data is streamed chunk by chunk, and each level is binned from the stored previous
+    one, so the full resolution data is read only once. Returns the levels as memory maps.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    levels = []
+    previous = (data, 1)
+    for factor in factors:
+        binned = bin_image(previous[0], factor // previous[1], stack=stack)
+        entry = _entry(cache_dir, path, suffix=".npy", bin=factor, stack=stack)
+        with atomic_write(entry, mode=None) as tmp:
+            mmap = np.lib.format.open_memmap(tmp, mode="w+", dtype=binned.dtype, shape=binned.shape)
+            try:
+                da.store(binned, mmap, lock=True)
+                mmap.flush()
+            finally:
+                del mmap
+        levels.append(np.load(entry, mmap_mode="r"))
+        previous = (levels[-1], factor)
+
+    evict(cache_dir, max_bytes)
+    return levels
+
+
+def load_image_stats(cache_dir, path, **kwargs):
+    """Load the contrast limits and histogram of an image from the cache, or None if missing."""
+    entry = _entry(cache_dir, path, stats=kwargs)
+    if not entry.exists():
+        return None
+    try:
+        with np.load(entry, allow_pickle=False) as arrays:
+            stats = tuple(arrays["contrast_limits"].tolist()), (arrays["counts"], arrays["edges"])
+    except (OSError, ValueError, KeyError):
+        _remove(entry)
+        return None
+    os.utime(entry)
+    return stats
+
+
+def save_image_stats(cache_dir, path, contrast_limits, histogram, max_bytes=DEFAULT_CACHE_SIZE, **kwargs):
+    """Store the contrast limits and histogram of an image in the cache."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with atomic_write(_entry(cache_dir, path, stats=kwargs)) as f:
+        np.savez(f, contrast_limits=np.asarray(contrast_limits), counts=histogram[0], edges=histogram[1])
+    evict(cache_dir, max_bytes)
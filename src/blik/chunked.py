@@ -0,0 +1,220 @@
+"""
+Array-like which only allocates memory for the chunks that are written to.
+
+Used to back new segmentations, which are mostly empty: a tomogram-sized array of zeros
+costs nothing until something is painted, and only the painted chunks need to be saved.
+"""
+
+import itertools
+
+import numpy as np
+
+DEFAULT_CHUNKS = (64, 64, 64)
+
+
+class ChunkedArray:
+    """
+    Array of zeros stored as a dict of dense chunks, allocated when first written to.
+
+    Supports what napari needs for labels layers: basic indexing (integers and slices),
+    and fancy indexing with a tuple of integer arrays (used when painting), both for
+    reading and writing. Reading never allocates anything.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, chunks=DEFAULT_CHUNKS):
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = np.dtype(dtype)
+        chunks = tuple(chunks)
+        if len(chunks) < len(self.shape):
+            # leading dimensions are chunked one by one
+            chunks = (1,) * (len(self.shape) - len(chunks)) + chunks
+        self.chunks = tuple(min(int(c), s) or 1 for c, s in zip(chunks[-len(self.shape) :], self.shape))
+        # chunk grid index -> dense chunk
+        self._blocks = {}
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        """Memory actually allocated."""
+        return sum(block.nbytes for block in self._blocks.values())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(shape={self.shape}, dtype={self.dtype}, chunks={self.chunks}, "
+            f"allocated={len(self._blocks)})"
+        )
+
+    def blocks(self):
+        """Allocated chunks, as (slices into the array, chunk data) pairs, in grid order."""
+        for idx in sorted(self._blocks):
+            yield self._block_slices(idx), self._blocks[idx]
+
+    def _block_slices(self, idx):
+        return tuple(slice(i * c, min((i + 1) * c, s)) for i, c, s in zip(idx, self.chunks, self.shape))
+
+    def _block(self, idx):
+        block = self._blocks.get(idx)
+        if block is None:
+            shape = tuple(sl.stop - sl.start for sl in self._block_slices(idx))
+            block = self._blocks[idx] = np.zeros(shape, dtype=self.dtype)
+        return block
+
+    def astype(self, dtype, copy=True):
+        dtype = np.dtype(dtype)
+        if dtype == self.dtype and not copy:
+            return self
+        new = type(self)(self.shape, dtype, self.chunks)
+        new._blocks = {idx: block.astype(dtype) for idx, block in self._blocks.items()}
+        return new
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.zeros(self.shape, dtype=self.dtype)
+        for slices, block in self.blocks():
+            arr[slices] = block
+        return arr if dtype is None else arr.astype(dtype, copy=False)
+
+    def _is_fancy(self, key):
+        return (
+            isinstance(key, tuple)
+            and len(key) == self.ndim
+            and all(isinstance(k, np.ndarray) and np.issubdtype(k.dtype, np.integer) for k in key)
+        )
+
+    def _normalize(self, key):
+        """Turn a basic index into one (start, stop, step) or integer per dimension."""
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1 :]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) != self.ndim:
+            raise IndexError(f"too many indices for array of dimension {self.ndim}")
+        normalized = []
+        for k, s in zip(key, self.shape):
+            if isinstance(k, slice):
+                normalized.append(k.indices(s))
+            elif isinstance(k, (int, np.integer)):
+                k = int(k)
+                if not -s <= k < s:
+                    raise IndexError(f"index {k} is out of bounds for axis with size {s}")
+                normalized.append(k % s)
+            else:
+                return None
+        return normalized
+
+    def _fancy_chunks(self, key):
+        """Group the points of a fancy index by chunk, yielding (chunk index, point mask, local index)."""
+        key = tuple(np.broadcast_arrays(*key))
+        flat = [np.ravel(k) for k in key]
+        flat = [np.where(k < 0, k + s, k) for k, s in zip(flat, self.shape)]
+        grid = np.stack([k // c for k, c in zip(flat, self.chunks)], axis=1)
+        if not len(grid):
+            return key[0].shape, []
+        unique, inverse = np.unique(grid, axis=0, return_inverse=True)
+        groups = []
+        for i, idx in enumerate(map(tuple, unique)):
+            mask = inverse.ravel() == i
+            local = tuple(k[mask] - j * c for k, j, c in zip(flat, idx, self.chunks))
+            groups.append((idx, mask, local))
+        return key[0].shape, groups
+
+    def __getitem__(self, key):
+        if self._is_fancy(key):
+            shape, groups = self._fancy_chunks(key)
+            out = np.zeros(int(np.prod(shape, dtype=np.int64)), dtype=self.dtype)
+            for idx, mask, local in groups:
+                block = self._blocks.get(idx)
+                if block is not None:
+                    out[mask] = block[local]
+            return out.reshape(shape)
+
+        normalized = self._normalize(key)
+        if normalized is None:
+            return np.asarray(self)[key]
+
+        # read the bounding box of the selection, then apply steps and integer indices
+        box = []
+        for k in normalized:
+            if isinstance(k, int):
+                box.append((k, k + 1, 1))
+            else:
+                start, stop, step = k
+                if step < 0:
+                    n = len(range(start, stop, step))
+                    start, stop = (start + (n - 1) * step, start + 1) if n else (0, 0)
+                box.append((start, max(stop, start), step))
+        out = np.zeros(tuple(stop - start for start, stop, _ in box), dtype=self.dtype)
+        if out.size:
+            ranges = [range(start // c, (stop - 1) // c + 1) for (start, stop, _), c in zip(box, self.chunks)]
+            for idx in itertools.product(*ranges):
+                block = self._blocks.get(idx)
+                if block is None:
+                    continue
+                src, dst = [], []
+                for (start, stop, _), sl in zip(box, self._block_slices(idx)):
+                    lo, hi = max(start, sl.start), min(stop, sl.stop)
+                    src.append(slice(lo - sl.start, hi - sl.start))
+                    dst.append(slice(lo - start, hi - start))
+                out[tuple(dst)] = block[tuple(src)]
+        final = tuple(0 if isinstance(k, int) else slice(None, None, k[2]) for k in normalized)
+        return out[final]
+
+    def __setitem__(self, key, value):
+        if self._is_fancy(key):
+            shape, groups = self._fancy_chunks(key)
+            value = np.broadcast_to(np.asarray(value, dtype=self.dtype), shape).ravel()
+            for idx, mask, local in groups:
+                values = value[mask]
+                if idx not in self._blocks and not values.any():
+                    continue
+                self._block(idx)[local] = values
+            return
+
+        normalized = self._normalize(key)
+        if normalized is None or any(not isinstance(k, int) and k[2] != 1 for k in normalized):
+            if isinstance(key, np.ndarray) and key.dtype == bool:
+                self[np.nonzero(key)] = np.asarray(value)
+                return
+            raise IndexError("only integers, slices with step 1 and tuples of integer arrays are supported")
+
+        box = [(k, k + 1) if isinstance(k, int) else (k[0], max(k[1], k[0])) for k in normalized]
+        box_shape = tuple(stop - start for start, stop in box)
+        if not all(box_shape):
+            return
+        # broadcast against the selection without the dimensions dropped by integer indices
+        selected_shape = tuple(n for n, k in zip(box_shape, normalized) if not isinstance(k, int))
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype), selected_shape).reshape(box_shape)
+        ranges = [range(start // c, (stop - 1) // c + 1) for (start, stop), c in zip(box, self.chunks)]
+        for idx in itertools.product(*ranges):
+            src, dst = [], []
+            for (start, stop), sl in zip(box, self._block_slices(idx)):
+                lo, hi = max(start, sl.start), min(stop, sl.stop)
+                dst.append(slice(lo - sl.start, hi - sl.start))
+                src.append(slice(lo - start, hi - start))
+            values = value[tuple(src)]
+            if idx not in self._blocks and not values.any():
+                continue
+            self._block(idx)[tuple(dst)] = values
+
+    def min(self):
+        values = [block.min() for block in self._blocks.values()]
+        if self.nbytes < self.size * self.dtype.itemsize:
+            values.append(self.dtype.type(0))
+        return min(values) if values else self.dtype.type(0)
+
+    def max(self):
+        values = [block.max() for block in self._blocks.values()]
+        if self.nbytes < self.size * self.dtype.itemsize:
+            values.append(self.dtype.type(0))
+        return max(values) if values else self.dtype.type(0)
@@ -0,0 +1,187 @@
+"""
+A simple indexed container for named arrays, used by the blik file formats.
+
+Layout:
+    preamble: magic (8 bytes), version (uint32), index offset and index size (uint64)
+    data chunks: raw (or zlib compressed) C-ordered array bytes
+    index: utf-8 json with the kind of file, free-form attrs, and for each array
+           its dtype, trailing shape and the list of chunks (offset, nbytes, rows, compression)
+
+Arrays are split into chunks along the first axis, so row ranges can be read without
+loading everything, and uncompressed chunks can be memory mapped. Appending writes new
+chunks and a new index at the end of the file, and only then updates the preamble,
+so existing data is never rewritten and an interrupted append leaves the file intact.
+"""
+
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"BLIKCNT\0"
+CONTAINER_VERSION = 1
+_PREAMBLE = struct.Struct("<8sIQQ")
+COMPRESSIONS = (None, "zlib")
+
+
+def is_container(path):
+    """Check whether a file is a blik container (as opposed to a legacy file)."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _read_preamble(f):
+    f.seek(0)
+    magic, version, index_offset, index_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} is not a blik container")
+    if version > CONTAINER_VERSION:
+        raise ValueError(f"{f.name} was written by a newer version of blik (container version {version})")
+    return index_offset, index_size
+
+
+def _read_index(f):
+    index_offset, index_size = _read_preamble(f)
+    f.seek(index_offset)
+    return json.loads(f.read(index_size).decode())
+
+
+def _write_chunks(f, arr, chunk_rows=None, compression=None):
+    """Write array to the current end of the file, returning the chunk table."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression!r}, must be one of {COMPRESSIONS}")
+    arr = np.ascontiguousarray(arr)
+    chunk_rows = chunk_rows or max(len(arr), 1)
+    chunks = []
+    for start in range(0, len(arr), chunk_rows):
+        data = arr[start : start + chunk_rows].tobytes()
+        if compression == "zlib":
+            # fastest level: these are mostly float coordinates that do not compress much anyways
+            data = zlib.compress(data, 1)
+        chunks.append(
+            {
+                "offset": f.tell(),
+                "nbytes": len(data),
+                "rows": len(arr[start : start + chunk_rows]),
+                "compression": compression,
+            }
+        )
+        f.write(data)
+    return chunks
+
+
+def _write_index(f, index):
+    f.seek(0, 2)
+    index_offset = f.tell()
+    raw = json.dumps(index).encode()
+    f.write(raw)
+    # the preamble is updated last, making the new index visible only once complete
+    f.seek(0)
+    f.write(_PREAMBLE.pack(MAGIC, CONTAINER_VERSION, index_offset, len(raw)))
+
+
+def write_container(path, kind, arrays, attrs=None, chunk_rows=None, compression=None):
+    """
+    Write a dict of named arrays (and json-serializable attrs) to a new container.
+
+    chunk_rows: split arrays into chunks of at most this many rows (default: one chunk each)
+    compression: None or "zlib". Compressed chunks cannot be memory mapped.
+    """
+    index = {"kind": kind, "attrs": attrs or {}, "arrays": {}}
+    with open(path, "wb") as f:
+        # placeholder, filled in when the index is written
+        f.write(_PREAMBLE.pack(MAGIC, CONTAINER_VERSION, 0, 0))
+        for name, arr in arrays.items():
+            arr = np.asarray(arr)
+            index["arrays"][name] = {
+                "dtype": arr.dtype.str,
+                "shape": list(arr.shape[1:]),
+                "chunks": _write_chunks(f, arr, chunk_rows, compression),
+            }
+        _write_index(f, index)
+    return path
+
+
+def append_container(path, arrays, attrs=None, chunk_rows=None, compression=None):
+    """
+    Append rows to arrays of an existing container, without rewriting existing data.
+
+    attrs, if given, are updated (not replaced). Arrays that do not exist yet are created.
+    """
+    with open(path, "r+b") as f:
+        index = _read_index(f)
+        f.seek(0, 2)
+        for name, arr in arrays.items():
+            entry = index["arrays"].get(name)
+            arr = np.asarray(arr, dtype=None if entry is None else entry["dtype"])
+            if entry is None:
+                entry = index["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape[1:]), "chunks": []}
+            elif list(arr.shape[1:]) != entry["shape"]:
+                raise ValueError(
+                    f"cannot append array with shape {arr.shape} to {name!r} with rows of shape {entry['shape']}"
+                )
+            entry["chunks"].extend(_write_chunks(f, arr, chunk_rows, compression))
+        index["attrs"].update(attrs or {})
+        _write_index(f, index)
+    return path
+
+
+class ContainerReader:
+    """
+    Read arrays (or row ranges of them) from a container.
+
+    If mmap is True, uncompressed chunks are memory mapped (read-only) instead of read.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(path, "rb") as f:
+            index = _read_index(f)
+        self.kind = index["kind"]
+        self.attrs = index["attrs"]
+        self._arrays = index["arrays"]
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def rows(self, name):
+        """Total number of rows of an array."""
+        return sum(chunk["rows"] for chunk in self._arrays[name]["chunks"])
+
+    def _read_chunk(self, entry, chunk):
+        dtype = np.dtype(entry["dtype"])
+        shape = (chunk["rows"], *entry["shape"])
+        if chunk["rows"] == 0:
+            return np.empty(shape, dtype)
+        if chunk["compression"] is None and self.mmap:
+            return np.memmap(self.path, dtype=dtype, mode="r", offset=chunk["offset"], shape=shape)
+        with open(self.path, "rb") as f:
+            f.seek(chunk["offset"])
+            data = f.read(chunk["nbytes"])
+        if chunk["compression"] == "zlib":
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def read(self, name, start=None, stop=None):
+        """
+        Read rows [start, stop) of an array, only touching the chunks that contain them.
+
+        If all the rows come from a single memory mapped chunk, no data is copied.
+        """
+        entry = self._arrays[name]
+        start, stop, _ = slice(start, stop).indices(self.rows(name))
+        parts = []
+        chunk_start = 0
+        for chunk in entry["chunks"]:
+            chunk_stop = chunk_start + chunk["rows"]
+            if chunk_stop > start and chunk_start < stop:
+                data = self._read_chunk(entry, chunk)
+                parts.append(data[max(start - chunk_start, 0) : stop - chunk_start])
+            chunk_start = chunk_stop
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.empty((0, *entry["shape"]), np.dtype(entry["dtype"]))
+        return np.concatenate(parts)
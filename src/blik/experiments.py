@@ -0,0 +1,347 @@
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from napari.layers import Image, Labels, Points, Shapes, Vectors
+
+from .chunked import ChunkedArray
+from .index import read_experiment_ids, read_index
+from .reader import MRC_SUFFIXES, read_layers, read_mrc_mmap
+from .utils import layer_tuples_to_layers
+
+DEFAULT_MAX_EXPERIMENTS = 5
+DEFAULT_MAX_BYTES = 8 * 1024**3
+# hidden experiments are only moved out of memory if a budget is set
+DEFAULT_MAX_HIDDEN_BYTES = None
+
+
+def _array_nbytes(data):
+    if isinstance(data, (list, tuple)):
+        return sum(_array_nbytes(d) for d in data)
+    if isinstance(data, ChunkedArray):
+        return data.nbytes
+    if isinstance(data, np.memmap) or not isinstance(data, np.ndarray):
+        # pages of memory maps are managed (and dropped) by the OS, and lazy arrays are not resident
+        return 0
+    return int(data.nbytes)
+
+
+def _layer_arrays(layer):
+    if getattr(layer, "multiscale", False):
+        return list(layer.data)
+    return layer.data
+
+
+def layer_nbytes(layer):
+    """Approximate memory used by the data (and features) of a layer."""
+    nbytes = _array_nbytes(_layer_arrays(layer))
+    features = getattr(layer, "features", None)
+    if features is not None and len(features.columns):
+        nbytes += int(features.memory_usage(deep=True).sum())
+    return nbytes
+
+
+def _mark_modified(layer):
+    """flag the layer as modified on user edits, so it is never released."""
+
+    def _on_edit():
+        layer.metadata["modified"] = True
+
+    if isinstance(layer, (Points, Shapes)):
+        layer.events.data.connect(_on_edit)
+    if isinstance(layer, Points):
+        layer.events.features.connect(_on_edit)
+    if isinstance(layer, Labels):
+        layer.events.paint.connect(_on_edit)
+
+
+class ExperimentStore:
+    """
+    Placeholders for experiments whose data is only read when needed.
+
+    Registering paths only records which experiment ids they contain. The data of an
+    experiment is read when it is loaded, and released again once it is not among the
+    max_experiments most recently loaded or the loaded data exceeds max_bytes.
+    Experiments with layers that were edited after loading are never released.
+    """
+
+    def __init__(self, max_experiments=DEFAULT_MAX_EXPERIMENTS, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_experiments = max_experiments
+        self.max_bytes = max_bytes
+        # experiment_id -> list of (path, read kwargs)
+        self._sources = {}
+        # experiment_id -> list of layers, in order of use
+        self._loaded = OrderedDict()
+        # called with the list of new experiment ids after registering
+        self.on_register = []
+
+    def __contains__(self, exp_id):
+        return exp_id in self._sources
+
+    @property
+    def experiment_ids(self):
+        return sorted(self._sources)
+
+    def is_loaded(self, exp_id):
+        return exp_id in self._loaded
+
+    def loaded_layers(self, exp_id):
+        return list(self._loaded.get(exp_id, []))
+
+    def register(self, exp_id, path, **read_kwargs):
+        """Register a path as a source of data for an experiment."""
+        sources = self._sources.setdefault(exp_id, [])
+        source = (Path(path), read_kwargs)
+        if source not in sources:
+            sources.append(source)
+
+    def _registered(self, exp_ids):
+        exp_ids = sorted(exp_ids)
+        for callback in list(self.on_register):
+            callback(exp_ids)
+        return exp_ids
+
+    def register_paths(self, *paths, **read_kwargs):
+        """
+        Find the experiments contained in paths and register them without loading any data.
+
+        Only headers and metadata are read (see blik.index). Paths can also be dataset manifests,
+        which are registered directly. read_kwargs are passed to read_layers when the experiments
+        are loaded. Returns the registered experiment ids.
+        """
+        exp_ids = set()
+        for path in paths:
+            if Path(path).suffix == ".csv":
+                exp_ids.update(self._register_index(read_index(path), **read_kwargs))
+                continue
+            for exp_id in read_experiment_ids(path, read_kwargs.get("name_regex")):
+                self.register(exp_id, path, **read_kwargs)
+                exp_ids.add(exp_id)
+        return self._registered(exp_ids)
+
+    def _register_index(self, index, **read_kwargs):
+        for exp_id, file in zip(index["experiment_id"], index["file"]):
+            self.register(exp_id, file, **read_kwargs)
+        return set(index["experiment_id"])
+
+    def register_index(self, index, **read_kwargs):
+        """Register all the files of a dataset manifest (as returned by blik.index.build_index)."""
+        return self._registered(self._register_index(index, **read_kwargs))
+
+    def load(self, exp_id):
+        """
+        Mark an experiment as most recently used, reading its data if it is not loaded yet.
+
+        Returns the newly created layers (empty if the experiment was already loaded).
+        """
+        if exp_id in self._loaded:
+            self._loaded.move_to_end(exp_id)
+            return []
+
+        layers = []
+        for path, read_kwargs in self._sources.get(exp_id, []):
+            layer_tuples = read_layers(path, experiment_ids=[exp_id], **read_kwargs) or []
+            layers.extend(layer_tuples_to_layers(layer_tuples))
+        for layer in layers:
+            _mark_modified(layer)
+        self._loaded[exp_id] = layers
+        return layers
+
+    def release(self, exp_id):
+        """Forget the loaded data of an experiment, returning the layers that can be removed."""
+        layers = self._loaded.pop(exp_id, [])
+        if any(lay.metadata.get("modified", False) for lay in layers):
+            # edits would be lost, so the experiment stays loaded for good and is no longer managed here
+            self._sources.pop(exp_id, None)
+            return []
+        return layers
+
+    def loaded_nbytes(self):
+        """Approximate memory used by each loaded experiment."""
+        return {exp_id: sum(layer_nbytes(lay) for lay in layers) for exp_id, layers in self._loaded.items()}
+
+    def evict(self):
+        """
+        Release least recently used experiments until within budget, returning the layers to remove.
+
+        The most recently loaded experiment is never released.
+        """
+        released = []
+        nbytes = self.loaded_nbytes()
+        total = sum(nbytes.values())
+        for exp_id in list(self._loaded)[:-1]:
+            if len(self._loaded) <= self.max_experiments and total <= self.max_bytes:
+                break
+            total -= nbytes[exp_id]
+            released.extend(self.release(exp_id))
+        return released
+
+
+class LayerSpill:
+    """
+    Move the data of hidden layers out of memory, within a memory budget (None disables it).
+
+    Image and labels data which was not edited since it was read from an mrc file is
+    replaced by a copy-on-write memory map of that file, so nothing is written. Other
+    image and labels data (e.g. unsaved edits) is saved to .npy files in directory and
+    replaced by copy-on-write memory maps of them, so the layers keep working (and any edit
+    is kept) while the OS only keeps in memory the pages that are used. Vectors data (which
+    napari always copies) is saved and emptied. Restoring reads the data back into memory
+    and deletes the files. Data that is already lazy (memory maps, dask arrays) is left alone.
+    If no directory is given, files go to a temporary directory removed at exit.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_HIDDEN_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self._directory = Path(directory) if directory is not None else None
+        # layer -> (paths of the spilled arrays, bytes spilled)
+        self._spilled = {}
+        # experiment ids, least recently selected first
+        self._recent = OrderedDict()
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            self._directory = Path(tempfile.mkdtemp(prefix="blik-spill-"))
+            weakref.finalize(self, shutil.rmtree, self._directory, ignore_errors=True)
+        return self._directory
+
+    def is_spilled(self, layer):
+        return layer in self._spilled
+
+    def spilled_nbytes(self, layer):
+        return self._spilled.get(layer, ((), 0))[1]
+
+    def track(self, layer):
+        """Flag the layer as modified on edits, so its data is never replaced by its source file."""
+        if isinstance(layer, Labels) and not layer.metadata.get("spill_tracked", False):
+            layer.metadata["spill_tracked"] = True
+            _mark_modified(layer)
+
+    def _save(self, arr):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".npy", delete=False) as f:
+            np.save(f, arr)
+        return f.name
+
+    @staticmethod
+    def _source_mmap(layer, data):
+        """Memory map of the mrc file the (unedited) data of layer was read from, or None."""
+        # painting is only noticed on tracked labels; images are never edited in place
+        untracked = isinstance(layer, Labels) and not layer.metadata.get("spill_tracked", False)
+        if untracked or layer.metadata.get("modified", False):
+            return None
+        source = Path(str(layer.metadata.get("source", "")))
+        if source.suffix not in MRC_SUFFIXES or not source.is_file():
+            return None
+        try:
+            mmap = read_mrc_mmap(source)[0].data
+        except (OSError, ValueError):
+            return None
+        if mmap.shape != data.shape or mmap.dtype != data.dtype:
+            return None
+        return mmap
+
+    def spill(self, layer):
+        """Move the data of a layer out of memory, returning how many bytes were freed."""
+        if layer in self._spilled or not isinstance(layer, (Image, Labels, Vectors)):
+            return 0
+        arrays = _layer_arrays(layer)
+        nbytes = _array_nbytes(arrays)
+        in_memory = all(isinstance(arr, np.ndarray) for arr in (arrays if isinstance(arrays, list) else [arrays]))
+        if not nbytes or not in_memory:
+            # chunked segmentations only hold what was painted
+            return 0
+        if isinstance(layer, Vectors):
+            # colors are per vector, so emptying the data drops them as well
+            paths = [self._save(layer.data), self._save(layer.edge_color)]
+            layer.data = np.empty((0, 2, layer.data.shape[-1]))
+        elif not isinstance(arrays, list) and (mmap := self._source_mmap(layer, arrays)) is not None:
+            # unedited data can be read back from its source file
+            paths = []
+            layer.data = mmap
+        else:
+            multiscale = isinstance(arrays, list)
+            arrays = arrays if multiscale else [arrays]
+            paths = [self._save(arr) for arr in arrays]
+            mmaps = [np.load(path, mmap_mode="c") for path in paths]
+            layer.data = mmaps if multiscale else mmaps[0]
+        self._spilled[layer] = (paths, nbytes)
+        return nbytes
+
+    def restore(self, layer):
+        """Read the data of a spilled layer back into memory."""
+        if layer not in self._spilled:
+            return
+        paths, _ = self._spilled.pop(layer)
+        if isinstance(layer, Vectors):
+            # vectors regenerated meanwhile (e.g. by edits to their particles) are more recent
+            if not len(layer.data):
+                layer.data = np.load(paths[0])
+                layer.edge_color = np.load(paths[1])
+        else:
+            # copying the memory maps also picks up edits made while spilled
+            arrays = _layer_arrays(layer)
+            layer.data = [np.array(arr) for arr in arrays] if isinstance(arrays, list) else np.array(arrays)
+        self._remove_files(paths)
+
+    def discard(self, layer):
+        """Forget a spilled layer (e.g. after removing it from the viewer), deleting its files."""
+        paths, _ = self._spilled.pop(layer, ((), 0))
+        self._remove_files(paths)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                # still memory mapped on some platforms; it lives in a cache directory anyways
+                pass
+
+    def select(self, exp_id, layers_by_exp):
+        """
+        Restore the layers of the selected experiment, then spill hidden experiments until within budget.
+
+        layers_by_exp maps each experiment id to its layers. Least recently selected
+        experiments are spilled first. Returns the layers that were spilled.
+        """
+        for layer in layers_by_exp.get(exp_id, ()):
+            self.restore(layer)
+        self._recent.pop(exp_id, None)
+        self._recent[exp_id] = None
+        if self.max_bytes is None:
+            return []
+
+        order = {exp: i for i, exp in enumerate(self._recent)}
+        # never selected experiments go first
+        hidden = sorted((exp for exp in layers_by_exp if exp != exp_id), key=lambda exp: order.get(exp, -1))
+        nbytes = {exp: sum(layer_nbytes(lay) for lay in layers_by_exp[exp]) for exp in hidden}
+        total = sum(nbytes.values())
+        spilled = []
+        for exp in hidden:
+            if total <= self.max_bytes:
+                break
+            for layer in layers_by_exp[exp]:
+                if not layer.visible:
+                    freed = self.spill(layer)
+                    if freed:
+                        total -= freed
+                        spilled.append(layer)
+        for exp in list(self._recent):
+            if exp not in layers_by_exp:
+                del self._recent[exp]
+        return spilled
+
+    def memory_usage(self, layers_by_exp):
+        """Memory used by each experiment, and how much of its data was spilled to disk."""
+        return {
+            exp: (sum(layer_nbytes(lay) for lay in layers), sum(self.spilled_nbytes(lay) for lay in layers))
+            for exp, layers in layers_by_exp.items()
+        }
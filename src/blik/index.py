@@ -0,0 +1,242 @@
+"""
+Index a dataset directory into a manifest of which files belong to which experiment.
+
+Only headers and metadata are read: mrc headers, the experiment column of particle
+tables, and the index of blik containers. The manifest is a csv file with one row per
+experiment and file, and is updated incrementally: files whose size and modification
+time did not change since the last scan are not read again.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mrcfile
+import numpy as np
+import pandas as pd
+from cryohub.reading.main import known_formats
+from cryohub.utils.constants import Dynamo, Relion
+from cryohub.utils.generic import ParseError, guess_name
+from cryotypes.image import ImageProtocol
+from dynamotable.utils import generate_column_names
+
+from .container import ContainerReader, is_container
+from .reader import (
+    MRC_SUFFIXES,
+    _read_path,
+    _scan_star,
+    read_surface,
+    read_surface_picks,
+)
+from .utils import atomic_write, get_workers
+
+MANIFEST_NAME = "blik_index.csv"
+MANIFEST_COLUMNS = [
+    "experiment_id",
+    "file",
+    "type",
+    "shape",
+    "pixel_spacing",
+    "particle_count",
+    "mtime",
+    "size",
+]
+INDEX_SUFFIXES = (*known_formats, ".picks", ".surf")
+
+
+def _row(exp_id, kind, shape=None, pixel_spacing=None, particle_count=None):
+    return {
+        "experiment_id": str(exp_id),
+        "type": kind,
+        "shape": None if shape is None else "x".join(str(s) for s in shape),
+        "pixel_spacing": pixel_spacing,
+        "particle_count": particle_count,
+    }
+
+
+def _index_mrc(path, name_regex=None):
+    with mrcfile.open(path, header_only=True, permissive=True) as mrc:
+        shape = mrcfile.utils.data_shape_from_header(mrc.header)
+        dtype = mrcfile.utils.data_dtype_from_header(mrc.header)
+        pixel_size = float(mrc.voxel_size.x)
+    # same rule as read_layers: 8 bit integer images are segmentations
+    kind = "segmentation" if np.issubdtype(dtype, np.integer) and dtype.itemsize == 1 else "image"
+    return [_row(guess_name(path, name_regex), kind, shape, pixel_size or None)]
+
+
+def _index_star(path, name_regex=None):
+    columns, offset, optics = _scan_star(path)
+    exp_col = next((col for col in (*Relion.MICROGRAPH_NAME_HEADER.values(), "experiment_id") if col in columns), None)
+    pixel_col = next((col for col in Relion.PIXEL_SIZE_HEADER.values() if col in columns), None)
+    usecols = [col for col in (exp_col, pixel_col) if col is not None] or [columns[0]]
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        df = pd.read_csv(f, sep=r"\s+", header=None, names=columns, usecols=usecols, comment="#")
+
+    if exp_col is None:
+        df["experiment_id"] = None
+        exp_col = "experiment_id"
+    pixel_size = None
+    if pixel_col is None and optics is not None:
+        pixel_col = next((col for col in Relion.PIXEL_SIZE_HEADER.values() if col in optics.columns), None)
+        if pixel_col is not None:
+            pixel_size = float(optics[pixel_col].iloc[0])
+            pixel_col = None
+
+    rows = []
+    for exp, exp_df in df.groupby(exp_col, dropna=False, sort=False):
+        if pixel_col is not None:
+            pixel_size = float(exp_df[pixel_col].iloc[0])
+        exp_id = guess_name(None if pd.isnull(exp) else exp, name_regex)
+        rows.append(_row(exp_id, "particles", pixel_spacing=pixel_size, particle_count=len(exp_df)))
+    return rows
+
+
+def _index_tbl(path, name_regex=None):
+    # the tomogram index (column 20) is the experiment id
+    tomo_col = generate_column_names(20).index(Dynamo.EXP_ID_HEADER)
+    tomo = pd.read_csv(path, sep=r"\s+", header=None, usecols=[tomo_col]).iloc[:, 0]
+    rows = []
+    for exp_id, count in tomo.value_counts(sort=False).items():
+        if name_regex:
+            exp_id = guess_name(exp_id, name_regex)
+        rows.append(_row(exp_id, "particles", particle_count=int(count)))
+    return rows
+
+
+def _index_picks(path):
+    if is_container(path):
+        attrs = ContainerReader(path).attrs
+        return [_row(attrs["experiment_id"], "picks", pixel_spacing=attrs["scale"][0])]
+    layer = read_surface_picks(path)
+    return [_row(layer[1]["metadata"]["experiment_id"], "picks", pixel_spacing=layer[1]["scale"][0])]
+
+
+def _index_surf(path):
+    if is_container(path):
+        reader = ContainerReader(path)
+        attrs = reader.attrs
+        shape = (reader.rows("vertices"), 3)
+        return [_row(attrs["experiment_id"], "surface", shape=shape, pixel_spacing=attrs["scale"][0])]
+    layer = read_surface(path)
+    exp_id = layer[1]["metadata"]["experiment_id"]
+    return [_row(exp_id, "surface", shape=layer[0][0].shape, pixel_spacing=layer[1]["scale"][0])]
+
+
+def _index_other(path, name_regex=None):
+    """Fall back to a lazy read through cryohub for other formats."""
+    rows = []
+    for obj in _read_path(path, name_regex=name_regex, lazy=True):
+        if isinstance(obj, ImageProtocol):
+            rows.append(_row(obj.experiment_id, "image", obj.data.shape, obj.pixel_spacing or None))
+        else:
+            rows.append(
+                _row(
+                    obj.experiment_id,
+                    "particles",
+                    pixel_spacing=obj.pixel_spacing or None,
+                    particle_count=len(obj.position),
+                )
+            )
+    return rows
+
+
+def index_file(path, name_regex=None):
+    """
+    Read the metadata of a single file, returning one row (dict) per experiment it contains.
+
+    Files which cannot be parsed result in no rows.
+    """
+    path = Path(path)
+    try:
+        if path.suffix in MRC_SUFFIXES:
+            rows = _index_mrc(path, name_regex)
+        elif path.suffix == ".star":
+            rows = _index_star(path, name_regex)
+        elif path.suffix == ".tbl":
+            rows = _index_tbl(path, name_regex)
+        elif path.suffix == ".picks":
+            rows = _index_picks(path)
+        elif path.suffix == ".surf":
+            rows = _index_surf(path)
+        else:
+            rows = _index_other(path, name_regex)
+    except (ParseError, ValueError, OSError, KeyError):
+        return []
+    stat = path.stat()
+    for row in rows:
+        row.update(file=str(path), mtime=stat.st_mtime_ns, size=stat.st_size)
+    return rows
+
+
+def read_experiment_ids(path, name_regex=None):
+    """
+    Find which experiment ids a file contains, reading only headers and metadata (see index_file).
+
+    Ids are strings, as in manifests.
+    """
+    path = Path(path)
+    if path.suffix in (".zarr", ".journal"):
+        layer_tuples = _read_path(path, name_regex=name_regex, contrast_limits=False)
+        return sorted({str(lt[1]["metadata"]["experiment_id"]) for lt in layer_tuples})
+    return sorted({row["experiment_id"] for row in index_file(path, name_regex)})
+
+
+def read_index(manifest):
+    """Read a manifest, with file paths made absolute."""
+    manifest = Path(manifest)
+    df = pd.read_csv(manifest, dtype={"experiment_id": str, "file": str, "type": str, "shape": str})
+    df["file"] = [str((manifest.parent / file).resolve()) for file in df["file"]]
+    return df
+
+
+def build_index(root, manifest=None, name_regex=None, workers=None, rebuild=False):
+    """
+    Scan a directory tree in parallel and write (or update) its manifest.
+
+    manifest: path of the csv manifest (default: blik_index.csv in root). If it already
+              exists, only new or changed files are read. Use rebuild if name_regex changed.
+    workers: number of files to read concurrently (None uses all cores).
+
+    Returns the manifest as a dataframe, with absolute file paths.
+    """
+    root = Path(root)
+    manifest = Path(manifest) if manifest is not None else root / MANIFEST_NAME
+
+    paths = sorted(path for path in root.rglob("*") if path.suffix in INDEX_SUFFIXES and path.is_file())
+
+    old = pd.DataFrame(columns=MANIFEST_COLUMNS)
+    if manifest.exists() and not rebuild:
+        old = read_index(manifest)
+
+    # reuse rows of files which did not change since the last scan
+    known = {
+        (file, mtime, size): rows
+        for (file, mtime, size), rows in old.groupby(["file", "mtime", "size"], sort=False)
+    }
+    rows = []
+    to_index = []
+    for path in paths:
+        stat = path.stat()
+        previous = known.get((str(path.resolve()), stat.st_mtime_ns, stat.st_size))
+        if previous is None:
+            to_index.append(path)
+        else:
+            rows.extend(previous.to_dict("records"))
+
+    workers = get_workers(workers, len(to_index))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for file_rows in pool.map(lambda path: index_file(path, name_regex), to_index):
+            rows.extend(file_rows)
+
+    df = pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+    df["file"] = [str(Path(file).resolve()) for file in df["file"]]
+    df = df.sort_values(["experiment_id", "file"], ignore_index=True)
+
+    # store paths relative to the manifest, so the dataset can be moved
+    to_write = df.assign(file=[os.path.relpath(file, manifest.parent) for file in df["file"]])
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(manifest, "w", newline="") as f:
+        to_write.to_csv(f, index=False)
+    return df
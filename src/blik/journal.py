@@ -0,0 +1,219 @@
+"""
+Append-only journal of the edits made to a points or shapes layer.
+
+Each record holds a small json header (operation, indices, attrs) and a npz payload with
+the affected rows, framed by a fixed-size preamble with the sizes and a crc32 checksum:
+    preamble: magic (4 bytes), header size, payload size, crc32 (uint32)
+
+The first record is always a full snapshot of the layer (a "reset"); all the following
+ones only contain the rows that were added, removed or changed. Compacting writes a new
+journal with a single snapshot, replacing the old one atomically. When replaying, a
+truncated or corrupted record (e.g. from a crash while writing) ends the journal.
+"""
+
+import io
+import json
+import struct
+import warnings
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .utils import atomic_write, column_to_array
+from .writer import write_particles_relion_40, write_surface_picks
+
+MAGIC = b"BJRN"
+_PREAMBLE = struct.Struct("<4sIII")
+
+
+def _pack_rows(kind, data=None, features=None):
+    """Serialize layer rows (points or lines of shapes) and their features into npz bytes."""
+    arrays = {}
+    if data is not None:
+        if kind == "shapes":
+            lines = [np.asarray(line, dtype=float) for line in data]
+            arrays["lengths"] = np.array([len(line) for line in lines], dtype=np.int64)
+            arrays["data"] = np.concatenate(lines) if lines else np.empty((0, 3))
+        else:
+            arrays["data"] = np.asarray(data, dtype=float)
+    columns = []
+    if features is not None:
+        for i, col in enumerate(features.columns):
+            arr = column_to_array(features[col])
+            if arr is None:
+                arr = features[col].astype(str).to_numpy(dtype=str)
+            arrays[f"features/{i}"] = arr
+            columns.append(str(col))
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue(), columns if features is not None else None
+
+
+def _unpack_rows(kind, payload, columns):
+    with np.load(io.BytesIO(payload), allow_pickle=False) as arrays:
+        data = None
+        if "data" in arrays:
+            data = arrays["data"]
+            if kind == "shapes":
+                data = np.split(data, np.cumsum(arrays["lengths"])[:-1]) if len(arrays["lengths"]) else []
+        features = None
+        if columns is not None:
+            features = pd.DataFrame({col: arrays[f"features/{i}"] for i, col in enumerate(columns)})
+    return data, features
+
+
+def _record(kind, op, indices=None, data=None, features=None, attrs=None):
+    payload, columns = _pack_rows(kind, data, features)
+    header = {
+        "kind": kind,
+        "op": op,
+        "indices": None if indices is None else [int(i) for i in indices],
+        "columns": columns,
+    }
+    if attrs is not None:
+        header["attrs"] = attrs
+    header = json.dumps(header).encode()
+    crc = zlib.crc32(payload, zlib.crc32(header))
+    return _PREAMBLE.pack(MAGIC, len(header), len(payload), crc) + header + payload
+
+
+class Journal:
+    """
+    Journal of the edits of a layer, stored at path.
+
+    kind is "points" or "shapes". Rows are tracked so that additions (which napari reports
+    without indices) can be journaled as the rows appended since the last record.
+    """
+
+    def __init__(self, path, kind):
+        if kind not in ("points", "shapes"):
+            raise ValueError(f"cannot journal {kind} layers")
+        self.path = Path(path)
+        self.kind = kind
+        self.rows = 0
+        self.records = 0
+
+    def _append(self, record):
+        with open(self.path, "ab") as f:
+            f.write(record)
+        self.records += 1
+
+    def reset(self, data, features=None, attrs=None):
+        """Start a new journal with a snapshot of the whole layer, replacing the old one atomically."""
+        record = _record(self.kind, "reset", data=data, features=features, attrs=attrs or {})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path) as f:
+            f.write(record)
+        self.rows = len(data)
+        self.records = 1
+
+    def add(self, data, features=None):
+        """Journal rows appended at the end."""
+        self._append(_record(self.kind, "add", data=data, features=features))
+        self.rows += len(data)
+
+    def remove(self, indices):
+        self._append(_record(self.kind, "remove", indices=indices))
+        self.rows -= len(set(indices))
+
+    def change(self, indices, data, features=None):
+        self._append(_record(self.kind, "change", indices=indices, data=data, features=features))
+
+    def set_features(self, features):
+        """Journal a replacement of all the features (e.g. after rotating particles)."""
+        self._append(_record(self.kind, "features", features=features))
+
+
+def _read_records(path):
+    with open(path, "rb") as f:
+        while preamble := f.read(_PREAMBLE.size):
+            if len(preamble) < _PREAMBLE.size:
+                warnings.warn(f"ignoring truncated record at the end of {path}", stacklevel=3)
+                return
+            magic, header_size, payload_size, crc = _PREAMBLE.unpack(preamble)
+            header = f.read(header_size)
+            payload = f.read(payload_size)
+            truncated = len(header) < header_size or len(payload) < payload_size
+            if magic != MAGIC or truncated or zlib.crc32(payload, zlib.crc32(header)) != crc:
+                warnings.warn(f"ignoring corrupted or truncated records at the end of {path}", stacklevel=3)
+                return
+            yield json.loads(header), payload
+
+
+def replay_journal(path):
+    """
+    Rebuild the kind ("points" or "shapes"), data, features and attrs of a layer from its journal.
+
+    Data is an array of points, or a list of lines for shapes.
+    """
+    data = None
+    features = None
+    attrs = {}
+    for header, payload in _read_records(path):
+        kind = header["kind"]
+        rows, rows_features = _unpack_rows(kind, payload, header["columns"])
+        op = header["op"]
+        indices = header["indices"]
+        if op == "reset":
+            data = rows if kind == "shapes" else np.asarray(rows)
+            features = rows_features
+            attrs = header.get("attrs", {})
+        elif data is None:
+            raise ValueError(f"{path} does not start with a snapshot")
+        elif op == "add":
+            data = [*data, *rows] if kind == "shapes" else np.concatenate([data, rows])
+            if features is not None and rows_features is not None:
+                features = pd.concat([features, rows_features], ignore_index=True)
+        elif op == "remove":
+            keep = np.ones(len(data), dtype=bool)
+            keep[indices] = False
+            data = [line for line, k in zip(data, keep) if k] if kind == "shapes" else data[keep]
+            if features is not None:
+                features = features[keep].reset_index(drop=True)
+        elif op == "change":
+            if kind == "shapes":
+                data = list(data)
+                for i, line in zip(indices, rows):
+                    data[i] = line
+            else:
+                data = data.copy()
+                data[indices] = rows
+            if features is not None and rows_features is not None:
+                features = features.copy()
+                for col in features.columns:
+                    features.loc[indices, col] = rows_features[col].to_numpy()
+        elif op == "features":
+            features = rows_features
+    if data is None:
+        raise ValueError(f"{path} does not contain any records")
+    return kind, data, features, attrs
+
+
+def layer_attrs(attributes):
+    """The json-serializable layer attributes needed to recover a layer from its journal."""
+    metadata = attributes["metadata"]
+    attrs = {
+        "name": attributes["name"],
+        "scale": np.asarray(attributes["scale"], dtype=float).tolist(),
+        "metadata": {key: str(metadata[key]) for key in ("experiment_id", "p_id", "source") if key in metadata},
+    }
+    if "edge_color_cycle" in attributes:
+        attrs["edge_color_cycle"] = np.asarray(attributes["edge_color_cycle"], dtype=float).tolist()
+    return attrs
+
+
+def compact_journal(journal, layer_data, output):
+    """
+    Write the layer to its final file (.star for points, .picks for shapes), and restart its journal.
+
+    layer_data is a layer data tuple, as returned by layer.as_layer_data_tuple().
+    """
+    data, attributes, layer_type = layer_data
+    if layer_type == "shapes":
+        write_surface_picks(output, data, attributes)
+    else:
+        write_particles_relion_40(output, [layer_data])
+    journal.reset(data, attributes.get("features"), layer_attrs(attributes))
+    return output
@@ -0,0 +1,280 @@
+"""
+Read and write images and segmentations as OME-Zarr (version 0.5, on zarr v3).
+
+zarr is an optional dependency (pip install "blik[zarr]"). Data is stored in chunks,
+so it can be loaded lazily and only the chunks that changed are rewritten on save.
+Lower resolution levels are stored alongside the full resolution data and read as a
+multiscale layer. Blik metadata is stored in the "blik" group attribute.
+"""
+
+from pathlib import Path
+
+import dask
+import dask.array as da
+import numpy as np
+from cryohub.utils.generic import guess_name
+from packaging.version import parse as parse_version
+
+from .chunked import ChunkedArray
+from .utils import estimate_contrast_limits, generate_pyramid, pyramid_factors
+
+OME_ZARR_VERSION = "0.5"
+DEFAULT_CHUNKS = (64, 64, 64)
+PYRAMID_FACTORS = (2, 4, 8)
+DEFAULT_LEVELS = len(PYRAMID_FACTORS)
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError('zarr support requires zarr>=3: pip install "blik[zarr]"') from e
+    if parse_version(zarr.__version__).major < 3:
+        raise ImportError(f'zarr support requires zarr>=3, found {zarr.__version__}: pip install "blik[zarr]"')
+    return zarr
+
+
+def _compressors(zarr, compression, compression_level):
+    if compression is None:
+        return None
+    return [zarr.codecs.BloscCodec(cname=compression, clevel=compression_level, shuffle="bitshuffle")]
+
+
+def _write_chunk(target, region, block, compare):
+    if compare and np.array_equal(target[region], block):
+        return 0
+    target[region] = block
+    return 1
+
+
+def _array_location(arr):
+    root = getattr(arr.store, "root", None)
+    return (str(Path(root).resolve()) if root is not None else id(arr.store)), arr.path
+
+
+def _reads_from(data, target):
+    """Whether computing the dask array data reads from the zarr array target."""
+    zarr = _import_zarr()
+    location = _array_location(target)
+    return any(
+        isinstance(value, zarr.Array) and _array_location(value) == location
+        for value in dict(data.__dask_graph__()).values()
+    )
+
+
+def _write_level(group, name, data, chunks, compressors):
+    """
+    Write an array chunk by chunk, returning the number of chunks written.
+
+    If an array with the same shape, dtype and chunks already exists, chunks whose
+    content did not change are left untouched.
+    """
+    zarr = _import_zarr()
+    chunks = tuple(min(c, s) for c, s in zip(chunks, data.shape))
+    data = da.asarray(data).rechunk(chunks)
+
+    target = group.get(name)
+    compare = (
+        isinstance(target, zarr.Array)
+        and target.shape == data.shape
+        and target.dtype == data.dtype
+        and target.chunks == chunks
+    )
+    if not compare:
+        if isinstance(target, zarr.Array) and _reads_from(data, target):
+            # overwriting would delete the data while it is being read
+            raise ValueError(
+                f"cannot change the shape, dtype or chunks of {target.store_path} while saving data read from it;"
+                " save to a different path, or keep the same chunks"
+            )
+        target = group.create_array(
+            name,
+            shape=data.shape,
+            dtype=data.dtype,
+            chunks=chunks,
+            compressors=compressors,
+            fill_value=0,
+            overwrite=True,
+        )
+
+    regions = da.core.slices_from_chunks(data.chunks)
+    blocks = data.to_delayed().ravel()
+    writes = [dask.delayed(_write_chunk)(target, region, block, compare) for region, block in zip(regions, blocks)]
+    return sum(dask.compute(*writes))
+
+
+def _downsample_labels(data, factors, stack=False):
+    """Downsample labels by striding, since averaging would create non-existing labels."""
+    levels = [data]
+    for factor in pyramid_factors(data.shape, factors, stack=stack):
+        step = (slice(None),) * int(stack) + (slice(None, None, factor),) * (data.ndim - int(stack))
+        levels.append(data[step])
+    return levels
+
+
+def _multiscales_attrs(name, ndim, pixel_spacing, factors, stack):
+    axes = [{"name": ax, "type": "space", "unit": "angstrom"} for ax in "zyx"[-ndim:]]
+    datasets = []
+    for i, factor in enumerate((1, *factors)):
+        scale = [float(pixel_spacing * factor)] * ndim
+        if stack:
+            # the stack axis is not binned
+            scale[0] = float(pixel_spacing)
+        datasets.append({"path": str(i), "coordinateTransformations": [{"type": "scale", "scale": scale}]})
+    return [{"name": name, "axes": axes, "datasets": datasets}]
+
+
+def _write_zarr(path, data, attributes, labels, chunks, compression, compression_level, levels):
+    zarr = _import_zarr()
+    if "experiment_id" not in attributes["metadata"]:
+        raise ValueError(
+            "cannot write a layer that does not have blik metadata. Add it to an experiment!"
+        )
+    path = Path(path)
+    if path.suffix != ".zarr":
+        path = path.with_name(path.name + ".zarr")
+    if isinstance(data, list):
+        # multiscale: levels are regenerated from the full resolution data
+        data = data[0]
+    if isinstance(data, ChunkedArray):
+        # read chunk by chunk, instead of densifying it as a single block
+        data = da.from_array(data, chunks=data.chunks)
+    data = da.asarray(data)
+    metadata = attributes["metadata"]
+    stack = metadata.get("stack", False)
+    if len(chunks) < data.ndim:
+        chunks = (*(data.shape[: data.ndim - len(chunks)]), *chunks)
+    chunks = tuple(chunks)[-data.ndim :]
+
+    factors = PYRAMID_FACTORS[:levels]
+    pyramid = _downsample_labels(data, factors, stack) if labels else generate_pyramid(data, factors, stack)
+    factors = factors[: len(pyramid) - 1]
+
+    group = zarr.open_group(path, mode="a")
+    compressors = _compressors(zarr, compression, compression_level)
+    written = _write_level(group, "0", pyramid[0], chunks, compressors)
+    for i, level in enumerate(pyramid[1:], 1):
+        existing = group.get(str(i))
+        # lower levels only change if the full resolution data did
+        if written or existing is None or existing.shape != level.shape or existing.dtype != level.dtype:
+            _write_level(group, str(i), level, chunks, compressors)
+    for i in range(len(pyramid), len(PYRAMID_FACTORS) + 1):
+        # leftovers of a previous save with more levels
+        if str(i) in group:
+            del group[str(i)]
+
+    ome = {
+        "version": OME_ZARR_VERSION,
+        "multiscales": _multiscales_attrs(attributes["name"], data.ndim, attributes["scale"][0], factors, stack),
+    }
+    if labels:
+        ome["image-label"] = {}
+    group.attrs.update(
+        {
+            "ome": ome,
+            "blik": {
+                "experiment_id": str(metadata["experiment_id"]),
+                "stack": bool(stack),
+                "source": str(metadata.get("source", "")),
+                "kind": "labels" if labels else "image",
+            },
+        }
+    )
+    return path
+
+
+def write_image_zarr(
+    path,
+    data,
+    attributes,
+    chunks=DEFAULT_CHUNKS,
+    compression="zstd",
+    compression_level=3,
+    levels=DEFAULT_LEVELS,
+):
+    """
+    Write an image as OME-Zarr, with up to `levels` binned lower resolution levels.
+
+    compression: blosc compressor name (e.g. "zstd", "lz4"), or None for no compression.
+    """
+    path = _write_zarr(path, data, attributes, False, chunks, compression, compression_level, levels)
+    return [str(path)]
+
+
+def write_labels_zarr(
+    path,
+    data,
+    attributes,
+    chunks=DEFAULT_CHUNKS,
+    compression="zstd",
+    compression_level=3,
+    levels=DEFAULT_LEVELS,
+):
+    """
+    Write a segmentation as OME-Zarr, with up to `levels` downsampled lower resolution levels.
+
+    Saving again to the same path only rewrites the chunks that changed, and empty
+    chunks are not stored at all.
+    compression: blosc compressor name (e.g. "zstd", "lz4"), or None for no compression.
+    """
+    path = _write_zarr(path, data, attributes, True, chunks, compression, compression_level, levels)
+    return [str(path)]
+
+
+def read_zarr(path, name_regex=None, multiscale=True, contrast_limits=True, **kwargs):
+    """
+    Read an OME-Zarr image or segmentation lazily into a layer tuple.
+
+    If multiscale, all the resolution levels stored in the file are used.
+    """
+    from .reader import construct_image_layer_tuple, construct_segmentation_layer_tuple
+
+    zarr = _import_zarr()
+    path = Path(path)
+    group = zarr.open_group(path, mode="r")
+    attrs = group.attrs.asdict()
+    # before 0.5 (zarr v2), the ome metadata was not namespaced
+    ome = attrs.get("ome", attrs)
+    datasets = ome["multiscales"][0]["datasets"]
+    levels = [da.from_zarr(group[dataset["path"]]) for dataset in datasets]
+    if not multiscale:
+        levels = levels[:1]
+    scale = next(
+        transform["scale"]
+        for transform in datasets[0].get("coordinateTransformations", [])
+        if transform["type"] == "scale"
+    )
+
+    blik = attrs.get("blik", {})
+    exp_id = blik.get("experiment_id") or guess_name(path, name_regex)
+    stack = blik.get("stack", False)
+    data = levels if len(levels) > 1 else levels[0]
+    labels = blik.get("kind", "labels" if "image-label" in ome else "image") == "labels"
+
+    if labels:
+        return [
+            construct_segmentation_layer_tuple(
+                data=data,
+                scale=scale[-1],
+                exp_id=exp_id,
+                stack=stack,
+                source=str(path),
+                multiscale=len(levels) > 1,
+            )
+        ]
+
+    image_kwargs = {}
+    histogram = None
+    if contrast_limits:
+        image_kwargs["contrast_limits"], histogram = estimate_contrast_limits(levels[-1])
+    layer = construct_image_layer_tuple(
+        data=data,
+        scale=scale[-1],
+        exp_id=exp_id,
+        stack=stack,
+        source=str(path),
+        **image_kwargs,
+    )
+    if histogram is not None:
+        layer[1]["metadata"]["histogram"] = histogram
+    return [layer]
@@ -1,19 +1,62 @@
+import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from importlib.metadata import version
 from pathlib import Path
 from uuid import uuid1
 
 import cryohub
+import mrcfile
 import numpy as np
 import pandas as pd
-from cryotypes.image import ImageProtocol
-from cryotypes.poseset import PoseSetProtocol
+from cryohub.reading.star import parse_relion_star
+from cryohub.utils.constants import Dynamo
+from cryohub.utils.generic import ParseError, get_columns_or_default, guess_name
+from cryohub.utils.star import merge_optics
+from cryohub.utils.types import PoseSet
+from cryotypes.image import Image, ImageProtocol, validate_image
+from cryotypes.poseset import PoseSetProtocol, validate_poseset
+from dynamotable.utils import generate_column_names
 from scipy.spatial.transform import Rotation
 
-from .utils import generate_vectors, invert_xyz
+from .cache import (
+    DEFAULT_CACHE_SIZE,
+    default_cache_dir,
+    load_image_stats,
+    load_posesets,
+    load_pyramid,
+    save_image_stats,
+    save_posesets,
+    save_pyramid,
+)
+from .container import ContainerReader, is_container
+from .journal import replay_journal
+from .ome_zarr import read_zarr
+from .utils import (
+    IDENTITY_QUAT,
+    ORIENTATION_COLS,
+    estimate_contrast_limits,
+    generate_pyramid,
+    generate_vectors,
+    get_quaternions,
+    get_workers,
+    invert_xyz,
+    pyramid_factors,
+    set_orientations,
+)
+
+# binning factors of the levels of multiscale images
+PYRAMID_FACTORS = (2, 4, 8)
+MRC_SUFFIXES = (".mrc", ".mrcs", ".st", ".map", ".rec")
+# pyramids being stored in the cache in the background, by cache dir, source and levels
+_pyramid_writes = {}
+_pyramid_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blik-pyramid-cache")
 
 def get_reader(path):
-    return read_layers
+    # the parse cache is opt-in for the napari reader, by setting BLIK_CACHE_DIR
+    cache_dir = default_cache_dir() if "BLIK_CACHE_DIR" in os.environ else None
+    return partial(read_layers, workers=None, cache_dir=cache_dir)
 
 
 def _construct_positions_layer(
@@ -22,9 +65,9 @@ def _construct_positions_layer(
     feat_defaults = (
         pd.DataFrame(features.iloc[-1].to_dict(), index=[0])
         if len(features)
-        else pd.DataFrame()
+        else pd.DataFrame(index=[0])
     )
-    feat_defaults["orientation"] = np.array(Rotation.identity(), dtype=object)
+    feat_defaults[ORIENTATION_COLS] = IDENTITY_QUAT
     if coords is not None:
         coords = invert_xyz(coords)
     return (
@@ -57,7 +100,7 @@ def _construct_orientations_layer(
         vec_data = None
         vec_color = "blue"
     else:
-        vec_data, vec_color = generate_vectors(coords, features["orientation"])
+        vec_data, vec_color = generate_vectors(coords, get_quaternions(features))
         vec_data = invert_xyz(vec_data)  # napari works in zyx order
     return (
         vec_data,
@@ -99,10 +142,8 @@ def construct_particle_layer_tuples(
     if features is None:
         features = pd.DataFrame()
 
-    if "orientation" not in features.columns:
-        features["orientation"] = np.array(
-            [] if coords is None else Rotation.identity(len(coords)), dtype=object
-        )
+    if not set(ORIENTATION_COLS).issubset(features.columns):
+        set_orientations(features, np.tile(IDENTITY_QUAT, (0 if coords is None else len(coords), 1)))
 
     # divide by scale top keep constant size. TODO: remove after vispy 0.12 which fixes this
     pos = _construct_positions_layer(
@@ -141,7 +182,9 @@ def read_particles(particles, name_suffix="particle"):
 
     px_size = particles.pixel_spacing
     if not px_size:
-        warnings.warn(f"unknown pixel spacing for particles '{particles.experiment_id}'; setting to 1 Angstrom.", stacklevel=2)
+        warnings.warn(
+            f"unknown pixel spacing for particles '{particles.experiment_id}'; setting to 1 Angstrom.", stacklevel=2
+        )
         px_size = 1
 
     if particles.shift is not None:
@@ -149,7 +192,7 @@ def read_particles(particles, name_suffix="particle"):
         shift_cols = ["shift_x", "shift_y", "shift_z"]
         features[shift_cols] = particles.shift
     if particles.orientation is not None:
-        features["orientation"] = np.asarray(particles.orientation, dtype=object)
+        set_orientations(features, particles.orientation)
 
     return construct_particle_layer_tuples(
         coords=coords,
@@ -169,10 +212,18 @@ def construct_image_layer_tuple(
     source="",
     **image_kwargs,
 ):
+    """
+    Constructs an image layer tuple from image data.
+
+    Data can also be a list of arrays of decreasing resolution, resulting in a multiscale layer.
+    """
+    multiscale = isinstance(data, list)
+    shape = data[0].shape if multiscale else data.shape
     return (
         data,
         {
             "name": f"{exp_id} - image",
+            "multiscale": multiscale,
             "scale": [scale] * 3,
             "metadata": {"experiment_id": exp_id, "stack": stack, "source": source},
             "interpolation2d": "spline36",
@@ -180,7 +231,7 @@ def construct_image_layer_tuple(
             "blending": "translucent",
             "projection_mode": "mean",
             "depiction": "plane",
-            "plane": {"thickness": 5, "position": np.array(data.shape) / 2},
+            "plane": {"thickness": 5, "position": np.array(shape) / 2},
             "rendering": "average",
             # "axis_labels": ('z', 'y', 'x'),
             "units": 'angstrom',
@@ -190,14 +241,88 @@ def construct_image_layer_tuple(
     )
 
 
-def read_image(image):
-    return construct_image_layer_tuple(
-        data=image.data,
+def _image_stats(image, data, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, **kwargs):
+    """Contrast limits and histogram of an image, using the cache if possible."""
+    source = Path(image.source)
+    use_cache = cache_dir is not None and source.is_file()
+    if use_cache:
+        stats = load_image_stats(cache_dir, source, **kwargs)
+        if stats is not None:
+            return stats
+    contrast_limits, histogram = estimate_contrast_limits(data)
+    if use_cache:
+        save_image_stats(cache_dir, source, contrast_limits, histogram, max_bytes=cache_size, **kwargs)
+    return contrast_limits, histogram
+
+
+def _save_pyramid_in_background(cache_dir, source, data, factors, stack, max_bytes):
+    """Store the binned levels of an image in the cache without blocking, for the next time it is opened."""
+    key = (str(Path(cache_dir).resolve()), str(source.resolve()), tuple(factors), stack)
+    if key in _pyramid_writes:
+        return _pyramid_writes[key]
+
+    def _save():
+        try:
+            save_pyramid(cache_dir, source, data, factors, stack=stack, max_bytes=max_bytes)
+        except Exception as e:
+            warnings.warn(f"could not cache the pyramid of {source}: {e}", stacklevel=1)
+        finally:
+            _pyramid_writes.pop(key, None)
+
+    future = _pyramid_writes[key] = _pyramid_writer.submit(_save)
+    return future
+
+
+def wait_for_cache_writes():
+    """Wait until the pyramids being stored in the cache in the background are written."""
+    wait(list(_pyramid_writes.values()))
+
+
+def read_image(image, multiscale=False, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, contrast_limits=True):
+    """
+    Convert an image into a napari layer tuple.
+
+    If multiscale, a pyramid of binned images is generated lazily, or loaded from cache_dir
+    if given (where it is stored in the background the first time, see wait_for_cache_writes).
+    If contrast_limits, these are estimated from a subsample of the data (or loaded from cache_dir),
+    and a histogram is added to the layer metadata.
+    """
+    data = image.data
+    if multiscale:
+        factors = pyramid_factors(data.shape, PYRAMID_FACTORS, stack=image.stack)
+        source = Path(image.source)
+        if cache_dir is not None and source.is_file():
+            levels = load_pyramid(cache_dir, source, factors, stack=image.stack)
+        else:
+            levels = None
+        if levels is not None:
+            data = [data, *levels]
+        else:
+            if cache_dir is not None and source.is_file():
+                # binning reads the whole volume, so it must not block opening it
+                _save_pyramid_in_background(cache_dir, source, data, factors, image.stack, cache_size)
+            data = generate_pyramid(data, factors, stack=image.stack)
+
+    image_kwargs = {}
+    if contrast_limits:
+        # the lowest resolution is good enough and way faster, but only if it is already stored:
+        # computing a lazy binned level reads the whole volume, while a strided sample does not
+        sample = data[-1] if multiscale and isinstance(data[-1], np.ndarray) else image.data
+        image_kwargs["contrast_limits"], histogram = _image_stats(
+            image, sample, cache_dir, cache_size, multiscale=multiscale
+        )
+
+    layer = construct_image_layer_tuple(
+        data=data,
         scale=image.pixel_spacing,
         exp_id=image.experiment_id,
         stack=image.stack,
         source=image.source,
+        **image_kwargs,
     )
+    if contrast_limits:
+        layer[1]["metadata"]["histogram"] = histogram
+    return layer
 
 
 def construct_segmentation_layer_tuple(
@@ -234,7 +359,41 @@ def read_segmentation(image):
 
 
 
-def read_surface_picks(path):
+def read_mrc_mmap(path, name_regex=None, names=None, guess_id=True, lazy=True, strict=False):
+    """
+    Read an mrc file as a copy-on-write memory map.
+
+    Only the pages that are accessed are read from disk (and shared through the page cache),
+    while edits stay in memory. Data keeps the byte order of the file.
+
+    Arguments match cryohub.read: the image is discarded if its experiment id is not in names,
+    while guess_id, lazy and strict do not apply to a single memory mapped image.
+    """
+    exp_id = guess_name(path, name_regex)
+    if names is not None and exp_id not in names:
+        return []
+    with mrcfile.open(path, header_only=True, permissive=True) as mrc:
+        header = mrc.header
+        dtype = mrcfile.utils.data_dtype_from_header(header)
+        shape = mrcfile.utils.data_shape_from_header(header)
+        # data starts after the main header and the extended header
+        offset = header.nbytes + int(header.nsymbt)
+        pixel_size = float(mrc.voxel_size.x)
+    # same as mrcfile's is_image_stack/is_volume_stack, which need the data
+    stack = len(shape) == 4 or (len(shape) == 3 and header.ispg == mrcfile.constants.IMAGE_STACK_SPACEGROUP)
+
+    img = Image(
+        data=np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=shape),
+        experiment_id=exp_id,
+        pixel_spacing=pixel_size,
+        source=path,
+        stack=stack,
+    )
+    return [validate_image(img, coerce=True)]
+
+
+def _read_surface_picks_legacy(path):
+    """Read the original .picks format: a sequence of np.save blobs followed by the experiment id."""
     lines = []
     with open(path, "rb") as f:
         scale = np.load(f)
@@ -246,6 +405,45 @@ def read_surface_picks(path):
             except ValueError:
                 break
         exp_id = f.read().decode()
+    return lines, surf_id, scale, edge_color_cycle, exp_id
+
+
+def _read_surface_picks_container(path, surface_ids=None, mmap=True):
+    reader = ContainerReader(path, mmap=mmap)
+    surf_id = reader.read("surface_id")
+    starts = reader.read("line_offsets")
+    stops = np.append(starts[1:], reader.rows("points"))
+
+    selected = np.arange(len(surf_id))
+    if surface_ids is not None:
+        selected = selected[np.isin(surf_id, surface_ids)]
+    lines = [reader.read("points", starts[i], stops[i]) for i in selected]
+
+    attrs = reader.attrs
+    return (
+        lines,
+        np.asarray(surf_id[selected]),
+        np.array(attrs["scale"]),
+        np.array(attrs["edge_color_cycle"]),
+        attrs["experiment_id"],
+    )
+
+
+def read_surface_picks(path, surface_ids=None, mmap=True):
+    """
+    Read a .picks file into a shapes layer tuple.
+
+    surface_ids: only load the lines belonging to these surfaces.
+    mmap: lines are memory mapped views into the file instead of copies, if possible.
+    """
+    if is_container(path):
+        lines, surf_id, scale, edge_color_cycle, exp_id = _read_surface_picks_container(path, surface_ids, mmap)
+    else:
+        lines, surf_id, scale, edge_color_cycle, exp_id = _read_surface_picks_legacy(path)
+        if surface_ids is not None:
+            selected = np.isin(surf_id, surface_ids)
+            lines = [line for line, sel in zip(lines, selected) if sel]
+            surf_id = surf_id[selected]
 
     return (
         lines,
@@ -255,7 +453,7 @@ def read_surface_picks(path):
             "metadata": {"experiment_id": exp_id},
             "scale": scale,
             "features": {"surface_id": surf_id},
-            "feature_defaults": {"surface_id": surf_id.max() + 1},
+            "feature_defaults": {"surface_id": surf_id.max() + 1 if len(surf_id) else 0},
             "edge_color_cycle": edge_color_cycle,
             "edge_color": "surface_id",
             "shape_type": "path",
@@ -267,19 +465,211 @@ def read_surface_picks(path):
     )
 
 
-def read_surface(path):
+def read_journal(path):
+    """
+    Recover a layer from its autosave journal, replaying all the edits it recorded.
+
+    Particles result in a points and a vectors layer tuple, picks in a shapes layer tuple.
+    """
+    kind, data, features, attrs = replay_journal(path)
+    metadata = attrs.get("metadata", {})
+    exp_id = metadata.get("experiment_id", Path(path).stem)
+    scale = attrs.get("scale", [1, 1, 1])
+    if kind == "shapes":
+        return [
+            (
+                data,
+                {
+                    "name": attrs.get("name", f"{exp_id} - surface lines"),
+                    "edge_width": 50 / scale[0],
+                    "metadata": metadata,
+                    "scale": scale,
+                    "features": features,
+                    "edge_color_cycle": attrs.get("edge_color_cycle", np.random.rand(30, 3)),
+                    "edge_color": "surface_id",
+                    "shape_type": "path",
+                    "ndim": 3,
+                    "units": "angstrom",
+                },
+                "shapes",
+            )
+        ]
+    if "p_id" not in metadata:
+        attributes = {"name": attrs.get("name", exp_id), "metadata": metadata, "scale": scale, "features": features}
+        return [(data, attributes, "points")]
+    return construct_particle_layer_tuples(
+        coords=invert_xyz(data),
+        features=features,
+        scale=scale[0],
+        exp_id=exp_id,
+        p_id=metadata["p_id"],
+        source=metadata.get("source", ""),
+        name_suffix="recovered",
+    )
+
+
+def _to_numeric(col):
+    try:
+        return pd.to_numeric(col)
+    except (ValueError, TypeError):
+        return col
+
+
+def _scan_star(path):
+    """
+    Find the particle table in a star file without reading its rows.
+
+    Returns the column names, the byte offset of the first row, and the optics table (if any).
+    The particle table is the first loop which is not the optics table, and must be the last block.
+    """
+    block = None
+    columns = []
+    in_loop = False
+    optics_columns = []
+    optics_rows = []
+    with open(path, "rb") as f:
+        while line := f.readline():
+            stripped = line.strip()
+            if not stripped or stripped.startswith(b"#"):
+                continue
+            if stripped.startswith(b"data_"):
+                block = stripped[5:].decode()
+                columns = []
+                in_loop = False
+            elif stripped.startswith(b"loop_"):
+                in_loop = True
+            elif stripped.startswith(b"_"):
+                if in_loop:
+                    # strip leading underscore and the column number comment
+                    columns.append(stripped.split()[0][1:].decode())
+            elif in_loop and columns:
+                if block != "optics":
+                    optics = None
+                    if optics_rows:
+                        optics = pd.DataFrame(optics_rows, columns=optics_columns).apply(_to_numeric)
+                    return columns, f.tell() - len(line), optics
+                optics_columns = columns
+                optics_rows.append(stripped.decode().split())
+    raise ParseError(f"could not find a particle table in {path}")
+
+
+def _iter_star_chunks(path, chunk_size, name_regex=None):
+    columns, offset, optics = _scan_star(path)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for df in pd.read_csv(f, sep=r"\s+", header=None, names=columns, chunksize=chunk_size, comment="#"):
+            if optics is not None:
+                df = merge_optics({"optics": optics, "particles": df})
+            yield parse_relion_star(df, star_path=path, name_regex=name_regex)
+
+
+def _tbl_to_posesets(df, path, name_regex=None):
+    """Same as cryohub's tbl reader, but on an already parsed table."""
+    posesets = []
+    for exp_id, exp_df in df.groupby(Dynamo.EXP_ID_HEADER):
+        exp_df = exp_df.reset_index(drop=True)
+        coords = get_columns_or_default(exp_df, Dynamo.COORD_HEADERS)
+        shifts = get_columns_or_default(exp_df, Dynamo.SHIFT_HEADERS)
+        eulers = get_columns_or_default(exp_df, Dynamo.EULER_HEADERS[3])
+
+        rot = None
+        if eulers is not None and not np.allclose(eulers, 0):
+            # inverse, so that when applied to basis vectors it gives the particle orientation
+            rot = Rotation.from_euler(Dynamo.EULER, eulers, degrees=True).inv()
+
+        poseset = PoseSet(
+            position=coords,
+            shift=shifts,
+            orientation=rot,
+            experiment_id=guess_name(exp_id, name_regex) if name_regex else exp_id,
+            source=path,
+            features=exp_df.drop(columns=Dynamo.REDUNDANT_HEADERS, errors="ignore"),
+        )
+        posesets.append(validate_poseset(poseset, coerce=True))
+    return posesets
+
+
+def _iter_tbl_chunks(path, chunk_size, name_regex=None):
+    for df in pd.read_csv(path, sep=r"\s+", header=None, chunksize=chunk_size):
+        df = df.apply(_to_numeric)
+        df.columns = generate_column_names(df.shape[1])
+        yield _tbl_to_posesets(df, path, name_regex)
+
+
+def iter_particles(path, chunk_size=100_000, name_regex=None):
+    """
+    Parse a .star or .tbl particle file in chunks of rows.
+
+    Yields lists of posesets (one per experiment found in the chunk), so only one chunk
+    of the table is in memory at any time. The same experiment can appear in several chunks.
+    """
+    path = Path(path)
+    if path.suffix == ".star":
+        yield from _iter_star_chunks(path, chunk_size, name_regex)
+    elif path.suffix == ".tbl":
+        yield from _iter_tbl_chunks(path, chunk_size, name_regex)
+    else:
+        raise ParseError(f"cannot stream particles from {path}: only .star and .tbl files are supported")
+
+
+def _read_surface_legacy(path):
+    """Read the original .surf format: a sequence of np.save blobs followed by the experiment id."""
     with open(path, "rb") as f:
         scale = np.load(f)
         # TODO: needs to exposed in napari
         # colormap = np.load(f)
         data = tuple(np.load(f) for _ in range(3))
         exp_id = f.read().decode()
+    return data, scale, exp_id
+
+
+def _read_surface_container(path, surfaces=None, mmap=True):
+    reader = ContainerReader(path, mmap=mmap)
+    vertex_ranges = reader.read("surface_vertex_ranges")
+    face_ranges = reader.read("surface_face_ranges")
+    names = ["vertices", "faces", "values"] if "values" in reader else ["vertices", "faces"]
+
+    if surfaces is None:
+        data = tuple(reader.read(name) for name in names)
+    else:
+        # only read the rows of the requested surfaces, and renumber faces to the new vertex positions
+        parts = {name: [] for name in names}
+        offset = 0
+        for surf in surfaces:
+            v_start, v_stop = vertex_ranges[surf]
+            f_start, f_stop = face_ranges[surf]
+            parts["vertices"].append(reader.read("vertices", v_start, v_stop))
+            parts["faces"].append(reader.read("faces", f_start, f_stop) - v_start + offset)
+            if "values" in parts:
+                parts["values"].append(reader.read("values", v_start, v_stop))
+            offset += v_stop - v_start
+        data = tuple(np.concatenate(parts[name]) for name in names)
+        lengths = np.diff(vertex_ranges[surfaces], axis=1).ravel()
+        vertex_ranges = np.stack([np.cumsum(lengths) - lengths, np.cumsum(lengths)], axis=1)
+
+    attrs = reader.attrs
+    return data, np.array(attrs["scale"]), attrs["experiment_id"], np.asarray(vertex_ranges)
+
+
+def read_surface(path, surfaces=None, mmap=True):
+    """
+    Read a .surf file into a surface layer tuple.
+
+    surfaces: only load these surfaces (by index).
+    mmap: memory map the data instead of reading it, if not compressed.
+    """
+    metadata = {}
+    if is_container(path):
+        data, scale, exp_id, vertex_ranges = _read_surface_container(path, surfaces, mmap)
+        metadata["surface_vertex_ranges"] = vertex_ranges
+    else:
+        data, scale, exp_id = _read_surface_legacy(path)
 
     return (
         data,
         {
             "name": f"{exp_id} - surface",
-            "metadata": {"experiment_id": exp_id},
+            "metadata": {"experiment_id": exp_id, **metadata},
             "shading": "smooth",
             "scale": scale,
             # TODO: needs to exposed in napari
@@ -291,29 +681,114 @@ def read_surface(path):
     )
 
 
-def read_layers(*paths, **kwargs):
+def _read_path(
+    path, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, mmap=False, multiscale=False, contrast_limits=True, **kwargs
+):
+    """Read a single path, returning a list of layer tuples or cryohub objects."""
+    if path.suffix == ".picks":
+        return [read_surface_picks(path)]
+    elif path.suffix == ".journal":
+        return read_journal(path)
+    elif path.suffix == ".surf":
+        return [read_surface(path)]
+    elif path.suffix == ".zarr":
+        return read_zarr(
+            path, name_regex=kwargs.get("name_regex"), multiscale=multiscale, contrast_limits=contrast_limits
+        )
+    elif mmap and path.suffix in MRC_SUFFIXES and path.is_file():
+        return read_mrc_mmap(path, **kwargs)
+
+    use_cache = cache_dir is not None and path.is_file()
+    if use_cache:
+        posesets = load_posesets(cache_dir, path, **kwargs)
+        if posesets is not None:
+            return posesets
+
+    obj_list = cryohub.read(path, **kwargs)
+    # only particles are worth caching; images are read lazily anyways
+    if use_cache and obj_list and all(isinstance(obj, PoseSetProtocol) for obj in obj_list):
+        save_posesets(cache_dir, path, obj_list, max_bytes=cache_size, **kwargs)
+    return obj_list
+
+
+def read_layers(
+    *paths,
+    workers=1,
+    cache_dir=None,
+    cache_size=DEFAULT_CACHE_SIZE,
+    multiscale=False,
+    mmap=False,
+    contrast_limits=True,
+    experiment_ids=None,
+    **kwargs,
+):
+    """
+    Read any number of paths into napari layer tuples.
+
+    workers: number of threads used to parse files concurrently (None uses all cores).
+             Output order does not depend on it.
+    cache_dir: if given, parsed particle files are cached in this directory and reused
+               as long as the source file and reader kwargs do not change.
+    cache_size: maximum size in bytes of the cache; least recently used entries are evicted.
+    multiscale: open images as multiscale pyramids (2x, 4x and 8x binned); these are also
+                cached if cache_dir is given.
+    mmap: read mrc files as memory maps instead of through cryohub (takes precedence over lazy).
+    contrast_limits: estimate contrast limits of images from a subsample of the data, instead
+                     of letting napari compute them (cached if cache_dir is given).
+    experiment_ids: only build layers for these experiment ids (compared as strings).
+    """
+    paths = [Path(path) for path in paths]
+    workers = get_workers(workers, len(paths))
+    read_path = partial(
+        _read_path,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
+        mmap=mmap,
+        multiscale=multiscale,
+        contrast_limits=contrast_limits,
+        **kwargs,
+    )
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(read_path, paths))
+    else:
+        results = [read_path(path) for path in paths]
+
     layers = []
-    cryohub_paths = []
-    for path in paths:
-        path = Path(path)
-        if path.suffix == ".picks":
-            layers.append(read_surface_picks(path))
-        if path.suffix == ".surf":
-            layers.append(read_surface(path))
+    obj_list = []
+    for path, result in zip(paths, results):
+        if path.suffix in (".picks", ".surf", ".journal", ".zarr"):
+            layers.extend(result)
         else:
-            cryohub_paths.append(path)
+            obj_list.extend(result)
+
+    if experiment_ids is not None:
+        # manifests store ids as strings, while some readers give numbers
+        experiment_ids = {str(exp_id) for exp_id in experiment_ids}
+        layers = [lt for lt in layers if str(lt[1]["metadata"]["experiment_id"]) in experiment_ids]
+        obj_list = [obj for obj in obj_list if str(obj.experiment_id) in experiment_ids]
 
-    obj_list = cryohub.read(*cryohub_paths, **kwargs)
     # sort so we get images first, better for some visualization circumstances
     for obj in sorted(obj_list, key=lambda x: not isinstance(x, ImageProtocol)):
         if not obj.pixel_spacing:
-            warnings.warn(f"unknown pixel spacing for {obj.__class__.__name__} '{obj.experiment_id}'; setting to 1 Angstrom.", stacklevel=2)
+            warnings.warn(
+                f"unknown pixel spacing for {obj.__class__.__name__} '{obj.experiment_id}'; setting to 1 Angstrom.",
+                stacklevel=2,
+            )
             obj.pixel_spacing = 1
         if isinstance(obj, ImageProtocol):
             if np.issubdtype(obj.data.dtype, np.integer) and np.iinfo(obj.data.dtype).bits == 8:
                 layers.append(read_segmentation(obj))
             else:
-                layers.append(read_image(obj))
+                layers.append(
+                    read_image(
+                        obj,
+                        multiscale=multiscale,
+                        cache_dir=cache_dir,
+                        cache_size=cache_size,
+                        contrast_limits=contrast_limits,
+                    )
+                )
         elif isinstance(obj, PoseSetProtocol):
             layers.extend(read_particles(obj))
 
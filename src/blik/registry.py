@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+from napari.layers import Points, Vectors
+
+
+class LayerRegistry:
+    """
+    Index of the blik layers of a viewer by experiment_id and p_id.
+
+    It is kept up to date incrementally (see connect), so that finding the layers of an
+    experiment or the vectors of a particle layer does not need to scan the whole layer list.
+    Layers whose blik metadata changes after insertion need to be re-indexed with update.
+    """
+
+    def __init__(self):
+        # experiment_id -> layers, in order of insertion
+        self._by_exp = defaultdict(dict)
+        # p_id -> {"points": layer, "vectors": layer}
+        self._by_pid = defaultdict(dict)
+        # layer -> (experiment_id, p_id) it was indexed with
+        self._keys = {}
+        # experiments which may have visible layers
+        self.visible_experiments = set()
+
+    def __contains__(self, layer):
+        return layer in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def experiment_ids(self):
+        return [exp_id for exp_id in self._by_exp if exp_id is not None]
+
+    def layers(self, exp_id):
+        """layers belonging to an experiment."""
+        return list(self._by_exp.get(exp_id, ()))
+
+    def particle_pair(self, p_id):
+        """points and vectors layers of a particle set (either can be None)."""
+        pair = self._by_pid.get(p_id, {})
+        return pair.get("points"), pair.get("vectors")
+
+    def _on_visible(self, event):
+        layer = event.source
+        if layer.visible and layer in self._keys:
+            self.visible_experiments.add(self._keys[layer][0])
+
+    def add(self, layer):
+        """index a layer; untracked layers (without experiment_id) are ignored. Returns whether it was indexed."""
+        if "experiment_id" not in layer.metadata:
+            return False
+        if layer in self._keys:
+            self.remove(layer)
+        exp_id = layer.metadata["experiment_id"]
+        p_id = layer.metadata.get("p_id", None)
+        self._keys[layer] = (exp_id, p_id)
+        self._by_exp[exp_id][layer] = None
+        if p_id is not None and isinstance(layer, (Points, Vectors)):
+            self._by_pid[p_id]["points" if isinstance(layer, Points) else "vectors"] = layer
+        if layer.visible:
+            self.visible_experiments.add(exp_id)
+        layer.events.visible.connect(self._on_visible)
+        return True
+
+    def remove(self, layer):
+        keys = self._keys.pop(layer, None)
+        if keys is None:
+            return
+        exp_id, p_id = keys
+        layer.events.visible.disconnect(self._on_visible)
+        self._by_exp[exp_id].pop(layer, None)
+        if not self._by_exp[exp_id]:
+            del self._by_exp[exp_id]
+            self.visible_experiments.discard(exp_id)
+        pair = self._by_pid.get(p_id)
+        if pair is not None:
+            for kind, lay in list(pair.items()):
+                if lay is layer:
+                    del pair[kind]
+            if not pair:
+                del self._by_pid[p_id]
+
+    def update(self, layer):
+        """re-index a layer after its metadata changed."""
+        self.remove(layer)
+        return self.add(layer)
+
+    def clear(self):
+        for layer in list(self._keys):
+            self.remove(layer)
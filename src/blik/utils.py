@@ -1,16 +1,61 @@
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import dask.array as da
 import einops
 import napari
 import numpy as np
+import pandas as pd
 from scipy.spatial.transform import Rotation
 
+# orientations are stored as scalar-last quaternions (scipy convention) in these feature columns
+ORIENTATION_COLS = ["orientation_x", "orientation_y", "orientation_z", "orientation_w"]
+IDENTITY_QUAT = np.array([0, 0, 0, 1], dtype=float)
+
 
 def invert_xyz(arr):
     return arr[..., ::-1]
 
 
-def generate_vectors(coords, orientations):
+def orientation_features(orientations):
+    """Generate a features dataframe holding the quaternions of the given rotations."""
+    return pd.DataFrame(np.atleast_2d(orientations.as_quat()), columns=ORIENTATION_COLS)
+
+
+def get_quaternions(features):
+    """
+    Get the (n, 4) quaternion array from a features dataframe.
+
+    Missing columns or values are filled in with the identity rotation.
+    """
+    quat = features.reindex(columns=ORIENTATION_COLS).to_numpy(dtype=float, copy=True)
+    quat[np.isnan(quat).any(axis=1)] = IDENTITY_QUAT
+    return quat
+
+
+def get_orientations(features):
+    """Get a single batched Rotation from the quaternions of a features dataframe."""
+    return Rotation.from_quat(get_quaternions(features))
+
+
+def set_orientations(features, orientations, index=None):
+    """Store rotations (or quaternions) in a features dataframe, optionally only at index."""
+    if isinstance(orientations, Rotation):
+        orientations = orientations.as_quat()
+    if index is None:
+        features[ORIENTATION_COLS] = orientations
+    else:
+        features.loc[index, ORIENTATION_COLS] = orientations
+
+
+def generate_vectors(coords, quaternions):
     """Generate basis vectors and relative colors for napari."""
-    mat = Rotation.concatenate(orientations).as_matrix()
+    if not len(coords):
+        return np.empty((0, 2, 3)), np.empty((0, 3))
+    mat = Rotation.from_quat(quaternions).as_matrix().reshape(-1, 3, 3)
     basis_vecs = einops.rearrange(mat, "batch a b -> b batch a")
     vec_data = np.empty((len(coords) * 3, 2, 3))
     vec_color = np.empty((len(coords) * 3, 3))
@@ -22,6 +67,127 @@ def generate_vectors(coords, orientations):
     return vec_data, vec_color
 
 
+def vector_rows(indices):
+    """Rows of the output of generate_vectors belonging to the particles at the given indices."""
+    indices = np.asarray(indices, dtype=int)
+    return (indices[:, None] * 3 + np.arange(3)).ravel()
+
+
+def bin_image(data, factor, stack=False):
+    """
+    Lazily bin an image by an integer factor by averaging with dask.
+
+    If stack is True, the first axis is left alone. Excess pixels at the edges are trimmed.
+    """
+    dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float32
+    axes = range(int(stack), data.ndim)
+    return da.coarsen(np.mean, da.asarray(data), dict.fromkeys(axes, factor), trim_excess=True).astype(dtype)
+
+
+def pyramid_factors(shape, factors=(2, 4, 8), stack=False):
+    """Binning factors which result in images of at least 1 pixel in each dimension."""
+    return [factor for factor in factors if min(shape[int(stack) :]) >= factor]
+
+
+def generate_pyramid(data, factors=(2, 4, 8), stack=False):
+    """
+    Generate a lazy multiscale pyramid, starting from full resolution data.
+
+    factors are relative to the full resolution, and each level is binned from the previous one.
+    Levels which would be smaller than a pixel are skipped.
+    """
+    levels = [data]
+    previous = 1
+    for factor in pyramid_factors(data.shape, factors, stack=stack):
+        levels.append(bin_image(levels[-1], factor // previous, stack=stack))
+        previous = factor
+    return levels
+
+
+def estimate_contrast_limits(data, percentiles=(0.5, 99.5), max_samples=1_000_000, bins=256):
+    """
+    Estimate robust contrast limits and a histogram from a strided subsample of the data.
+
+    Only about max_samples values are read, so lazy (dask or memory mapped) data is never fully loaded.
+    Returns the contrast limits and the histogram as (counts, bin_edges).
+    """
+    step = int(np.ceil((np.prod(data.shape) / max_samples) ** (1 / data.ndim)))
+    sample = np.asarray(data[(slice(None, None, max(step, 1)),) * data.ndim], dtype=np.float32).ravel()
+    sample = sample[np.isfinite(sample)]
+    if not len(sample):
+        return (0.0, 1.0), (np.zeros(bins, dtype=int), np.linspace(0, 1, bins + 1))
+
+    low, high = np.percentile(sample, percentiles)
+    if high <= low:
+        # flat image, napari needs a non-empty range
+        high = low + 1
+    counts, edges = np.histogram(sample, bins=bins, range=(sample.min(), max(sample.max(), high)))
+    return (float(low), float(high)), (counts, edges)
+
+
+def filename_safe(name):
+    """Replace characters which are not safe in file names (e.g. experiment ids with slashes)."""
+    return re.sub(r"[^\w.-]", "_", str(name))
+
+
+def get_workers(workers, n_items):
+    """Number of parallel workers to use for n_items; None means one per core."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, n_items))
+
+
+@contextmanager
+def atomic_write(path, mode="wb", **kwargs):
+    """
+    Write to a temporary file next to path, which only replaces path once the block completes.
+
+    Yields the temporary file opened with mode and kwargs (as in open), or its path if mode
+    is None (for libraries which open files themselves). Readers never see partial files,
+    and the temporary file is removed if writing fails.
+    """
+    path = Path(path)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False) as f:
+        pass
+    tmp = Path(f.name)
+    try:
+        if mode is None:
+            yield tmp
+        else:
+            with open(tmp, mode, **kwargs) as f:
+                yield f
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def column_to_array(col):
+    """Convert a features column to an array that can be stored without pickling, or None if impossible."""
+    if col.dtype != object and not pd.api.types.is_string_dtype(col):
+        arr = col.to_numpy()
+        return None if arr.dtype == object else arr
+    if pd.api.types.infer_dtype(col, skipna=False) not in ("string", "empty"):
+        return None
+    return col.to_numpy(dtype=str)
+
+
+def select_in_box(tree, center, half_extent, budget=None):
+    """
+    Select the points indexed by a KDTree which fall within an axis-aligned box.
+
+    If more than budget points are found, they are evenly subsampled down to budget.
+    """
+    half_extent = np.broadcast_to(half_extent, np.shape(center))
+    idx = tree.query_ball_point(center, r=np.max(half_extent), p=np.inf, return_sorted=True)
+    idx = np.asarray(idx, dtype=int)
+    if len(idx):
+        idx = idx[np.all(np.abs(tree.data[idx] - center) <= half_extent, axis=1)]
+    if budget is not None and len(idx) > budget:
+        idx = idx[np.linspace(0, len(idx) - 1, budget).astype(int)]
+    return idx
+
+
 def layer_tuples_to_layers(layer_tuples):
     return [
         getattr(napari.layers, ltype.capitalize())(data, **kwargs)
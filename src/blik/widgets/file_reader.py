@@ -1,9 +1,18 @@
 from pathlib import Path
 from typing import TYPE_CHECKING, List
 
+import numpy as np
+import pandas as pd
 from magicgui import magic_factory
+from napari.qt.threading import thread_worker
+from napari.utils.colormaps.standardize_color import transform_color
+from napari.utils.notifications import show_info
 
-from ..reader import read_layers
+from ..cache import default_cache_dir
+from ..index import MANIFEST_NAME, build_index
+from ..reader import iter_particles, read_layers, read_particles
+from ..utils import layer_tuples_to_layers
+from .main_widget import experiment_store, vectors_sync_paused
 
 if TYPE_CHECKING:
     import napari
@@ -14,19 +23,152 @@ if TYPE_CHECKING:
     files={"mode": "rm"},
     name_regex={"widget_type": "ListEdit"},
     names={"widget_type": "ListEdit"},
+    workers={"min": 0},
 )
 def file_reader(
     files: List[Path],
     name_regex: List[str],
     names: List[str],
     as_dask_array: bool = True,
+    memory_map: bool = False,
+    workers: int = 0,
+    use_cache: bool = False,
+    multiscale: bool = False,
+    lazy_experiments: bool = False,
 ) -> "napari.types.LayerDataTuple":
     """
     Read files with blik.
 
     name_regex: a regex string. Matching text will be used as name for the piece of data
     names: only load data matching this comma separated list of names
+    as_dask_array: read data lazily as dask arrays
+    memory_map: read mrc files as memory maps (overrides as_dask_array for them)
+    workers: number of files to parse in parallel (0 uses all cores)
+    use_cache: cache parsed particle files on disk (in $BLIK_CACHE_DIR or ~/.cache/blik)
+    multiscale: open images as multiscale pyramids (also cached if use_cache is set)
+    lazy_experiments: only register the experiments, and read each one when selected in the main widget
+                      (also works with dataset manifests generated by the index_dataset widget)
     """
-    return read_layers(
-        *files, name_regex=name_regex or None, names=names or None, lazy=as_dask_array
+    kwargs = {
+        "name_regex": name_regex or None,
+        "names": names or None,
+        "lazy": as_dask_array,
+        "mmap": memory_map,
+        "cache_dir": default_cache_dir() if use_cache else None,
+        "multiscale": multiscale,
+    }
+    if lazy_experiments:
+        experiment_store.register_paths(*files, **kwargs)
+        return []
+    return read_layers(*files, workers=workers or None, **kwargs)
+
+
+def _append_particles(points, vectors, chunks):
+    """append chunks of particle layer tuples to existing points and vectors layers in one go."""
+    features = pd.concat([points.features, *(pos[1]["features"] for pos, _ in chunks)], ignore_index=True)
+    # napari resizes the colors when setting data, so they are gathered first
+    edge_color = np.concatenate([vectors.edge_color, *(transform_color(ori[1]["edge_color"]) for _, ori in chunks)])
+    # vectors are generated with the chunks, so they should not be synced from the points
+    with vectors_sync_paused(points):
+        points.data = np.concatenate([points.data, *(pos[0] for pos, _ in chunks)])
+        points.features = features
+        vectors.data = np.concatenate([vectors.data, *(ori[0] for _, ori in chunks)])
+        vectors.edge_color = edge_color
+
+
+def _add_particle_chunks(viewer, layers, pending, final=False):
+    """
+    add pending chunks of particle layer tuples to the viewer, creating layers for unseen experiments.
+
+    Chunks are only appended to existing layers once they hold as many particles as the layers
+    (or once streaming is done), so each particle is copied a bounded number of times.
+    """
+    for key, chunks in list(pending.items()):
+        if key not in layers:
+            layers[key] = layer_tuples_to_layers(chunks.pop(0))
+            for lay in layers[key]:
+                viewer.add_layer(lay)
+        n_pending = sum(len(pos[0]) for pos, _ in chunks)
+        if n_pending and (final or n_pending >= len(layers[key][0].data)):
+            _append_particles(*layers[key], chunks)
+            chunks.clear()
+        if not chunks:
+            del pending[key]
+
+
+@magic_factory(
+    call_button="Stream",
+    files={"mode": "rm", "filter": "*.star *.tbl"},
+    chunk_size={"min": 1000, "max": 10_000_000, "step": 1000},
+)
+def stream_particles(
+    viewer: "napari.Viewer",
+    files: List[Path],
+    name_regex: str = "",
+    chunk_size: int = 100_000,
+):
+    """
+    Read large particle files progressively.
+
+    Files are parsed in a separate thread in chunks of chunk_size rows. The first chunk of each
+    experiment is shown as soon as it is ready, and later ones are added in growing batches.
+
+    name_regex: a regex string. Matching text will be used as name for the piece of data
+    """
+
+    @thread_worker
+    def _read():
+        for path in files:
+            for posesets in iter_particles(path, chunk_size=chunk_size, name_regex=name_regex or None):
+                # layer tuples are built here, so the main thread only adds them to the viewer
+                yield [((str(poseset.source), poseset.experiment_id), read_particles(poseset)) for poseset in posesets]
+
+    def _on_yielded(chunk):
+        for key, layer_tuples in chunk:
+            pending.setdefault(key, []).append(layer_tuples)
+        _add_particle_chunks(viewer, layers, pending)
+
+    worker = _read()
+    layers = {}
+    pending = {}
+    worker.yielded.connect(_on_yielded)
+    worker.finished.connect(lambda: _add_particle_chunks(viewer, layers, pending, final=True))
+    worker.start()
+    return worker
+
+
+@magic_factory(
+    call_button="Index",
+    directory={"mode": "d"},
+    workers={"min": 0},
+)
+def index_dataset(
+    directory: Path,
+    name_regex: str = "",
+    workers: int = 0,
+    rebuild: bool = False,
+    as_dask_array: bool = True,
+    memory_map: bool = False,
+):
+    """
+    Index a dataset directory and register its experiments for lazy loading.
+
+    Only headers and metadata are read, and the result is saved in the directory as a manifest
+    (blik_index.csv), so later scans only read new or changed files. Experiments are then listed
+    in the main widget and only read once selected.
+
+    name_regex: a regex string. Matching text will be used as name for the piece of data
+    workers: number of files to read in parallel (0 uses all cores)
+    rebuild: ignore the existing manifest (needed if name_regex changed)
+    as_dask_array: read data lazily as dask arrays once selected
+    memory_map: read mrc files as memory maps once selected (overrides as_dask_array for them)
+    """
+    index = build_index(
+        directory,
+        directory / MANIFEST_NAME,
+        name_regex=name_regex or None,
+        workers=workers or None,
+        rebuild=rebuild,
     )
+    experiment_store.register_index(index, name_regex=name_regex or None, lazy=as_dask_array, mmap=memory_map)
+    show_info(f"indexed {index['file'].nunique()} files from {index['experiment_id'].nunique()} experiments")
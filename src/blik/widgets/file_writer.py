@@ -0,0 +1,66 @@
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from magicgui import magic_factory
+from napari.layers import Points
+from napari.qt.threading import thread_worker
+from napari.utils.notifications import show_info
+
+from ..writer import PARTICLE_WRITERS, write_particles_batch
+
+if TYPE_CHECKING:
+    import napari
+
+
+def _particle_layer_data(viewer, selected_only):
+    """snapshot the data of particle layers, so it can be written safely from another thread."""
+    layers = viewer.layers.selection if selected_only else viewer.layers
+    layer_data = []
+    for lay in layers:
+        if isinstance(lay, Points) and "p_id" in lay.metadata:
+            data, state, layer_type = lay.as_layer_data_tuple()
+            state["features"] = state["features"].copy()
+            layer_data.append((data.copy(), state, layer_type))
+    return layer_data
+
+
+@magic_factory(
+    call_button="Export",
+    directory={"mode": "d"},
+    file_format={"choices": list(PARTICLE_WRITERS)},
+    workers={"min": 0},
+)
+def export_particles(
+    viewer: "napari.Viewer",
+    directory: Path,
+    file_format: str = "relion_40",
+    per_experiment: bool = True,
+    selected_only: bool = False,
+    workers: int = 0,
+):
+    """
+    Save particle layers in the background, one file per experiment or merged into one.
+
+    per_experiment: write a file named after each experiment_id, instead of a single particles file
+    selected_only: only export the selected layers
+    workers: number of files to write in parallel (0 uses all cores)
+    """
+    layer_data = _particle_layer_data(viewer, selected_only)
+    if not layer_data:
+        show_info("no particle layers to export")
+        return None
+
+    @thread_worker
+    def _write():
+        return write_particles_batch(
+            directory,
+            layer_data,
+            file_format=file_format,
+            per_experiment=per_experiment,
+            workers=workers or None,
+        )
+
+    worker = _write()
+    worker.returned.connect(lambda paths: show_info(f"exported particles to {len(paths)} file(s) in {directory}"))
+    worker.start()
+    return worker
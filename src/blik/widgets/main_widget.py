@@ -1,20 +1,63 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
 from importlib.metadata import version
+from pathlib import Path
+from weakref import WeakKeyDictionary
 
 import napari
 import numpy as np
 import pandas as pd
 from magicgui import magic_factory, magicgui
-from magicgui.widgets import Container
+from magicgui.widgets import Container, Label
 from napari.layers import Image, Labels, Points, Shapes, Vectors
+from napari.qt.threading import thread_worker
 from napari.utils._magicgui import find_viewer_ancestor
 from napari.utils.notifications import show_info
 from packaging.version import parse as parse_version
-from scipy.spatial.transform import Rotation
-
+from qtpy.QtCore import QTimer
+from qtpy.QtWidgets import QApplication
+from scipy.spatial import cKDTree
+
+from ..chunked import ChunkedArray
+from ..experiments import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_EXPERIMENTS,
+    ExperimentStore,
+    LayerSpill,
+)
+from ..journal import Journal, compact_journal, layer_attrs
 from ..reader import construct_particle_layer_tuples, construct_segmentation_layer_tuple
-from ..utils import generate_vectors, invert_xyz, layer_tuples_to_layers
+from ..registry import LayerRegistry
+from ..utils import (
+    ORIENTATION_COLS,
+    filename_safe,
+    generate_vectors,
+    get_quaternions,
+    invert_xyz,
+    layer_tuples_to_layers,
+    select_in_box,
+    vector_rows,
+)
+
+# index of the blik layers of each viewer
+_registries = WeakKeyDictionary()
+# vector update callbacks of each connected points layer, so they are not connected twice
+_vector_callbacks = {}
+# experiments which are only read once selected
+experiment_store = ExperimentStore()
+# data of hidden layers moved to disk
+layer_spill = LayerSpill()
+# autosave journal and callbacks of each journaled layer, and the autosave settings
+_journals = {}
+_autosave_settings = {"directory": None, "journal_edits": False, "compact_every": 1000}
+# above this fraction of changed particles, vectors are regenerated from scratch
+VECTOR_UPDATE_MAX_FRACTION = 0.25
+# dtype of new segmentations: wide enough for any number of labels, since only painted
+# chunks are allocated; write_labels downcasts to the smallest dtype when saving
+SEGMENTATION_DTYPE = np.int32
+# vector updates are coalesced into one every latency_ms (0 updates on every event, synchronously)
+_vector_settings = {"latency_ms": 16}
 
 
 def _get_choices(wdg, condition=None):
@@ -23,40 +66,351 @@ def _get_choices(wdg, condition=None):
     if not viewer:
         return []
 
-    choices = set()
-    for lay in viewer.layers:
-        if condition is not None and not condition(lay):
-            continue
-        try:
-            exp = lay.metadata["experiment_id"]
-        except KeyError:
-            continue
-        if exp is not None:
-            choices.add(exp)
+    registry = _get_registry(viewer)
+    if condition is None:
+        choices = set(registry.experiment_ids)
+        choices.update(experiment_store.experiment_ids)
+    else:
+        choices = {exp for exp in registry.experiment_ids if any(condition(lay) for lay in registry.layers(exp))}
     return sorted(choices)
 
 
-def _connect_points_to_vectors(p, v):
-    """connect a particle points layer to a vectors layer to keep them in sync."""
+def _get_registry(viewer):
+    """index of the blik layers of a viewer, created on first use and then kept up to date."""
+    registry = _registries.get(viewer)
+    if registry is None:
+        registry = _registries[viewer] = LayerRegistry()
+        for layer in viewer.layers:
+            registry.add(layer)
+        viewer.layers.events.inserted.connect(lambda e: e.value in registry or registry.add(e.value))
+        viewer.layers.events.removed.connect(lambda e: registry.remove(e.value))
+    return registry
+
+
+def _visible_particles(viewer, p, tree, budget, margin=0):
+    """
+    Indices of the particles in the current slice (or slab) and field of view.
+
+    margin (in world units) is added around the view, so that partially visible objects are included.
+    """
+    ndisplay = viewer.dims.ndisplay
+    displayed = list(viewer.dims.displayed)
+    center = np.array(viewer.dims.point, dtype=float)
+    center[displayed] = viewer.camera.center[-ndisplay:]
+
+    # non-displayed dimensions are limited to the slab
+    half_extent = np.asarray(viewer.dims.thickness, dtype=float) / 2
+    # napari does not expose the canvas size publicly; without it, use the whole slab
+    canvas_size = getattr(viewer, "_canvas_size", None)
+    fov = np.inf if canvas_size is None else np.array(canvas_size, dtype=float) / viewer.camera.zoom / 2
+    half_extent[displayed] = fov if ndisplay == 2 else np.max(fov)
+    half_extent += margin
+
+    center = p.world_to_data(center)
+    half_extent = half_extent / np.abs(p.scale)
+    return select_in_box(tree, center, half_extent, budget=budget)
+
+
+def _view_events(viewer):
+    """events which change what is in view."""
+    return [
+        viewer.camera.events.center,
+        viewer.camera.events.zoom,
+        viewer.dims.events.point,
+        viewer.dims.events.thickness,
+        viewer.dims.events.ndisplay,
+    ]
+
+
+def _disconnect_points_from_vectors(p):
+    """undo the connections made by _connect_points_to_vectors."""
+    callbacks = _vector_callbacks.pop(p, None)
+    if callbacks is None:
+        return
+    if callbacks["timer"] is not None:
+        callbacks["timer"].stop()
+    p.events.data.disconnect(callbacks["data"])
+    p.events.set_data.disconnect(callbacks["update"])
+    p.events.features.disconnect(callbacks["update"])
+    if callbacks["viewer"] is not None:
+        for event in _view_events(callbacks["viewer"]):
+            event.disconnect(callbacks["view"])
+
+
+@contextmanager
+def vectors_sync_paused(p):
+    """
+    stop syncing the vectors of a particle points layer while both layers are updated together.
+
+    Syncing resumes afterwards from the new state, without regenerating the vectors.
+    """
+    callbacks = _vector_callbacks.get(p)
+    if callbacks is None:
+        yield
+        return
+    _disconnect_points_from_vectors(p)
+    try:
+        yield
+    finally:
+        _connect_points_to_vectors(p, callbacks["vectors"], callbacks["viewer"], callbacks["latency"])
+        if callbacks["viewer"] is not None:
+            # with level of detail, only the particles in view should have vectors
+            _vector_callbacks[p]["view"]()
+
+
+def _vectors_update(vec_data, previous, removed, coords, quat):
+    """
+    vectors data for the given particles, reusing the vectors generated for the previous ones.
+
+    Only the 3-row blocks of particles which were added, moved or rotated are regenerated,
+    unless more than VECTOR_UPDATE_MAX_FRACTION of them changed. Returns None if nothing changed.
+    """
+    if previous is not None:
+        old_coords, old_quat = previous
+        if removed is not None and not (len(removed) and removed.max() >= len(old_coords)):
+            old_coords = np.delete(old_coords, removed, axis=0)
+            old_quat = np.delete(old_quat, removed, axis=0)
+            vec_data = np.delete(vec_data, vector_rows(removed), axis=0)
+        elif removed is not None:
+            previous = None
+    if previous is not None:
+        n_old = len(old_coords)
+        if n_old <= len(coords) and len(vec_data) == n_old * 3:
+            # new particles can only be appended at the end
+            moved = np.any(old_coords != coords[:n_old], axis=1)
+            rotated = np.any(old_quat != quat[:n_old], axis=1)
+            changed = np.flatnonzero(moved | rotated)
+            changed = np.concatenate([changed, np.arange(n_old, len(coords))])
+            if len(changed) <= VECTOR_UPDATE_MAX_FRACTION * len(coords):
+                if not len(changed):
+                    return None if removed is None else vec_data
+                if len(coords) > n_old:
+                    vec_data = np.concatenate([vec_data, np.empty(((len(coords) - n_old) * 3, 2, 3))])
+                elif removed is None:
+                    vec_data = vec_data.copy()
+                new_vec_data, _ = generate_vectors(invert_xyz(coords[changed]), quat[changed])
+                vec_data[vector_rows(changed)] = invert_xyz(new_vec_data)
+                return vec_data
+    # invert xyz and zyx back and forth because calculation happens in xyz space
+    vec_data, _ = generate_vectors(invert_xyz(coords), quat)
+    return invert_xyz(vec_data)
+
+
+def _connect_points_to_vectors(p, v, viewer=None, latency=None):
+    """
+    connect a particle points layer to a vectors layer to keep them in sync.
+
+    Bursts of events (e.g. while dragging points or rotating particles) are coalesced into a
+    single update every `latency` milliseconds (default from the level_of_detail widget), and
+    vectors are generated in a separate thread. Only the vectors of particles which changed are
+    regenerated (see _vectors_update). If a viewer is given and level of detail is enabled, only
+    the particles in view get vectors, and these are regenerated whenever the view changes.
+    """
+    tree = None
+    # positions and orientations the vectors currently show, if they show all particles
+    shown = None
+    # indices of the particles removed since the last update
+    removed = None
+    # worker generating vectors, and whether another update was requested meanwhile
+    worker = None
+    pending = False
+    timer = None
+
+    def _set_vectors(vec_data):
+        resized = len(vec_data) != len(v.data)
+        v.data = vec_data
+        if resized:
+            # colors only depend on the position in each 3-row block
+            v.edge_color = np.tile(np.eye(3), (len(vec_data) // 3, 1))
 
     def _update_vectors():
+        nonlocal tree, shown, removed, worker, pending
+        if worker is not None:
+            pending = True
+            return
         if not len(p.data):
+            shown = removed = None
+            return
+        quat = get_quaternions(p.features)
+        if np.any(pd.isnull(p.features.reindex(columns=ORIENTATION_COLS))):
+            p.features[ORIENTATION_COLS] = quat
+        coords = p.data
+        if viewer is not None and level_of_detail.only_in_view.value:
+            if tree is None:
+                tree = cKDTree(coords)
+            # vectors stick out of the slice by up to their length
+            margin = np.max(v.length * np.abs(v.scale))
+            idx = _visible_particles(viewer, p, tree, level_of_detail.max_arrows.value // 3, margin)
+            shown = removed = None
+            _set_vectors(_vectors_update(None, None, None, coords[idx], quat[idx]))
             return
-        if np.any(pd.isnull(p.features["orientation"])):
-            obj = p.features["orientation"].astype(object)
-            obj[pd.isnull(obj)] = Rotation.identity()
-            p.features["orientation"] = obj
-        # invert xyz and zyx back and forth because calculation happens in xyz space
-        vec_data, vec_color = generate_vectors(
-            invert_xyz(p.data), p.features["orientation"]
-        )
-        v.data = invert_xyz(vec_data)
-        v.edge_color = vec_color
-
-    p.events.set_data.disconnect(_update_vectors)
-    p.events.set_data.connect(_update_vectors)
-    p.events.features.disconnect(_update_vectors)
-    p.events.features.connect(_update_vectors)
+        args = (v.data, shown, removed, coords.copy(), quat)
+        # set before touching the vectors layer, which can trigger nested updates
+        shown, removed = (args[3], quat), None
+        if _synchronous():
+            vec_data = _vectors_update(*args)
+            if vec_data is not None:
+                _set_vectors(vec_data)
+            return
+
+        worker = thread_worker(_vectors_update)(*args)
+        worker.returned.connect(_on_returned)
+        worker.finished.connect(_on_finished)
+        worker.start()
+
+    def _on_returned(vec_data):
+        if vec_data is not None:
+            _set_vectors(vec_data)
+
+    def _on_finished():
+        nonlocal worker, pending
+        worker = None
+        if pending:
+            pending = False
+            _request_update()
+
+    def _synchronous():
+        return timer is None or _latency() <= 0
+
+    def _latency():
+        return _vector_settings["latency_ms"] if latency is None else latency
+
+    def _request_update():
+        if _synchronous():
+            _update_vectors()
+        elif not timer.isActive():
+            timer.start(int(_latency()))
+
+    def _on_data(event=None):
+        nonlocal tree, shown, removed
+        tree = None
+        # napari updates the slice (and thus the vectors) before emitting "removed"
+        if getattr(event, "action", None) != "removing" or shown is None:
+            return
+        if removed is None:
+            removed = np.unique(np.asarray(event.data_indices, dtype=int))
+        else:
+            # removals from different states of the data cannot be combined, start from scratch
+            shown = removed = None
+
+    def _on_view_change():
+        registry = _get_registry(viewer)
+        if p not in registry or v not in registry:
+            _disconnect_points_from_vectors(p)
+        elif level_of_detail.only_in_view.value:
+            _request_update()
+
+    if QApplication.instance() is not None:
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(_update_vectors)
+
+    _disconnect_points_from_vectors(p)
+    _vector_callbacks[p] = {
+        "vectors": v,
+        "viewer": viewer,
+        "latency": latency,
+        "data": _on_data,
+        "update": _request_update,
+        "view": _on_view_change,
+        "timer": timer,
+    }
+
+    p.events.data.connect(_on_data)
+    p.events.set_data.connect(_request_update)
+    p.events.features.connect(_request_update)
+    if viewer is not None:
+        for event in _view_events(viewer):
+            event.connect(_on_view_change)
+
+
+def _journal_paths(directory, layer):
+    """journal and compacted output files of a layer."""
+    name = filename_safe(layer.name)
+    suffix = ".picks" if isinstance(layer, Shapes) else ".star"
+    return Path(directory) / f"{name}.journal", Path(directory) / f"{name}{suffix}"
+
+
+def _disconnect_journal(layer):
+    """stop journaling a layer, compacting the journal into the final file first."""
+    journaled = _journals.pop(layer, None)
+    if journaled is None:
+        return
+    layer.events.data.disconnect(journaled["data"])
+    if isinstance(layer, Points):
+        layer.events.features.disconnect(journaled["features"])
+    if journaled["journal"].records > 1:
+        compact_journal(journaled["journal"], layer.as_layer_data_tuple(), journaled["output"])
+
+
+def _connect_journal(layer, directory, compact_every):
+    """
+    journal the edits of a particle or surface picking layer.
+
+    Only the rows affected by each edit are appended to the journal, which is compacted into
+    a .star or .picks file (and restarted) every compact_every edits.
+    """
+    if layer in _journals:
+        return
+    path, output = _journal_paths(directory, layer)
+    journal = Journal(path, "shapes" if isinstance(layer, Shapes) else "points")
+
+    def _features(indices=None):
+        features = layer.features
+        if features is None or not len(features.columns):
+            return None
+        return features if indices is None else features.iloc[indices]
+
+    def _on_data(event):
+        action = getattr(event, "action", None)
+        if action == "added":
+            # napari only ever appends, and does not always tell which indices
+            n_rows = len(layer.data)
+            journal.add(layer.data[journal.rows :], _features(slice(journal.rows, n_rows)))
+        elif action == "removed" and len(event.data_indices) < journal.rows:
+            journal.remove(event.data_indices)
+        elif action == "changed" and len(layer.data) == journal.rows and len(event.data_indices) < journal.rows:
+            indices = list(event.data_indices)
+            journal.change(indices, [layer.data[i] for i in indices], _features(indices))
+        elif action in ("added", "removed", "changed"):
+            # everything was replaced
+            journal.reset(layer.data, _features(), layer_attrs(layer.as_layer_data_tuple()[1]))
+        else:
+            return
+        if journal.records >= compact_every:
+            compact_journal(journal, layer.as_layer_data_tuple(), output)
+
+    def _on_features(event=None):
+        # edits of some rows (e.g. rotate_particles) emit the event with their data_indices
+        indices = getattr(event, "data_indices", None)
+        if indices is not None and len(layer.data) == journal.rows:
+            indices = list(indices)
+            if not indices:
+                return
+            journal.change(indices, layer.data[indices], _features(indices))
+        else:
+            journal.set_features(_features())
+        if journal.records >= compact_every:
+            compact_journal(journal, layer.as_layer_data_tuple(), output)
+
+    journal.reset(layer.data, _features(), layer_attrs(layer.as_layer_data_tuple()[1]))
+    _journals[layer] = {"journal": journal, "output": output, "data": _on_data, "features": _on_features}
+    layer.events.data.connect(_on_data)
+    if isinstance(layer, Points):
+        layer.events.features.connect(_on_features)
+
+
+def _journal_layers(viewer):
+    """(dis)connect the autosave journals of all the eligible layers, depending on the autosave settings."""
+    active = _autosave_settings["journal_edits"]
+    for layer in list(_journals):
+        if not active or layer not in viewer.layers:
+            _disconnect_journal(layer)
+    if not active:
+        return
+    for layer in viewer.layers:
+        if isinstance(layer, (Points, Shapes)) and "experiment_id" in layer.metadata:
+            _connect_journal(layer, _autosave_settings["directory"], _autosave_settings["compact_every"])
 
 
 def _connect_picking_callbacks(surf):
@@ -73,8 +427,10 @@ def _attach_callbacks_to_viewer(wdg):
     """attach all callbacks to the napari viewer and enable scale bar."""
     viewer = find_viewer_ancestor(wdg.native)
     if viewer:
-        viewer.layers.events.inserted.connect(lambda e: _connect_layers(viewer, e))
-        _connect_layers(viewer, None)
+        viewer.layers.events.inserted.connect(lambda e: _connect_layer(viewer, e.value))
+        viewer.layers.events.removed.connect(lambda e: _disconnect_layer(e.value))
+        for layer in viewer.layers:
+            _connect_layer(viewer, layer)
 
         # pixels are 1 A. We put 0.1nm cause it's more readable with multiples
         viewer.scale_bar.unit = "0.1nm"
@@ -82,27 +438,45 @@ def _attach_callbacks_to_viewer(wdg):
         # viewer.dims.axis_labels = ['z', 'y', 'x']
 
 
-def _connect_layers(viewer, e):
-    """connect all points and vectors layers with the necessary callbacks."""
-    points = {}
-    vectors = {}
-    for lay in viewer.layers:
-        if "experiment_id" not in lay.metadata:
-            continue
+def _layers_by_experiment(registry):
+    return {exp_id: registry.layers(exp_id) for exp_id in registry.experiment_ids}
+
+
+def _format_memory_usage(usage):
+    """memory used by each experiment, largest first."""
+    lines = []
+    for exp_id, (nbytes, spilled) in sorted(usage.items(), key=lambda item: -item[1][0]):
+        line = f"{exp_id}: {nbytes / 1024**2:.0f} MB"
+        if spilled:
+            line += f" ({spilled / 1024**2:.0f} MB on disk)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _connect_layer(viewer, layer):
+    """connect a newly inserted layer with the necessary callbacks, and to its points/vectors counterpart."""
+    registry = _get_registry(viewer)
+    if layer not in registry and not registry.add(layer):
+        return
+
+    if isinstance(layer, Shapes):
+        _connect_picking_callbacks(layer)
+    layer_spill.track(layer)
+    p_id = layer.metadata.get("p_id", None)
+    if p_id is not None and isinstance(layer, (Points, Vectors)):
+        p, v = registry.particle_pair(p_id)
+        if p is not None and v is not None:
+            _connect_points_to_vectors(p, v, viewer)
+    if _autosave_settings["journal_edits"] and isinstance(layer, (Points, Shapes)):
+        _connect_journal(layer, _autosave_settings["directory"], _autosave_settings["compact_every"])
 
-        p_id = lay.metadata.get("p_id", None)
-        if p_id is not None:
-            if isinstance(lay, Points):
-                points[p_id] = lay
-            elif isinstance(lay, Vectors):
-                vectors[p_id] = lay
-        if isinstance(lay, Shapes):
-            _connect_picking_callbacks(lay)
 
-    for p_id, p in points.items():
-        v = vectors.get(p_id, None)
-        if v is not None:
-            _connect_points_to_vectors(p, v)
+def _disconnect_layer(layer):
+    """undo the connections made by _connect_layer."""
+    layer_spill.discard(layer)
+    if isinstance(layer, Points):
+        _disconnect_points_from_vectors(layer)
+    _disconnect_journal(layer)
 
 
 @magic_factory(
@@ -117,22 +491,28 @@ def _connect_layers(viewer, e):
 )
 def experiment(viewer: napari.Viewer, experiment_id):
     """Select which experiment_id to display in napari and hide everything else."""
-    sel = []
     if viewer is None:
         return
-    for layer in viewer.layers:
-        try:
-            layer_exp = layer.metadata["experiment_id"]
-        except KeyError:
-            # leave untracked layers alone, and keep them in the selection if there
-            if layer in viewer.layers.selection:
-                sel.append(layer)
-            continue
-        if layer_exp == experiment_id:
-            layer.visible = True
-            sel.append(layer)
-        else:
+    if experiment_id in experiment_store:
+        for layer in experiment_store.load(experiment_id):
+            viewer.add_layer(layer)
+        for layer in experiment_store.evict():
+            if layer in viewer.layers:
+                viewer.layers.remove(layer)
+
+    # only the layers of the experiments which may be visible need to be touched
+    registry = _get_registry(viewer)
+    for exp_id in list(registry.visible_experiments - {experiment_id}):
+        for layer in registry.layers(exp_id):
             layer.visible = False
+    if experiment_id is not None:
+        layer_spill.select(experiment_id, _layers_by_experiment(registry))
+    sel = registry.layers(experiment_id)
+    for layer in sel:
+        layer.visible = True
+    registry.visible_experiments = {experiment_id} if sel else set()
+    # leave untracked layers alone, and keep them in the selection if there
+    sel.extend(layer for layer in viewer.layers.selection if layer not in registry)
     viewer.layers.selection = set(sel)
     experiment.current_layers = set(sel)
 
@@ -149,6 +529,10 @@ def add_to_exp(layer: napari.layers.Layer):
     if isinstance(layer, (Image, Labels)):
         if "stack" not in layer.metadata:
             layer.metadata["stack"] = False
+    viewer = find_viewer_ancestor(add_to_exp.native)
+    if viewer:
+        _get_registry(viewer).remove(layer)
+        _connect_layer(viewer, layer)
 
 
 @magicgui(
@@ -178,7 +562,8 @@ def new(
         for lay in layers:
             if isinstance(lay, Image) and lay.metadata["experiment_id"] == exp_id:
                 layer = construct_segmentation_layer_tuple(
-                    data=np.zeros(lay.data.shape, dtype=np.int32),
+                    # only the painted chunks are ever allocated (and saved)
+                    data=ChunkedArray(lay.data.shape, dtype=SEGMENTATION_DTYPE),
                     scale=lay.scale[0],
                     exp_id=exp_id,
                     stack=lay.metadata["stack"],
@@ -256,6 +641,65 @@ def slice_thickness_A(viewer: napari.Viewer, thickness_A=0):
     viewer.dims.thickness = (thickness_A,) * viewer.dims.ndim
 
 
+@magicgui(
+    auto_call=True,
+    max_arrows={"min": 3, "max": 10_000_000, "step": 3},
+    update_latency_ms={"min": 0, "max": 1000},
+)
+def level_of_detail(only_in_view=False, max_arrows=30_000, update_latency_ms=16):
+    """
+    Only show orientation vectors for particles in view, up to max_arrows at a time.
+
+    Vectors are updated at most every update_latency_ms.
+    """
+    _vector_settings["latency_ms"] = update_latency_ms
+    for callbacks in list(_vector_callbacks.values()):
+        callbacks["update"]()
+
+
+@magicgui(
+    auto_call=True,
+    max_experiments={"min": 1},
+    max_memory_GB={"min": 0.1, "step": 0.1},
+    hidden_memory_GB={"min": 0, "step": 0.1},
+)
+def lazy_loading(
+    max_experiments=DEFAULT_MAX_EXPERIMENTS,
+    max_memory_GB=DEFAULT_MAX_BYTES / 1024**3,
+    hidden_memory_GB=0.0,
+):
+    """
+    keep at most this many lazily loaded experiments in memory, within max_memory_GB.
+
+    Beyond hidden_memory_GB (0 disables it), the data of hidden experiments is moved out of memory
+    until they are selected again.
+    """
+    experiment_store.max_experiments = max_experiments
+    experiment_store.max_bytes = max_memory_GB * 1024**3
+    layer_spill.max_bytes = hidden_memory_GB * 1024**3 if hidden_memory_GB else None
+
+
+@magicgui(
+    auto_call=True,
+    directory={"mode": "d"},
+    compact_every={"min": 1, "max": 10_000_000},
+)
+def autosave(viewer: napari.Viewer, directory=Path("blik_autosave"), journal_edits=False, compact_every=1000):
+    """
+    journal edits to particles and surface picks in directory.
+
+    Journals are compacted into .star/.picks files every compact_every edits.
+    """
+    if _autosave_settings["directory"] != directory or _autosave_settings["compact_every"] != compact_every:
+        # journals need to be restarted
+        _autosave_settings["journal_edits"] = False
+        if viewer is not None:
+            _journal_layers(viewer)
+    _autosave_settings.update(directory=directory, journal_edits=journal_edits, compact_every=compact_every)
+    if viewer is not None:
+        _journal_layers(viewer)
+
+
 class MainBlikWidget(Container):
     """
     Main widget for blik controls.
@@ -275,7 +719,29 @@ class MainBlikWidget(Container):
         self.append(add_to_exp)
         if parse_version(version("napari")) >= parse_version("0.5.0a"):
             self.append(slice_thickness_A)
+        self.append(level_of_detail)
+        self.append(lazy_loading)
+        self.append(autosave)
+        self.memory_usage = Label(value="")
+        self.append(self.memory_usage)
+        exp.called.connect(lambda _: self._update_memory_usage())
+
+        def _refresh_choices(_):
+            try:
+                exp.reset_choices()
+            except RuntimeError:
+                # the widget was closed
+                experiment_store.on_register.remove(_refresh_choices)
+
+        experiment_store.on_register.append(_refresh_choices)
 
     def append(self, item):
         super().append(item)
         item._main_widget = self
+
+    def _update_memory_usage(self):
+        viewer = find_viewer_ancestor(self.native)
+        if viewer is None:
+            return
+        usage = layer_spill.memory_usage(_layers_by_experiment(_get_registry(viewer)))
+        self.memory_usage.value = _format_memory_usage(usage)
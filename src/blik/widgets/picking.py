@@ -1,3 +1,7 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from weakref import WeakKeyDictionary
+
 import napari
 import numpy as np
 import pandas as pd
@@ -8,8 +12,10 @@ from morphosamplers.helical_filament import HelicalFilament
 from morphosamplers.models import Sphere
 from morphosamplers.preprocess import get_label_paths_3d
 from morphosamplers.sampler import (
-    sample_volume_along_spline,
-    sample_volume_around_surface,
+    generate_1d_grid,
+    generate_2d_grid,
+    place_sampling_grids,
+    sample_volume_at_coordinates,
 )
 from morphosamplers.samplers.sphere_samplers import PointSampler, PoseSampler
 from morphosamplers.surface_spline import GriddedSplineSurface
@@ -17,7 +23,74 @@ from scipy.spatial import ConvexHull
 from scipy.spatial.transform import Rotation
 
 from ..reader import construct_particle_layer_tuples
-from ..utils import invert_xyz
+from ..utils import get_workers, invert_xyz, orientation_features, set_orientations
+
+# pixels read around the sampled coordinates, for spline interpolation
+RESAMPLE_MARGIN = 8
+
+# shapes layer -> {surface_id: (fingerprint, surface grid, mesh)} of the last generated surfaces
+_surface_cache = WeakKeyDictionary()
+
+
+def _map(func, items, workers=1):
+    """
+    apply func to each item, in parallel threads if workers > 1 (None means one per core).
+
+    Results are in the same order as items. Threads share memory, so large read-only
+    inputs (like the volume to resample) are not copied to each worker.
+    """
+    items = list(items)
+    workers = get_workers(workers, len(items))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(func, items))
+    return [func(item) for item in items]
+
+
+def _fingerprint(lines, spacing, closed, inside_point):
+    """hash of everything a fitted surface depends on."""
+    h = hashlib.sha1()
+    for line in lines:
+        line = np.ascontiguousarray(line, dtype=float)
+        h.update(str(line.shape).encode())
+        h.update(line.tobytes())
+    inside_point = None if inside_point is None else np.asarray(inside_point, dtype=float).tolist()
+    h.update(repr((float(spacing), bool(closed), inside_point)).encode())
+    return h.hexdigest()
+
+
+def _fit_surface(lines, spacing, closed=False, inside_point=None):
+    """fit a surface grid through lines of points, or return None if it cannot be fitted."""
+    try:
+        return GriddedSplineSurface(
+            points=lines,
+            separation=spacing,
+            order=3,
+            closed=closed,
+            inside_point=inside_point,
+        )
+    except ValueError:
+        return None
+
+
+def _with_separation(surf, spacing):
+    """
+    the surface grid with the given separation.
+
+    Grids are shared by the surface cache and the metadata of surface layers, so a new
+    grid is fitted instead of changing the separation of the given one.
+    """
+    if np.isclose(surf.separation, spacing):
+        return surf
+    return GriddedSplineSurface(
+        points=surf.points,
+        separation=spacing,
+        order=surf.order,
+        smoothing=surf.smoothing,
+        closed=surf.closed,
+        inside_point=surf.inside_point,
+        oversampling=surf.oversampling,
+    )
 
 
 def _generate_surface_grids_from_shapes_layer(
@@ -25,8 +98,15 @@ def _generate_surface_grids_from_shapes_layer(
     spacing_A=100,
     inside_points=None,
     closed=False,
+    workers=1,
+    cache=None,
 ):
-    """create a new surface representation from picked surface points."""
+    """
+    create a new surface representation from picked surface points.
+
+    If a cache dict is given, surfaces whose lines and parameters did not change since
+    the last call with the same cache are reused instead of being fitted again.
+    """
     spacing_A /= surface_shapes.scale[0]
     colors = []
     surface_grids = []
@@ -37,7 +117,8 @@ def _generate_surface_grids_from_shapes_layer(
         inside_point = (
             invert_xyz(inside_points.data[0]) if len(inside_points.data) else None
         )
-    for _, surf in surface_shapes.features.groupby("surface_id"):
+    surfaces = []
+    for surface_id, surf in surface_shapes.features.groupby("surface_id"):
         lines = data_array[surf.index]
         # sort by z so lines can be added in between at a later point
         # also invert xyz so we operate in back in xyz world and not napari inverted world
@@ -48,21 +129,31 @@ def _generate_surface_grids_from_shapes_layer(
 
         # drop duplicate points (messes up scipy's fitpack for splines)
         lines = [pd.DataFrame(line).drop_duplicates().to_numpy() for line in lines]
-
-        try:
-            surface_grids.append(
-                GriddedSplineSurface(
-                    points=lines,
-                    separation=spacing_A,
-                    order=3,
-                    closed=closed,
-                    inside_point=inside_point,
-                )
-            )
-        except ValueError:
-            continue
-
-        colors.append(surface_shapes.edge_color[surf.index])
+        fingerprint = _fingerprint(lines, spacing_A, closed, inside_point)
+        surfaces.append((surface_id, fingerprint, lines, surface_shapes.edge_color[surf.index]))
+
+    cached = {} if cache is None else cache
+    changed = [
+        (surface_id, fingerprint, lines)
+        for surface_id, fingerprint, lines, _ in surfaces
+        if surface_id not in cached or cached[surface_id][0] != fingerprint
+    ]
+    fitted = _map(
+        lambda item: _fit_surface(item[2], spacing_A, closed, inside_point),
+        changed,
+        workers,
+    )
+    for (surface_id, fingerprint, _), surf in zip(changed, fitted):
+        cached[surface_id] = (fingerprint, surf, None)
+    if cache is not None:
+        for surface_id in set(cache) - {surface_id for surface_id, *_ in surfaces}:
+            del cache[surface_id]
+
+    for surface_id, _, _, color in surfaces:
+        surf = cached[surface_id][1]
+        if surf is not None:
+            surface_grids.append(surf)
+            colors.append(color)
 
     if not colors:
         raise RuntimeError("could not generate surfaces for some reason")
@@ -71,15 +162,33 @@ def _generate_surface_grids_from_shapes_layer(
     return surface_grids, colors
 
 
+def _mesh_surfaces(surface_grids, workers=1, cache=None):
+    """meshes of the surface grids, reusing the ones in the cache for unchanged grids."""
+    meshes = {}
+    entries = {}
+    if cache is not None:
+        for surface_id, (_, surf, mesh) in cache.items():
+            entries[id(surf)] = surface_id
+            if mesh is not None:
+                meshes[id(surf)] = mesh
+    missing = [surf for surf in surface_grids if id(surf) not in meshes]
+    for surf, mesh in zip(missing, _map(lambda surf: surf.mesh(), missing, workers)):
+        meshes[id(surf)] = mesh
+        if id(surf) in entries:
+            surface_id = entries[id(surf)]
+            cache[surface_id] = (*cache[surface_id][:2], mesh)
+    return [meshes[id(surf)] for surf in surface_grids]
+
+
 def _generate_surface_grids_from_labels_layer(
     surface_label,
     spacing_A=100,
     inside_points=None,
     closed=False,
+    workers=1,
 ):
     """create a new surface representation from a segmentation."""
     spacing_A /= surface_label.scale[0]
-    surface_grids = []
     if inside_points is None:
         inside_point = None
     else:
@@ -92,38 +201,50 @@ def _generate_surface_grids_from_labels_layer(
         compute(surface_label.data)[0], axis=0, slicing_step=10, sampling_step=10
     )
 
-    for lines in surfaces_lines:
-        lines = [invert_xyz(line.astype(float)) for line in lines]
-
-        try:
-            surface_grids.append(
-                GriddedSplineSurface(
-                    points=lines,
-                    separation=spacing_A,
-                    order=3,
-                    closed=closed,
-                    inside_point=inside_point,
-                )
-            )
-        except ValueError:
-            continue
+    surfaces_lines = [[invert_xyz(line.astype(float)) for line in lines] for lines in surfaces_lines]
+    fitted = _map(
+        lambda lines: _fit_surface(lines, spacing_A, closed, inside_point),
+        surfaces_lines,
+        workers,
+    )
+    surface_grids = [surf for surf in fitted if surf is not None]
 
     return surface_grids, np.random.rand(len(surface_grids), 3)
 
 
-def _resample_surfaces(image_layer, surface_grids, spacing, thickness, masked):
-    volumes = []
-    for surf in surface_grids:
-        vol = sample_volume_around_surface(
-            compute(image_layer.data)[0].T,  # transpose to go back to xyz world
-            surface=surf,
-            sampling_thickness=thickness,
-            sampling_spacing=spacing,
-            interpolation_order=3,
-            masked=masked,
-        )
-        volumes.append(vol)
-    return volumes
+def _sample_subvolume(data, coords, interpolation_order=3, margin=RESAMPLE_MARGIN):
+    """
+    sample data (zyx) at xyz coords, reading only the bounding box around the coords.
+
+    The box is padded by margin so spline interpolation is not affected by its edges.
+    If data is lazy (e.g. dask), only the chunks overlapping the box are computed.
+    """
+    zyx = coords[..., ::-1]
+    flat = zyx.reshape(-1, 3)
+    shape = np.array(data.shape[-3:])
+    lo = np.clip(np.floor(np.nanmin(flat, axis=0)).astype(int) - margin, 0, shape - 1)
+    hi = np.clip(np.ceil(np.nanmax(flat, axis=0)).astype(int) + margin + 1, lo + 1, shape)
+    subvolume = np.asarray(data[tuple(slice(start, stop) for start, stop in zip(lo, hi))])
+    return sample_volume_at_coordinates(subvolume, zyx - lo, interpolation_order=interpolation_order)
+
+
+def _image_volume(image_layer):
+    """full resolution data of an image layer, without loading it."""
+    return image_layer.data[0] if image_layer.multiscale else image_layer.data
+
+
+def _resample_surfaces(image_layer, surface_grids, spacing, thickness, masked, workers=1):
+    data = _image_volume(image_layer)
+    grid = generate_1d_grid(grid_shape=thickness, grid_spacing=spacing)
+
+    def resample(surf):
+        coords = place_sampling_grids(grid, surf.sample(), surf.sample_orientations())
+        vol = _sample_subvolume(data, coords)
+        if masked:
+            vol[~surf.mask] = np.nan
+        return vol.reshape(*surf.grid_shape, thickness)
+
+    return _map(resample, surface_grids, workers)
 
 
 def _generate_filaments_from_points_layer(filament_picks):
@@ -136,13 +257,10 @@ def _generate_filaments_from_points_layer(filament_picks):
 
 
 def _resample_filament(image_layer, filament, spacing, thickness):
-    return sample_volume_along_spline(
-        compute(image_layer.data)[0].T,  # transpose to go back to xyz world
-        spline=filament,
-        sampling_shape=(thickness, thickness),
-        sampling_spacing=spacing,
-        interpolation_order=3,
-    )
+    positions = filament.sample(separation=spacing)
+    orientations = filament.sample_orientations(separation=spacing)
+    grid = generate_2d_grid(grid_shape=(thickness, thickness), grid_spacing=(spacing, spacing))
+    return _sample_subvolume(_image_volume(image_layer), place_sampling_grids(grid, positions, orientations))
 
 
 @magicgui(
@@ -150,20 +268,30 @@ def _resample_filament(image_layer, filament, spacing, thickness):
     call_button="Generate",
     spacing_A={"widget_type": "FloatSlider", "min": 0.01, "max": 1000},
     inside_points={"nullable": True},
+    workers={"min": 0},
 )
 def surface(
     surface_input: napari.layers.Layer,
     inside_points: napari.layers.Points,
     spacing_A=50,
     closed=False,
+    workers: int = 0,
 ) -> napari.types.LayerDataTuple:
-    """create a new surface representation from picked surface points."""
+    """
+    create a new surface representation from picked surface points.
+
+    workers: number of surfaces to fit and mesh in parallel (0 uses all cores)
+    """
+    cache = None
     if isinstance(surface_input, napari.layers.Shapes):
+        cache = _surface_cache.setdefault(surface_input, {})
         surface_grids, colors = _generate_surface_grids_from_shapes_layer(
             surface_input,
             spacing_A,
             inside_points=inside_points,
             closed=closed,
+            workers=workers or None,
+            cache=cache,
         )
     else:
         surface_grids, colors = _generate_surface_grids_from_labels_layer(
@@ -171,20 +299,22 @@ def surface(
             spacing_A,
             inside_points=inside_points,
             closed=closed,
+            workers=workers or None,
         )
 
-    meshes = []
     exp_id = surface_input.metadata["experiment_id"]
-
-    for surf in surface_grids:
-        meshes.append(surf.mesh())
+    # only surfaces whose picked lines changed since the last time are refitted and remeshed
+    meshes = _mesh_surfaces(surface_grids, workers or None, cache)
 
     offset = 0
     vert = []
     faces = []
     ids = []
+    vertex_ranges = []
     for surf_id, (v, f) in enumerate(meshes):
-        f += offset
+        # not in place: meshes are reused by the next call
+        f = f + offset
+        vertex_ranges.append((offset, offset + len(v)))
         offset += len(v)
         vert.append(v)
         faces.append(f)
@@ -207,6 +337,7 @@ def surface(
                 "experiment_id": exp_id,
                 "surface_grids": surface_grids,
                 "surface_colors": colors,
+                "surface_vertex_ranges": np.array(vertex_ranges),
             },
             "scale": surface_input.scale,
             "shading": "smooth",
@@ -238,8 +369,7 @@ def surface_particles(
     pos_all = []
     ori_all = []
     for surf in surface_grids:
-        if not np.isclose(surf.separation, spacing):
-            surf.separation = spacing
+        surf = _with_separation(surf, spacing)
         pos = surf.sample()
         ori = surf.sample_orientations()
         if masked:
@@ -249,7 +379,7 @@ def surface_particles(
         ori_all.append(ori)
 
     pos_all = np.concatenate(pos_all)
-    features = pd.DataFrame({"orientation": np.asarray(Rotation.concatenate(ori_all))})
+    features = orientation_features(Rotation.concatenate(ori_all))
 
     return construct_particle_layer_tuples(
         coords=pos_all,
@@ -266,6 +396,7 @@ def surface_particles(
     call_button="Resample",
     spacing_A={"widget_type": "FloatSlider", "min": 0.01, "max": 10000},
     thickness_A={"widget_type": "FloatSlider", "min": 0.01, "max": 10000},
+    workers={"min": 0},
 )
 def resample_surface(
     surface: napari.layers.Surface,
@@ -273,7 +404,13 @@ def resample_surface(
     spacing_A=5,
     thickness_A=200,
     masked=False,
+    workers: int = 0,
 ) -> napari.types.LayerDataTuple:
+    """
+    resample the volume around each surface into a flattened volume.
+
+    workers: number of surfaces to resample in parallel (0 uses all cores)
+    """
     surface_grids = surface.metadata.get("surface_grids", None)
     if surface_grids is None:
         raise ValueError("This surface layer contains no surface grid object.")
@@ -281,11 +418,9 @@ def resample_surface(
     exp_id = surface.metadata["experiment_id"]
     spacing = spacing_A / surface.scale[0]
     thickness = int(np.round(thickness_A / surface.scale[0]))
-    for surf in surface_grids:
-        if not np.isclose(surf.separation, spacing):
-            surf.separation = spacing
+    surface_grids = [_with_separation(surf, spacing) for surf in surface_grids]
 
-    vols = _resample_surfaces(volume, surface_grids, spacing, thickness, masked)
+    vols = _resample_surfaces(volume, surface_grids, spacing, thickness, masked, workers=workers or None)
 
     v = napari.Viewer()
     for i, vol in enumerate(vols):
@@ -356,7 +491,7 @@ def filament_particles(
         degrees=True,
     )
 
-    features = pd.DataFrame({"orientation": np.asarray(Rotation.concatenate(ori))})
+    features = orientation_features(Rotation.concatenate(ori))
 
     return construct_particle_layer_tuples(
         coords=pos,
@@ -476,15 +611,13 @@ def sphere_particles(
         ps = PoseSampler(spacing=spacing_A)
         poses = ps.sample(s)
 
-        features = pd.DataFrame(
-            {"orientation": np.asarray(Rotation.from_matrix(poses.orientations))}
-        )
+        features = orientation_features(Rotation.from_matrix(poses.orientations))
         pos.append(poses.positions)
         ori.append(features)
 
     return construct_particle_layer_tuples(
         coords=np.concatenate(pos),
-        features=pd.concat(ori, axis=0),
+        features=pd.concat(ori, axis=0, ignore_index=True),
         scale=sphere_surf.scale[0],
         exp_id=exp_id,
         name_suffix="spheres picked",
@@ -533,5 +666,7 @@ def rotate_particles(
     if particles.metadata.get("experiment_id", None) is None:
         raise ValueError("The selected layer is not a blik Particles layer.")
     ori = Rotation.from_euler("ZYZ", (rot, tilt, psi), degrees=True)
-    particles.features.loc[list(particles.selected_data), "orientation"] = ori
-    particles.events.features()
+    selected = list(particles.selected_data)
+    set_orientations(particles.features, ori, selected)
+    # only the selected rows changed, so the autosave journal does not need all the features
+    particles.events.features(data_indices=selected)
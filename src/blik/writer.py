@@ -1,29 +1,148 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import dask.array as da
+import mrcfile
 import numpy as np
+import pandas as pd
+from cryohub.utils.constants import Dynamo, Relion
 from cryohub.utils.generic import get_columns_or_default
+from cryohub.utils.star import extract_optics
 from cryohub.utils.types import PoseSet
-from cryohub.writing.mrc import write_mrc
-from cryohub.writing.star import write_star
-from cryohub.writing.tbl import write_tbl
-from cryotypes.image import Image
-from scipy.spatial.transform import Rotation
+from dynamotable.io import COLUMN_NAMES as DYNAMO_COLUMNS
+
+from .chunked import ChunkedArray
+from .container import ContainerReader, append_container, write_container
+from .utils import ORIENTATION_COLS, atomic_write, filename_safe, get_orientations, get_workers, invert_xyz
+
+logger = logging.getLogger(__name__)
+
+# version of the container-based .picks and .surf formats
+PICKS_VERSION = 2
+SURF_VERSION = 2
+# rows formatted at once when writing particle tables as text
+WRITE_CHUNK_ROWS = 100_000
+# bytes of image data written at once when streaming to mrc
+WRITE_SLAB_BYTES = 64 * 1024**2
+
+
+def _mrc_dtype(dtype):
+    """Closest dtype that can be stored in an mrc file (same rules as cryohub.writing.mrc)."""
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        # int can only go up to 16bit, and uint8 is stored as uint16
+        if dtype == np.uint8:
+            return np.dtype(np.uint16)
+        return np.dtype(f"{dtype.kind}{min(dtype.itemsize, 2)}")
+    if np.issubdtype(dtype, np.floating):
+        # float can only go up to 32bit
+        return np.dtype(f"f{min(dtype.itemsize, 4)}")
+    if np.dtype(dtype).kind == "b":
+        return np.dtype(np.int8)
+    raise TypeError(f'cannot write mrc with dtype "{dtype}"')
+
+
+def _smallest_label_dtype(data):
+    """Smallest integer dtype supported by mrc which can hold all the labels in data."""
+    low, high = (int(v) for v in da.compute(data.min(), data.max()))
+    for dtype in (np.int8, np.int16, np.uint16):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    raise ValueError(f"labels between {low} and {high} cannot be stored in an mrc file (max 16 bit)")
+
+
+def _slab_chunks(shape, itemsize, slab_bytes):
+    """Chunks spanning whole planes along the first axis, each at most about slab_bytes big."""
+    plane_bytes = int(np.prod(shape[1:], dtype=np.int64)) * itemsize
+    return (max(1, slab_bytes // max(plane_bytes, 1)), *shape[1:])
 
-from .utils import invert_xyz
 
+def _chunked_stats(data, dtype):
+    """min, max, mean and std of a ChunkedArray, from its allocated chunks only (the rest is zeros)."""
+    low, high = data.min(), data.max()
+    total = sumsq = 0.0
+    for _, block in data.blocks():
+        block = block.astype(dtype).astype(np.float64)
+        total += block.sum()
+        sumsq += np.square(block).sum()
+    mean = total / data.size
+    return low, high, mean, np.sqrt(max(sumsq / data.size - mean**2, 0))
 
-def write_image(path, data, attributes):
+
+def _write_mrc_streaming(path, data, dtype, pixel_spacing, stack=False, slab_bytes=WRITE_SLAB_BYTES):
+    """
+    Write an image into a preallocated mrc file, one slab of planes at a time.
+
+    Data can be a numpy, memmap or dask array: it is never loaded as a whole, so memory
+    use is bounded by slab_bytes (times the number of dask threads). For a ChunkedArray,
+    only the allocated chunks are written, since the new file is already zeros.
+    The file is written next to its destination and moved into place once complete.
+    """
+    path = Path(path)
+    chunked = isinstance(data, ChunkedArray)
+    if not chunked:
+        data = da.asarray(data)
+        data = data.rechunk(_slab_chunks(data.shape, data.dtype.itemsize, slab_bytes))
+    mode = mrcfile.utils.mode_from_dtype(dtype)
+
+    with atomic_write(path, mode=None) as tmp, mrcfile.new_mmap(tmp, data.shape, mrc_mode=mode, overwrite=True) as mrc:
+        if chunked:
+            for slices, block in data.blocks():
+                mrc.data[slices] = block.astype(dtype)
+            stats = _chunked_stats(data, dtype)
+        else:
+            # slabs are disjoint, so they can be written without locking
+            da.store(data.astype(dtype), mrc.data, lock=False)
+            # mrcfile's update_header_stats would need temporaries as big as the data
+            written = da.from_array(mrc.data, chunks=data.chunks)
+            stats = da.compute(
+                written.min(), written.max(), written.mean(dtype=np.float64), written.std(dtype=np.float64)
+            )
+        mrc.set_image_stack() if stack else mrc.set_volume()
+        mrc.voxel_size = pixel_spacing
+        mrc.header.dmin, mrc.header.dmax, mrc.header.dmean, mrc.header.rms = stats
+    return path
+
+
+def _image_attributes(path, data, attributes):
     if "experiment_id" not in attributes["metadata"]:
         raise ValueError(
             "cannot write a layer that does not have blik metadata. Add it to an experiment!"
         )
-    img = Image(
-        data=data,
-        experiment_id=attributes["metadata"]["experiment_id"],
-        pixel_spacing=attributes["scale"][0],
-        stack=attributes["metadata"].get("stack", False),
-        source=attributes["metadata"].get("source", ""),
-    )
-    write_mrc(img, str(path), overwrite=True)
-    return [path]
+    path = Path(path)
+    if not path.suffix:
+        path = path.with_suffix(".mrc")
+    if isinstance(data, list):
+        # multiscale: only the full resolution level is saved
+        data = data[0]
+    return path, data, attributes["scale"][0], attributes["metadata"].get("stack", False)
+
+
+def write_image(path, data, attributes, slab_bytes=WRITE_SLAB_BYTES):
+    path, data, pixel_spacing, stack = _image_attributes(path, data, attributes)
+    _write_mrc_streaming(path, data, _mrc_dtype(data.dtype), pixel_spacing, stack, slab_bytes)
+    return [str(path)]
+
+
+def write_labels(path, data, attributes, downcast=True, slab_bytes=WRITE_SLAB_BYTES):
+    """
+    Write a segmentation as mrc, streaming it slab by slab.
+
+    If downcast, labels are stored with the smallest integer type that fits them
+    (int8, int16 or uint16), which also means that small segmentations are
+    recognized as such when read back. This needs a quick pass over the data first.
+    """
+    path, data, pixel_spacing, stack = _image_attributes(path, data, attributes)
+    if downcast:
+        # chunked segmentations know their range without reading the empty chunks
+        dtype = _smallest_label_dtype(data if isinstance(data, ChunkedArray) else da.asarray(data))
+    else:
+        dtype = _mrc_dtype(data.dtype)
+    _write_mrc_streaming(path, data, dtype, pixel_spacing, stack, slab_bytes)
+    return [str(path)]
 
 
 def _generate_particle_set(layer_data):
@@ -37,16 +156,16 @@ def _generate_particle_set(layer_data):
             data = invert_xyz(data)
             shift_cols = ["shift_z", "shift_y", "shift_x"]
             features = attributes["features"].drop(
-                columns=["orientation", *shift_cols], errors="ignore"
+                columns=[*ORIENTATION_COLS, *shift_cols], errors="ignore"
             )
 
             shift = get_columns_or_default(attributes["features"], shift_cols)
             if shift is not None:
                 shift = invert_xyz(shift)
                 data = data - shift
-            ori = get_columns_or_default(attributes["features"], "orientation")
-            if ori is not None:
-                ori = Rotation.concatenate(ori.reshape(-1))
+            ori = None
+            if set(ORIENTATION_COLS).intersection(attributes["features"].columns):
+                ori = get_orientations(attributes["features"])
 
             particles.append(
                 PoseSet(
@@ -66,9 +185,159 @@ def _generate_particle_set(layer_data):
     return particles
 
 
+def _xyz_columns(arr, headers):
+    """Split an array of vectors into columns, leaving out z for 2D data (like cryohub)."""
+    arr = np.asarray(arr)
+    ndim = 2 if np.allclose(arr[:, 2], 0) else 3
+    return dict(zip(headers[:ndim], arr[:, :ndim].T))
+
+
+def _euler_columns(rot, headers, inplane_header, convention):
+    """Euler angles of the inverse rotations (which rotate the reference), converted in a single batch."""
+    inv = rot.inv()
+    rotvec = inv.as_rotvec(degrees=True)
+    if np.allclose(rotvec[:, :2], 0):
+        # single angle world
+        return {inplane_header: rotvec[:, 2]}
+    return dict(zip(headers, inv.as_euler(convention, degrees=True).T))
+
+
+def _relion_table(particles, version):
+    """Build the star file blocks of a list of particle sets, like cryohub's write_star."""
+    dataframes = []
+    for pset in particles:
+        n_rows = len(pset.position)
+        columns = _xyz_columns(pset.position, Relion.COORD_HEADERS)
+        columns[Relion.PIXEL_SIZE_HEADER[version]] = np.full(n_rows, pset.pixel_spacing)
+        if pset.shift is not None:
+            # relion shifts are subtractive, and in angstrom since 3.1
+            shift = -np.asarray(pset.shift) * (pset.pixel_spacing if version != "3.0" else 1)
+            columns.update(_xyz_columns(shift, Relion.SHIFT_HEADERS[version]))
+        if pset.orientation is not None:
+            columns.update(
+                _euler_columns(pset.orientation, Relion.EULER_HEADERS, Relion.EULER_HEADERS[2], Relion.EULER)
+            )
+        columns["experiment_id"] = np.full(n_rows, pset.experiment_id)
+        df = pd.DataFrame(columns)
+        if pset.features is not None and len(pset.features.columns):
+            df = pd.concat([df, pset.features.reset_index(drop=True)], axis=1)
+        dataframes.append(df)
+
+    df = pd.concat(dataframes, ignore_index=True) if len(dataframes) > 1 else dataframes[0]
+    if version == "3.0":
+        return {"": df}
+    return extract_optics(df)
+
+
+def _dynamo_table(particles):
+    """Build the table of a list of particle sets, like cryohub's write_tbl and dynamotable's write."""
+    dataframes = []
+    for pset in particles:
+        columns = _xyz_columns(pset.position, Dynamo.COORD_HEADERS)
+        if pset.shift is not None:
+            columns.update(_xyz_columns(pset.shift, Dynamo.SHIFT_HEADERS))
+        if pset.orientation is not None:
+            columns.update(
+                _euler_columns(pset.orientation, Dynamo.EULER_HEADERS[3], Dynamo.EULER_HEADERS[2][0], Dynamo.EULER)
+            )
+        # the original tomogram index might be saved as a feature
+        if pset.features is not None and Dynamo.EXP_ID_HEADER in pset.features.columns:
+            columns[Dynamo.EXP_ID_HEADER] = pset.features[Dynamo.EXP_ID_HEADER].to_numpy()
+        dataframes.append(pd.DataFrame(columns))
+
+    df = pd.concat(dataframes, ignore_index=True) if len(dataframes) > 1 else dataframes[0]
+    n_rows = len(df)
+    table = {}
+    for col in DYNAMO_COLUMNS:
+        if col in df.columns:
+            # missing values (e.g. angles of particle sets with only in-plane rotations) are left empty
+            table[col] = df[col]
+        elif col == "tag":
+            table[col] = np.arange(1, n_rows + 1)
+        elif col == "aligned_value":
+            table[col] = np.ones(n_rows, dtype=int)
+        else:
+            table[col] = np.zeros(n_rows, dtype=int)
+    return pd.DataFrame(table)
+
+
+def _quote(value):
+    # same rule as starfile
+    if isinstance(value, str) and (" " in value or not value):
+        return f'"{value}"'
+    return str(value)
+
+
+def _format_column(col, float_format, na_rep, quote):
+    """
+    Format string and values of a column, with strings and missing values already formatted.
+
+    Constant columns (common in dynamo tables) are returned as a literal with no values.
+    """
+    values = col.to_numpy()
+    if pd.api.types.is_float_dtype(col):
+        nan = np.isnan(values)
+        if not nan.any():
+            if len(values) and values.min() == values.max():
+                return (float_format % float(values[0])).replace("%", "%%"), None
+            return float_format, values.tolist()
+        return "%s", [na_rep if n else float_format % v for v, n in zip(values.tolist(), nan.tolist())]
+    if pd.api.types.is_integer_dtype(col) and not col.isna().any():
+        if len(values) and values.min() == values.max():
+            return str(values[0]), None
+        return "%d", values.tolist()
+    # everything else is formatted once per unique value
+    codes, uniques = pd.factorize(col, use_na_sentinel=True)
+    formatted = [_quote(u) if quote else str(u) for u in uniques]
+    if len(uniques) == 1 and not (codes < 0).any():
+        return formatted[0].replace("%", "%%"), None
+    return "%s", np.array([*formatted, na_rep], dtype=object)[codes].tolist()
+
+
+def _write_rows(f, df, sep, float_format, na_rep, quote=False):
+    """Write a dataframe as text rows, formatting each row in a single operation."""
+    for start in range(0, len(df), WRITE_CHUNK_ROWS):
+        chunk = df.iloc[start : start + WRITE_CHUNK_ROWS]
+        formats, values = zip(*(_format_column(chunk[col], float_format, na_rep, quote) for col in chunk.columns))
+        row_format = sep.join(formats) + "\n"
+        values = [val for val in values if val is not None]
+        if values:
+            f.writelines(row_format % row for row in zip(*values))
+        else:
+            f.write(row_format * len(chunk))
+
+
+def _write_star(path, blocks):
+    """Write star file loop blocks the same way as starfile, but much faster."""
+    with atomic_write(path, "w") as f:
+        f.write("# Created by blik\n\n\n")
+        for name, df in blocks.items():
+            f.write(f"data_{name}\n\nloop_\n")
+            f.writelines(f"_{col} #{i}\n" for i, col in enumerate(df.columns, 1))
+            _write_rows(f, df, sep="\t", float_format="%.6f", na_rep="<NA>", quote=True)
+            f.write("\n\n")
+
+
+def _log_timings(path, particles, start, tables_done):
+    end = time.perf_counter()
+    logger.info(
+        "wrote %d particles to %s in %.2fs (tables: %.2fs, writing: %.2fs)",
+        sum(len(pset.position) for pset in particles),
+        path,
+        end - start,
+        tables_done - start,
+        end - tables_done,
+    )
+
+
 def _write_particles_star(path, layer_data, relion_version):
+    start = time.perf_counter()
+    path = Path(path).with_suffix(Path(path).suffix or ".star")
     particles = _generate_particle_set(layer_data)
-    write_star(particles, path, overwrite=True, version=relion_version)
+    blocks = _relion_table(particles, relion_version)
+    tables_done = time.perf_counter()
+    _write_star(path, blocks)
+    _log_timings(path, particles, start, tables_done)
     return [path]
 
 
@@ -85,11 +354,70 @@ def write_particles_relion_40(path, layer_data):
 
 
 def write_particles_dynamo(path, layer_data):
+    start = time.perf_counter()
+    path = Path(path).with_suffix(Path(path).suffix or ".tbl")
     particles = _generate_particle_set(layer_data)
-    write_tbl(particles, path, overwrite=True)
+    table = _dynamo_table(particles)
+    tables_done = time.perf_counter()
+    with atomic_write(path, "w") as f:
+        # full precision, like dynamotable
+        _write_rows(f, table, sep=" ", float_format="%r", na_rep="")
+    _log_timings(path, particles, start, tables_done)
     return [path]
 
 
+PARTICLE_WRITERS = {
+    "relion_30": (write_particles_relion_30, ".star"),
+    "relion_31": (write_particles_relion_31, ".star"),
+    "relion_40": (write_particles_relion_40, ".star"),
+    "dynamo": (write_particles_dynamo, ".tbl"),
+}
+
+
+def write_particles_batch(
+    directory, layer_data, file_format="relion_40", per_experiment=True, workers=None, name="particles"
+):
+    """
+    Write particle layers to a directory, one file per experiment_id or a single merged file.
+
+    Files are written concurrently by a pool of workers (None uses all cores), each to a
+    temporary file which is renamed once complete, so no partial files are ever left behind.
+    Returns the written paths, in order of first appearance of each experiment.
+    """
+    if file_format not in PARTICLE_WRITERS:
+        raise ValueError(f"unknown format {file_format!r}, must be one of {list(PARTICLE_WRITERS)}")
+    write, suffix = PARTICLE_WRITERS[file_format]
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    if not per_experiment:
+        return write(directory / f"{name}{suffix}", layer_data)
+
+    by_exp = {}
+    for layer in layer_data:
+        if layer[2] == "vectors":
+            continue
+        exp_id = layer[1]["metadata"].get("experiment_id")
+        if exp_id is None:
+            raise ValueError("cannot write a layer that does not have blik metadata. Add it to an experiment!")
+        by_exp.setdefault(exp_id, []).append(layer)
+
+    jobs = [(directory / f"{filename_safe(exp_id)}{suffix}", layers) for exp_id, layers in by_exp.items()]
+    workers = get_workers(workers, len(jobs))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        paths = list(pool.map(lambda job: write(*job)[0], jobs))
+    return paths
+
+
+def _lines_to_arrays(lines, start=0):
+    """Concatenate lines into a single array of points, and the offsets at which each line starts."""
+    lines = [np.asarray(line, dtype=float) for line in lines]
+    lengths = [len(line) for line in lines]
+    points = np.concatenate(lines) if lines else np.empty((0, 3))
+    offsets = start + np.cumsum([0, *lengths[:-1]], dtype=np.int64)[: len(lines)]
+    return points, offsets
+
+
 def write_surface_picks(path, data, attributes):
     if "experiment_id" not in attributes["metadata"]:
         raise ValueError(
@@ -100,21 +428,62 @@ def write_surface_picks(path, data, attributes):
         path = str(path) + ".picks"
 
     exp_id = str(attributes["metadata"]["experiment_id"])
-    scale = attributes["scale"]
-    surf_id = attributes["features"]["surface_id"]
-    edge_color_cycle = attributes["edge_color_cycle"]
-    with open(path, "wb") as f:
-        np.save(f, scale)
-        np.save(f, surf_id)
-        np.save(f, edge_color_cycle)
-        for line in data:
-            np.save(f, line)
-        # exp ID at the end cause it has variable length and is not a np array
-        f.write(exp_id.encode())
+    points, offsets = _lines_to_arrays(data)
+    write_container(
+        path,
+        kind="picks",
+        arrays={
+            "points": points,
+            "line_offsets": offsets,
+            "surface_id": np.asarray(attributes["features"]["surface_id"], dtype=np.int64),
+        },
+        attrs={
+            "version": PICKS_VERSION,
+            "experiment_id": exp_id,
+            "scale": np.asarray(attributes["scale"], dtype=float).tolist(),
+            "edge_color_cycle": np.asarray(attributes["edge_color_cycle"], dtype=float).tolist(),
+        },
+    )
+    return [path]
+
+
+def append_surface_picks(path, lines, surface_ids):
+    """Append new lines to an existing .picks file, without rewriting it."""
+    reader = ContainerReader(path, mmap=False)
+    if reader.kind != "picks":
+        raise ValueError(f"{path} is not a .picks file (or uses the old format)")
+    points, offsets = _lines_to_arrays(lines, start=reader.rows("points"))
+    append_container(
+        path,
+        arrays={
+            "points": points,
+            "line_offsets": offsets,
+            "surface_id": np.asarray(surface_ids, dtype=np.int64),
+        },
+    )
     return [path]
 
 
-def write_surface(path, data, attributes):
+def _smallest_index_dtype(arr):
+    return np.int32 if not len(arr) or arr.max() <= np.iinfo(np.int32).max else np.int64
+
+
+def _face_ranges(faces, vertex_ranges):
+    """Face ranges of each surface, given that faces are grouped by surface in the same order as vertices."""
+    face_surface = np.searchsorted(vertex_ranges[:, 0], faces.min(axis=1), side="right") - 1
+    bounds = np.searchsorted(face_surface, np.arange(len(vertex_ranges) + 1))
+    return np.stack([bounds[:-1], bounds[1:]], axis=1)
+
+
+def write_surface(path, data, attributes, chunk_rows=1_000_000, compression=None, downcast=True):
+    """
+    Write a surface layer to a .surf file.
+
+    Vertices, faces and values are stored in chunks of chunk_rows, optionally compressed
+    (compression="zlib", which disables memory mapping when reading). If downcast, vertices
+    and values are stored as float32 and faces as int32 (if they fit).
+    The vertex and face ranges of each surface are also stored, so they can be loaded individually.
+    """
     if "experiment_id" not in attributes["metadata"]:
         raise ValueError(
             "cannot write a layer that does not have blik metadata. Add it to an experiment!"
@@ -124,15 +493,36 @@ def write_surface(path, data, attributes):
         path = str(path) + ".surf"
 
     exp_id = str(attributes["metadata"]["experiment_id"])
-    scale = attributes["scale"]
-    # TODO: needs to exposed in napari
-    # colormap = attributes['colormap']['colors']
-    with open(path, "wb") as f:
-        np.save(f, scale)
-        # TODO: needs to exposed in napari
-        # np.save(f, colormap)
-        for d in data:
-            np.save(f, d)
-        # exp ID at the end cause it has variable length and is not a np array
-        f.write(exp_id.encode())
+    vertices, faces = np.asarray(data[0]), np.asarray(data[1])
+    values = np.asarray(data[2]) if len(data) > 2 else None
+    if downcast:
+        vertices = vertices.astype(np.float32)
+        faces = faces.astype(_smallest_index_dtype(faces))
+        if values is not None:
+            values = values.astype(np.float32)
+
+    vertex_ranges = attributes["metadata"].get("surface_vertex_ranges", [[0, len(vertices)]])
+    vertex_ranges = np.asarray(vertex_ranges, dtype=np.int64).reshape(-1, 2)
+
+    arrays = {
+        "vertices": vertices,
+        "faces": faces,
+        "surface_vertex_ranges": vertex_ranges,
+        "surface_face_ranges": _face_ranges(faces, vertex_ranges),
+    }
+    if values is not None:
+        arrays["values"] = values
+    # TODO: colormap needs to exposed in napari
+    write_container(
+        path,
+        kind="surf",
+        arrays=arrays,
+        attrs={
+            "version": SURF_VERSION,
+            "experiment_id": exp_id,
+            "scale": np.asarray(attributes["scale"], dtype=float).tolist(),
+        },
+        chunk_rows=chunk_rows,
+        compression=compression,
+    )
     return [path]
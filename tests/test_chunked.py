@@ -0,0 +1,38 @@
+import numpy as np
+from napari.layers import Labels
+
+from blik.chunked import ChunkedArray
+
+
+def test_chunked_array_indexing():
+    rng = np.random.default_rng(0)
+    arr = ChunkedArray((50, 40, 30), dtype=np.int16, chunks=(16, 16, 16))
+    dense = np.zeros(arr.shape, dtype=np.int16)
+    assert arr.nbytes == 0
+
+    for _ in range(50):
+        key = tuple(slice(*sorted(rng.integers(0, s, 2))) for s in arr.shape)
+        arr[key] = dense[key] = rng.integers(0, 5)
+        idx = tuple(rng.integers(0, s, 20) for s in arr.shape)
+        arr[idx] = dense[idx] = rng.integers(0, 5, 20)
+        np.testing.assert_array_equal(arr[idx], dense[idx])
+        key = (int(rng.integers(0, 50)), slice(None, None, -2), slice(3, None, 3))
+        np.testing.assert_array_equal(arr[key], dense[key])
+        np.testing.assert_array_equal(arr[..., 5], dense[..., 5])
+    np.testing.assert_array_equal(np.asarray(arr), dense)
+    assert arr.max() == dense.max()
+    assert arr.min() == dense.min()
+
+
+def test_chunked_array_painting():
+    labels = Labels(ChunkedArray((128, 128, 128), chunks=(64, 64, 64)))
+    # writing zeros (or reading) allocates nothing
+    labels.data[:10] = 0
+    assert labels.data[:, 5].max() == 0
+    assert labels.data.nbytes == 0
+
+    labels.paint((10, 10, 10), 3)
+    assert labels.data[10, 10, 10] == 3
+    assert labels.data.nbytes == 64**3
+    labels.undo()
+    assert labels.data[10, 10, 10] == 0
@@ -0,0 +1,96 @@
+import mrcfile
+import numpy as np
+from napari.layers import Image, Labels, Vectors
+
+import blik.reader
+from blik.experiments import ExperimentStore, LayerSpill, layer_nbytes
+
+
+def test_experiment_store(star_file, mrc_file, monkeypatch):
+    store = ExperimentStore(max_experiments=2)
+    # registering only reads headers, never the whole files
+    with monkeypatch.context() as m:
+        m.setattr(blik.reader.cryohub, "read", None)
+        exp_ids = store.register_paths(star_file, mrc_file)
+    assert exp_ids == ["a_1", "a_2", "test"]
+    assert not any(store.is_loaded(exp_id) for exp_id in exp_ids)
+
+    layers = store.load("a_1")
+    assert [lay.metadata["experiment_id"] for lay in layers] == ["a_1", "a_1"]
+    assert store.load("a_1") == []
+    assert store.evict() == []
+
+    store.load("a_2")
+    store.load("test")
+    # a_1 is least recently used and over the limit
+    assert store.evict() == layers
+    assert not store.is_loaded("a_1")
+    assert "a_1" in store
+
+    # edited experiments are never released
+    store.load("a_1")[0].data = [[0, 0, 0]]
+    store.max_experiments = 1
+    store.load("test")
+    store.evict()
+    assert store.is_loaded("test")
+    assert not store.is_loaded("a_2")
+    assert "a_1" not in store
+
+
+def test_layer_spill(tmp_path):
+    spill = LayerSpill(max_bytes=10_000, directory=tmp_path)
+    img = Image(np.random.rand(20, 20, 20), visible=False)
+    lab = Labels(np.zeros((20, 20, 20), dtype=np.int32), visible=False)
+    vec = Vectors(np.random.rand(30, 2, 3), edge_color=np.tile(np.eye(3), (10, 1)), visible=False)
+    other = Image(np.random.rand(20, 20, 20))
+    layers = {"a": [img, lab, vec], "b": [other]}
+    img_data, vec_data, vec_color = img.data.copy(), vec.data.copy(), vec.edge_color.copy()
+
+    spilled = spill.select("b", layers)
+    assert spilled == [img, lab, vec]
+    assert layer_nbytes(img) == layer_nbytes(lab) == 0
+    assert not len(vec.data)
+    assert spill.memory_usage(layers)["a"] == (0, img_data.nbytes + lab.data.nbytes + vec_data.nbytes)
+
+    # spilled layers can still be edited
+    lab.data[0, 0, 0] = 3
+    other.visible = False
+    assert spill.select("a", layers) == [other]
+    np.testing.assert_array_equal(img.data, img_data)
+    np.testing.assert_array_equal(vec.data, vec_data)
+    np.testing.assert_array_equal(vec.edge_color, vec_color)
+    assert lab.data[0, 0, 0] == 3
+    assert not isinstance(lab.data, np.memmap)
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_layer_spill_source(tmp_path):
+    path = tmp_path / "a.mrc"
+    data = np.random.rand(20, 20, 20).astype(np.float32)
+    labels = np.zeros((20, 20, 20), dtype=np.int8)
+    with mrcfile.new(path) as mrc:
+        mrc.set_data(data)
+    with mrcfile.new(tmp_path / "a_seg.mrc") as mrc:
+        mrc.set_data(labels)
+
+    spill_dir = tmp_path / "spill"
+    spill = LayerSpill(max_bytes=0, directory=spill_dir)
+    img = Image(data.copy(), visible=False, metadata={"source": str(path)})
+    lab = Labels(labels.copy(), visible=False, metadata={"source": str(tmp_path / "a_seg.mrc")})
+    edited = Labels(labels.copy(), visible=False, metadata={"source": str(tmp_path / "a_seg.mrc")})
+    for layer in (img, lab, edited):
+        spill.track(layer)
+    edited.data_setitem((np.array([0]), np.array([0]), np.array([0])), 2)
+    layers = {"a": [img, lab, edited], "b": []}
+
+    assert spill.select("b", layers) == [img, lab, edited]
+    # unedited data is mapped from its source, and only the edits are written
+    assert isinstance(img.data, np.memmap) and isinstance(lab.data, np.memmap)
+    assert len(list(spill_dir.iterdir())) == 1
+    spill.select("a", layers)
+    np.testing.assert_array_equal(img.data, data)
+    assert edited.data[0, 0, 0] == 2
+    assert not list(spill_dir.iterdir())
+
+    # disabled by default
+    assert LayerSpill().select("b", layers) == []
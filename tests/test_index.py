@@ -0,0 +1,57 @@
+import shutil
+
+import dynamotable
+import mrcfile
+import numpy as np
+import pandas as pd
+
+import blik.index
+from blik.experiments import ExperimentStore
+from blik.index import build_index, read_index
+
+
+def test_build_index(tmp_path, monkeypatch, star_file, mrc_file):
+    shutil.copy(star_file, tmp_path / "particles.star")
+    (tmp_path / "tomos").mkdir()
+    shutil.copy(mrc_file, tmp_path / "tomos" / "a_1.mrc")
+    with mrcfile.new(tmp_path / "tomos" / "a_1.seg.mrc") as mrc:
+        mrc.set_data(np.zeros((4, 5, 6), np.int8))
+    dynamotable.write(pd.DataFrame({"x": [1, 2, 3], "y": 0, "z": 0, "tomo": [3, 3, 4]}), tmp_path / "particles.tbl")
+    (tmp_path / "notes.txt").write_text("not indexed")
+
+    index = build_index(tmp_path, workers=2)
+    assert (tmp_path / "blik_index.csv").exists()
+    rows = {(row.experiment_id, row.type): row for row in index.itertuples()}
+    assert set(rows) == {
+        ("a_1", "particles"),
+        ("a_2", "particles"),
+        ("a_1", "image"),
+        ("a_1", "segmentation"),
+        ("3", "particles"),
+        ("4", "particles"),
+    }
+    assert rows["a_1", "image"].shape == "10x10x10"
+    assert rows["a_1", "particles"].particle_count == 1
+    assert rows["3", "particles"].particle_count == 2
+    pd.testing.assert_frame_equal(read_index(tmp_path / "blik_index.csv"), index)
+
+    # only new or changed files are read again
+    indexed = []
+
+    def index_file(path, name_regex=None):
+        indexed.append(path.name)
+        return original(path, name_regex)
+
+    original = blik.index.index_file
+    monkeypatch.setattr(blik.index, "index_file", index_file)
+    (tmp_path / "particles.tbl").unlink()
+    shutil.copy(mrc_file, tmp_path / "tomos" / "a_2.mrc")
+    index = build_index(tmp_path)
+    assert indexed == ["a_2.mrc"]
+    assert "3" not in set(index["experiment_id"])
+    assert len(index[index["type"] == "image"]) == 2
+
+    store = ExperimentStore()
+    assert store.register_paths(tmp_path / "blik_index.csv") == ["a_1", "a_2"]
+    layers = store.load("a_1")
+    assert sorted(lay.__class__.__name__ for lay in layers) == ["Image", "Labels", "Points", "Vectors"]
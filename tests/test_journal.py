@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from blik.journal import Journal, compact_journal, replay_journal
+from blik.reader import read_layers
+
+
+def test_points_journal(tmp_path):
+    path = tmp_path / "points.journal"
+    journal = Journal(path, "points")
+    data = np.random.rand(4, 3)
+    features = pd.DataFrame({"score": np.arange(4.0), "name": list("abcd")})
+    journal.reset(data, features, {"name": "test"})
+
+    journal.add(np.ones((2, 3)), pd.DataFrame({"score": [4.0, 5.0], "name": ["e", "f"]}))
+    journal.remove([0, 2])
+    journal.change([1], np.zeros((1, 3)), pd.DataFrame({"score": [-1.0], "name": ["x"]}))
+    assert journal.rows == 4
+
+    kind, data_new, features_new, attrs = replay_journal(path)
+    assert kind == "points"
+    assert attrs == {"name": "test"}
+    np.testing.assert_array_equal(data_new, [data[1], [0, 0, 0], [1, 1, 1], [1, 1, 1]])
+    assert features_new["score"].tolist() == [1, -1, 4, 5]
+    assert features_new["name"].tolist() == ["b", "x", "e", "f"]
+
+    # a crash while appending only loses the last edit
+    journal.remove([0])
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 5)
+    with pytest.warns(UserWarning, match="truncated"):
+        _, data_crashed, _, _ = replay_journal(path)
+    np.testing.assert_array_equal(data_crashed, data_new)
+
+
+def test_shapes_journal(tmp_path):
+    path = tmp_path / "shapes.journal"
+    journal = Journal(path, "shapes")
+    lines = [np.random.rand(n, 3) for n in (2, 3)]
+    attributes = {
+        "name": "test - surface lines",
+        "metadata": {"experiment_id": "test"},
+        "scale": [2.0, 2.0, 2.0],
+        "features": pd.DataFrame({"surface_id": [0, 0]}),
+        "edge_color_cycle": np.random.rand(3, 4),
+    }
+    journal.reset(lines, attributes["features"])
+    new_line = np.random.rand(4, 3)
+    journal.add([new_line], pd.DataFrame({"surface_id": [1]}))
+    journal.remove([0])
+
+    kind, lines_new, features, _ = replay_journal(path)
+    assert kind == "shapes"
+    assert len(lines_new) == 2
+    np.testing.assert_array_equal(lines_new[1], new_line)
+    assert features["surface_id"].tolist() == [0, 1]
+
+    attributes["features"] = features
+    output = compact_journal(journal, (lines_new, attributes, "shapes"), tmp_path / "test.picks")
+    assert journal.records == 1
+    np.testing.assert_array_equal(read_layers(output)[0][0][1], new_line)
+    recovered = read_layers(path)[0]
+    assert recovered[1]["name"] == "test - surface lines"
+    np.testing.assert_array_equal(recovered[0][1], new_line)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from blik.reader import read_layers
+
+zarr = pytest.importorskip("zarr")
+
+from blik.ome_zarr import write_image_zarr, write_labels_zarr  # noqa: E402
+
+
+def test_image_zarr_roundtrip(tmp_path):
+    data = np.random.rand(32, 32, 32).astype(np.float32)
+    attrs = {"name": "a - image", "metadata": {"experiment_id": "a"}, "scale": (2, 2, 2)}
+    path = write_image_zarr(tmp_path / "a", data, attrs, chunks=(16, 16, 16))[0]
+    assert path.endswith(".zarr")
+
+    layer = read_layers(path, multiscale=True)[0]
+    assert layer[2] == "image"
+    assert layer[1]["metadata"]["experiment_id"] == "a"
+    assert layer[1]["scale"] == [2, 2, 2]
+    levels = layer[0]
+    assert [lvl.shape for lvl in levels] == [(32, 32, 32), (16, 16, 16), (8, 8, 8), (4, 4, 4)]
+    np.testing.assert_allclose(levels[0].compute(), data)
+    np.testing.assert_allclose(levels[1].compute(), data.reshape(16, 2, 16, 2, 16, 2).mean((1, 3, 5)), rtol=1e-5)
+
+    layer = read_layers(path, multiscale=False, contrast_limits=False)[0]
+    assert layer[0].shape == (32, 32, 32)
+    assert "contrast_limits" not in layer[1]
+
+
+def test_zarr_resave_to_source(tmp_path):
+    data = np.random.rand(32, 32, 32).astype(np.float32)
+    attrs = {"name": "a - image", "metadata": {"experiment_id": "a"}, "scale": (1, 1, 1)}
+    path = write_image_zarr(tmp_path / "a.zarr", data, attrs, chunks=(16, 16, 16), levels=1)[0]
+    lazy = read_layers(path, multiscale=False)[0][0]
+
+    # same layout: rewritten in place
+    write_image_zarr(path, lazy, attrs, chunks=(16, 16, 16), levels=1)
+    # a different layout would delete the source while reading it
+    with pytest.raises(ValueError, match="while saving data read from it"):
+        write_image_zarr(path, lazy, attrs, chunks=(8, 8, 8), levels=1)
+    np.testing.assert_allclose(read_layers(path, multiscale=False)[0][0].compute(), data)
+
+
+def test_labels_zarr_rewrites_changed_chunks(tmp_path, monkeypatch):
+    import blik.ome_zarr
+
+    data = np.zeros((32, 32, 32), dtype=np.int8)
+    data[:4, :4, :4] = 1
+    attrs = {"name": "a - segmentation", "metadata": {"experiment_id": "a"}, "scale": (1, 1, 1)}
+    path = write_labels_zarr(tmp_path / "a.zarr", data, attrs, chunks=(16, 16, 16), levels=1)[0]
+
+    writes = []
+    write_chunk = blik.ome_zarr._write_chunk
+
+    def _count(target, region, block, compare):
+        written = write_chunk(target, region, block, compare)
+        writes.append(written)
+        return written
+
+    monkeypatch.setattr(blik.ome_zarr, "_write_chunk", _count)
+    data[20:22, 20:22, 20:22] = 2
+    write_labels_zarr(path, data, attrs, chunks=(16, 16, 16), levels=1)
+    # one out of 8 chunks at full resolution and one at the lower level
+    assert sum(writes) == 2
+
+    layer = read_layers(path, multiscale=True)[0]
+    assert layer[2] == "labels"
+    np.testing.assert_array_equal(layer[0][0].compute(), data)
+    np.testing.assert_array_equal(layer[0][1].compute(), data[::2, ::2, ::2])
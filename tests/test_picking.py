@@ -0,0 +1,98 @@
+import dask.array as da
+import numpy as np
+import pandas as pd
+from morphosamplers.sampler import sample_volume_around_surface
+from morphosamplers.surface_spline import GriddedSplineSurface
+from napari.layers import Image, Shapes
+
+from blik.utils import layer_tuples_to_layers
+from blik.widgets.picking import _resample_surfaces
+
+
+def _flat_surface(z, offset=8):
+    """a small flat patch (xyz) at height z."""
+    points = [
+        np.array([[x, y, z] for x in range(offset, offset + 13, 4)], dtype=float)
+        for y in range(offset, offset + 13, 4)
+    ]
+    return GriddedSplineSurface(points=points, separation=2)
+
+
+def test_resample_surfaces_subvolume():
+    rng = np.random.default_rng(0)
+    volume = rng.random((64, 64, 64)).astype(np.float32)
+    surf = _flat_surface(10)
+
+    computed = []
+    data = da.from_array(volume, chunks=16).map_blocks(lambda block: computed.append(block.shape) or block)
+    layer = Image(data)
+    computed.clear()
+    (sampled,) = _resample_surfaces(layer, [surf], spacing=2, thickness=5, masked=False)
+
+    expected = sample_volume_around_surface(volume.T, surf, sampling_thickness=5, sampling_spacing=2)
+    np.testing.assert_allclose(sampled, expected, rtol=1e-4, atol=1e-4)
+    # only the chunks around the surface were read
+    assert 0 < len(computed) < data.npartitions
+
+
+def test_resample_surfaces_parallel():
+    rng = np.random.default_rng(0)
+    volume = rng.random((64, 64, 64)).astype(np.float32)
+    surfaces = [_flat_surface(z, offset) for z, offset in ((10, 8), (30, 20), (50, 40))]
+    layer = Image(volume)
+
+    serial = _resample_surfaces(layer, surfaces, spacing=2, thickness=5, masked=False)
+    parallel = _resample_surfaces(layer, surfaces, spacing=2, thickness=5, masked=False, workers=3)
+    assert len(parallel) == len(surfaces)
+    for s, p in zip(serial, parallel):
+        np.testing.assert_array_equal(s, p)
+
+
+def test_surface_incremental_refit(monkeypatch):
+    from blik.widgets import picking
+
+    lines = [np.array([[z, 20 + np.sin(x / 5), x] for x in range(8, 40, 4)]) for z in (5, 10, 15, 20, 25)]
+    shapes = Shapes(
+        [*lines, *(line + np.array([0, 30, 0]) for line in lines)],
+        shape_type="path",
+        features=pd.DataFrame({"surface_id": [0] * 5 + [1] * 5}),
+        metadata={"experiment_id": "a"},
+    )
+
+    fitted = []
+
+    def fit_surface(*args, **kwargs):
+        fitted.append(args[0])
+        return fit(*args, **kwargs)
+
+    fit = picking._fit_surface
+    monkeypatch.setattr(picking, "_fit_surface", fit_surface)
+
+    (first,) = picking.surface(surface_input=shapes, inside_points=None, spacing_A=5, workers=1)
+    assert len(fitted) == 2
+
+    # edit one line of the second surface
+    data = list(shapes.data)
+    data[7] = data[7] + [0, 1, 0]
+    shapes.data = data
+    shapes.features = pd.DataFrame({"surface_id": [0] * 5 + [1] * 5})
+    (second,) = picking.surface(surface_input=shapes, inside_points=None, spacing_A=5, workers=1)
+    assert len(fitted) == 3
+
+    grids_first, grids_second = first[1]["metadata"]["surface_grids"], second[1]["metadata"]["surface_grids"]
+    assert grids_second[0] is grids_first[0]
+    assert grids_second[1] is not grids_first[1]
+    # the unchanged surface keeps its vertices and faces
+    start, stop = second[1]["metadata"]["surface_vertex_ranges"][0]
+    np.testing.assert_array_equal(second[0][0][start:stop], first[0][0][start:stop])
+    assert len(second[0][1]) == len(first[0][1])
+
+    # sampling particles at another spacing does not change the shared grids
+    (surface_layer,) = layer_tuples_to_layers([second])
+    picking.surface_particles(surface=surface_layer, spacing_A=4)
+    assert len(fitted) == 3
+    assert all(np.isclose(grid.separation, 5) for grid in grids_second)
+
+    # a different spacing refits everything
+    picking.surface(surface_input=shapes, inside_points=None, spacing_A=4, workers=1)
+    assert len(fitted) == 5
@@ -1,4 +1,19 @@
-from blik.reader import construct_particle_layer_tuples, get_reader
+import dask.array as da
+import mrcfile
+import numpy as np
+import pandas as pd
+import pytest
+from cryotypes.image import Image
+
+from blik.reader import (
+    construct_particle_layer_tuples,
+    get_reader,
+    iter_particles,
+    read_image,
+    read_layers,
+    read_particles,
+    wait_for_cache_writes,
+)
 
 
 def test_reader(star_file):
@@ -34,3 +49,156 @@ def test_napari_read(star_file, mrc_file, make_napari_viewer):
     v = make_napari_viewer()
     v.open(star_file, plugin='blik')
     v.open(mrc_file, plugin='blik')
+
+
+def test_read_layers_parallel(star_file, mrc_file):
+    serial = read_layers(star_file, mrc_file, workers=1)
+    parallel = read_layers(star_file, mrc_file, workers=2)
+
+    assert [lay[1]["name"] for lay in serial] == [lay[1]["name"] for lay in parallel]
+    # images come first regardless of input order
+    assert parallel[0][2] == "image"
+
+
+def test_read_layers_experiment_ids(star_file, mrc_file):
+    layers = read_layers(star_file, mrc_file, experiment_ids=["a_2"])
+    assert [lay[1]["metadata"]["experiment_id"] for lay in layers] == ["a_2", "a_2"]
+
+
+def test_read_layers_cache(star_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    uncached = read_layers(star_file)
+    read_layers(star_file, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+    cached = read_layers(star_file, cache_dir=cache_dir)
+
+    for lay, lay_cached in zip(uncached, cached):
+        assert lay[1]["name"] == lay_cached[1]["name"]
+        np.testing.assert_allclose(lay[0], lay_cached[0])
+    pd.testing.assert_frame_equal(uncached[0][1]["features"], cached[0][1]["features"], check_dtype=False)
+
+    # different reader kwargs get a separate entry
+    read_layers(star_file, cache_dir=cache_dir, name_regex="a")
+    assert len(list(cache_dir.glob("*.npz"))) == 2
+
+    # entries are invalidated when the source file changes
+    star_copy = tmp_path / "copy.star"
+    star_copy.write_bytes(star_file.read_bytes())
+    read_layers(star_copy, cache_dir=cache_dir)
+    star_copy.write_bytes(star_file.read_bytes() + b"\n")
+    read_layers(star_copy, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("*.npz"))) == 3
+
+
+def test_cache_failed_write(star_file, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, "savez", fail)
+    with pytest.raises(OSError, match="disk full"):
+        read_layers(star_file, cache_dir=tmp_path)
+    # no leftover temporary files
+    assert not list(tmp_path.iterdir())
+
+
+def test_read_multiscale(tmp_path):
+    path = tmp_path / "big.mrc"
+    with mrcfile.new(path) as mrc:
+        mrc.set_data(np.random.rand(32, 32, 32).astype(np.float32))
+
+    img = read_layers(path, multiscale=True)[0]
+    assert img[1]["multiscale"]
+    assert [lvl.shape for lvl in img[0]] == [(32, 32, 32), (16, 16, 16), (8, 8, 8), (4, 4, 4)]
+
+    cache_dir = tmp_path / "cache"
+    img_cached = read_layers(path, multiscale=True, cache_dir=cache_dir)[0]
+    # the first time, levels are lazy and cached in the background
+    assert not isinstance(img_cached[0][-1], np.ndarray)
+    wait_for_cache_writes()
+    assert len(list(cache_dir.glob("*.npy"))) == 3
+    for lvl, lvl_cached in zip(img[0], img_cached[0]):
+        np.testing.assert_allclose(lvl, lvl_cached, rtol=1e-6)
+    img_cached = read_layers(path, multiscale=True, cache_dir=cache_dir)[0]
+    assert isinstance(img_cached[0][-1], np.memmap)
+
+
+def test_read_contrast_limits(tmp_path):
+    path = tmp_path / "outliers.mrc"
+    data = np.random.default_rng(0).normal(size=(32, 32, 32)).astype(np.float32)
+    data[0, 0, 0] = 1000
+    with mrcfile.new(path) as mrc:
+        mrc.set_data(data)
+
+    img = read_layers(path)[0]
+    low, high = img[1]["contrast_limits"]
+    assert -5 < low < 0 < high < 5
+    counts, edges = img[1]["metadata"]["histogram"]
+    assert len(edges) == len(counts) + 1
+
+    cache_dir = tmp_path / "cache"
+    read_layers(path, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+    img_cached = read_layers(path, cache_dir=cache_dir)[0]
+    assert img_cached[1]["contrast_limits"] == img[1]["contrast_limits"]
+
+    assert "contrast_limits" not in read_layers(path, contrast_limits=False)[0][1]
+
+
+def test_read_contrast_limits_multiscale_lazy():
+    class CountingArray:
+        """array which counts the values read from it."""
+
+        def __init__(self, arr):
+            self.arr = arr
+            self.shape, self.dtype, self.ndim = arr.shape, arr.dtype, arr.ndim
+            self.read = 0
+
+        def __getitem__(self, key):
+            out = self.arr[key]
+            self.read += out.size
+            return out
+
+    source = CountingArray(np.random.default_rng(0).normal(size=(256, 256, 256)).astype(np.float32))
+    image = Image(data=da.from_array(source, chunks=64), experiment_id="a", pixel_spacing=1, source="", stack=False)
+    img = read_image(image, multiscale=True)
+    low, high = img[1]["contrast_limits"]
+    assert -5 < low < 0 < high < 5
+    # opening does not read the whole volume
+    assert source.read < source.arr.size / 4
+
+
+def test_read_mmap(tmp_path):
+    path = tmp_path / "big_endian.mrc"
+    data = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+    with mrcfile.new(path) as mrc:
+        mrc.set_data(data.astype(">f4"))
+        mrc.set_extended_header(np.zeros(10, dtype=[("x", "i4")]))
+        mrc.voxel_size = 3
+
+    img = read_layers(path, mmap=True)[0]
+    assert isinstance(img[0], np.memmap)
+    assert img[1]["scale"] == [3] * 3
+    np.testing.assert_array_equal(img[0], data)
+
+    # copy-on-write: edits do not reach the file
+    img[0][0] = -1
+    np.testing.assert_array_equal(read_layers(path, mmap=True)[0][0], data)
+
+    # the names filter applies to memory maps as well
+    exp_id = img[1]["metadata"]["experiment_id"]
+    assert len(read_layers(path, mmap=True, names=[exp_id])) == 1
+    assert not read_layers(path, mmap=True, names=["other"])
+    with pytest.raises(TypeError):
+        read_layers(path, mmap=True, unknown=True)
+
+
+def test_iter_particles(star_file):
+    full = read_layers(star_file)
+    chunks = list(iter_particles(star_file, chunk_size=1))
+    assert len(chunks) == 2
+
+    # each particle has its own experiment, so each chunk matches one pair of layers
+    for (pset,), pts in zip(chunks, full[::2]):
+        pos = read_particles(pset)[0]
+        assert pos[1]["name"] == pts[1]["name"]
+        np.testing.assert_allclose(pos[0], pts[0])
@@ -0,0 +1,36 @@
+import numpy as np
+from napari.layers import Image, Points, Vectors
+
+from blik.registry import LayerRegistry
+
+
+def test_layer_registry():
+    registry = LayerRegistry()
+    img = Image(np.zeros((2, 2, 2)), metadata={"experiment_id": "a"}, visible=False)
+    pts = Points(np.zeros((1, 3)), metadata={"experiment_id": "a", "p_id": "x"}, visible=False)
+    vec = Vectors(np.zeros((3, 2, 3)), metadata={"experiment_id": "a", "p_id": "x"}, visible=False)
+    other = Image(np.zeros((2, 2, 2)), visible=False)
+
+    for layer in (img, pts, vec):
+        assert registry.add(layer)
+    assert not registry.add(other)
+    assert other not in registry
+    assert registry.experiment_ids == ["a"]
+    assert registry.layers("a") == [img, pts, vec]
+    assert registry.particle_pair("x") == (pts, vec)
+    assert not registry.visible_experiments
+
+    img.visible = True
+    assert registry.visible_experiments == {"a"}
+
+    registry.remove(vec)
+    assert registry.particle_pair("x") == (pts, None)
+
+    pts.metadata["experiment_id"] = "b"
+    registry.update(pts)
+    assert registry.layers("a") == [img]
+    assert registry.layers("b") == [pts]
+
+    registry.remove(img)
+    assert registry.experiment_ids == ["b"]
+    assert not registry.visible_experiments
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from blik.utils import atomic_write, select_in_box
+
+
+def test_select_in_box():
+    coords = np.stack(np.meshgrid(*[np.arange(10)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    tree = cKDTree(coords)
+
+    idx = select_in_box(tree, center=(5, 5, 5), half_extent=(0, 2, 1))
+    assert len(idx) == 5 * 3
+    assert np.all(coords[idx, 0] == 5)
+
+    idx = select_in_box(tree, center=(5, 5, 5), half_extent=10, budget=100)
+    assert len(idx) == 100
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "file.txt"
+    with atomic_write(path, "w") as f:
+        f.write("old")
+    assert path.read_text() == "old"
+
+    # failed writes keep the old file and leave nothing behind
+    with pytest.raises(RuntimeError), atomic_write(path, "w") as f:
+        f.write("new")
+        raise RuntimeError
+    assert path.read_text() == "old"
+    assert list(tmp_path.iterdir()) == [path]
+
+    with atomic_write(path, mode=None) as tmp:
+        tmp.write_text("new")
+    assert path.read_text() == "new"
+    assert list(tmp_path.iterdir()) == [path]
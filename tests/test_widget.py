@@ -1,10 +1,23 @@
 import mrcfile
 import napari
 import numpy as np
+import pandas as pd
+import starfile
 
-from blik.widgets.file_reader import file_reader
+from blik.journal import _read_records
+from blik.reader import read_layers
+from blik.utils import filename_safe, generate_vectors, get_quaternions, invert_xyz
+from blik.widgets import main_widget
+from blik.widgets.file_reader import file_reader, stream_particles
+from blik.widgets.file_writer import export_particles
 from blik.widgets.filter import bandpass_filter, gaussian_filter
-from blik.widgets.main_widget import MainBlikWidget
+from blik.widgets.main_widget import (
+    MainBlikWidget,
+    _connect_journal,
+    _connect_points_to_vectors,
+    _disconnect_journal,
+    experiment,
+)
 
 
 def test_main_widget(make_napari_viewer):
@@ -26,6 +39,9 @@ def test_main_widget(make_napari_viewer):
     wdg[1].l_type.value = "segmentation"
     wdg[1]()
     assert viewer.layers[-1].name == "test - segmentation"
+    # more than 255 labels can be painted
+    viewer.layers[-1].selected_label = 1000
+    assert viewer.layers[-1].selected_label == 1000
 
     # add new picking
     wdg[1].l_type.value = "particles"
@@ -76,3 +92,208 @@ def test_bandpass_filter_widget(make_napari_viewer, mrc_file):
     wdg()
     result = viewer.layers[-1].data
     assert np.all(result != 1)
+
+
+def test_stream_particles_widget(make_napari_viewer, qtbot, star_file):
+    viewer = make_napari_viewer()
+    wdg = stream_particles()
+    viewer.window.add_dock_widget(wdg)
+    wdg.files.value = [star_file]
+
+    worker = wdg()
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        pass
+    assert len(viewer.layers) == 4
+
+
+def test_stream_particles_chunks(make_napari_viewer, qtbot, tmp_path):
+    n = 50
+    path = tmp_path / "many.star"
+    df = pd.DataFrame(
+        {
+            "rlnCoordinateX": np.arange(n, dtype=float),
+            "rlnCoordinateY": np.ones(n),
+            "rlnCoordinateZ": np.ones(n),
+            "rlnAngleRot": np.linspace(0, 90, n),
+            "rlnAngleTilt": np.zeros(n),
+            "rlnAnglePsi": np.zeros(n),
+            "rlnMicrographName": ["a_1"] * n,
+        }
+    )
+    starfile.write({"particles": df}, path)
+    viewer = make_napari_viewer()
+    # sync vectors with the points as soon as both layers are added
+    viewer.layers.events.inserted.connect(
+        lambda e: len(viewer.layers) == 2 and _connect_points_to_vectors(*viewer.layers)
+    )
+    wdg = stream_particles()
+    viewer.window.add_dock_widget(wdg)
+    wdg.files.value = [path]
+
+    worker = wdg(chunk_size=7)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        pass
+    points, vectors = viewer.layers
+    expected = read_layers(path)
+    np.testing.assert_allclose(points.data, expected[0][0])
+    np.testing.assert_allclose(vectors.data, expected[1][0])
+    np.testing.assert_array_equal(vectors.edge_color[:, :3], np.tile(np.eye(3), (n, 1)))
+    assert len(points.features) == n
+    # vectors are synced again once streaming is done
+    assert points in main_widget._vector_callbacks
+
+
+def test_lazy_experiments(make_napari_viewer, star_file):
+    viewer = make_napari_viewer()
+    exp = experiment()
+    viewer.window.add_dock_widget(exp)
+    wdg = file_reader()
+    viewer.window.add_dock_widget(wdg)
+    wdg.files.value = [star_file]
+    wdg.lazy_experiments.value = True
+
+    wdg()
+    assert len(viewer.layers) == 0
+    exp.reset_choices()
+    assert {"a_1", "a_2"} <= set(exp.experiment_id.choices)
+
+    exp.experiment_id.value = "a_1"
+    visible = [lay.name for lay in viewer.layers if lay.visible]
+    assert visible == ["a_1 - particle positions", "a_1 - particle orientations"]
+    exp.experiment_id.value = "a_2"
+    visible = [lay.name for lay in viewer.layers if lay.visible]
+    assert visible == ["a_2 - particle positions", "a_2 - particle orientations"]
+    assert {lay.name for lay in viewer.layers.selection} == {"a_2 - particle positions", "a_2 - particle orientations"}
+
+
+def test_export_particles_widget(make_napari_viewer, qtbot, star_file, tmp_path):
+    viewer = make_napari_viewer()
+    viewer.open(star_file, plugin="blik")
+    wdg = export_particles()
+    viewer.window.add_dock_widget(wdg)
+    wdg.directory.value = tmp_path
+
+    worker = wdg()
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        pass
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a_1.star", "a_2.star"]
+
+
+def test_autosave_journal(make_napari_viewer, star_file, tmp_path):
+    viewer = make_napari_viewer()
+    viewer.open(star_file, plugin="blik")
+    points = viewer.layers[0]
+
+    _connect_journal(points, tmp_path, compact_every=3)
+    points.add([[5, 5, 5]])
+    points.selected_data = {0}
+    points.remove_selected()
+    journal = tmp_path / f"{filename_safe(points.name)}.journal"
+    recovered = read_layers(journal)[0]
+    np.testing.assert_array_equal(recovered[0], points.data)
+
+    # the third edit compacts into a star file
+    points.add([[6, 6, 6]])
+    assert journal.with_suffix(".star").exists()
+    points.add([[7, 7, 7]])
+
+    # changing the features of one particle only journals that row
+    points.features.loc[1, "orientation_w"] = 0.5
+    points.events.features(data_indices=[1])
+    header, _ = list(_read_records(journal))[-1]
+    assert header["op"] == "change" and header["indices"] == [1]
+    # without indices, all the features are journaled
+    points.features.loc[0, "orientation_w"] = 0.25
+    points.events.features()
+
+    _disconnect_journal(points)
+    recovered = read_layers(journal)[0]
+    np.testing.assert_array_equal(recovered[0], points.data)
+    assert recovered[1]["features"]["orientation_w"][1] == 0.5
+    assert recovered[1]["features"]["orientation_w"][0] == 0.25
+
+
+def test_incremental_vectors(make_napari_viewer, star_file, monkeypatch):
+    viewer = make_napari_viewer()
+    viewer.open(star_file, plugin="blik")
+    points, vectors = viewer.layers[:2]
+    points.visible = vectors.visible = True
+    points.data = np.random.rand(100, 3) * 10
+    _connect_points_to_vectors(points, vectors, latency=0)
+
+    generated = []
+
+    def _generate_vectors(coords, quat):
+        generated.append(len(coords))
+        return generate_vectors(coords, quat)
+
+    monkeypatch.setattr(main_widget, "generate_vectors", _generate_vectors)
+
+    def _check():
+        expected, _ = generate_vectors(invert_xyz(points.data), get_quaternions(points.features))
+        np.testing.assert_allclose(vectors.data, invert_xyz(expected))
+        np.testing.assert_array_equal(vectors.edge_color[:, :3], np.tile(np.eye(3), (len(points.data), 1)))
+
+    points.refresh()
+    generated.clear()
+    points.add([[5, 5, 5]])
+    points.refresh()
+    _check()
+    assert generated == [1]
+
+    points.selected_data = {1}
+    points.remove_selected()
+    points.refresh()
+    _check()
+    assert generated == [1]
+
+    # moving points edits data in place
+    points.data[2] += 1
+    points.refresh()
+    _check()
+    assert generated == [1, 1]
+
+    features = points.features.copy()
+    features.loc[3, "orientation_x"] = 1
+    features.loc[3, "orientation_w"] = 0
+    points.features = features
+    _check()
+    assert generated == [1, 1, 1]
+
+    # reordering everything needs a full update
+    points.data = points.data[::-1]
+    points.refresh()
+    _check()
+    assert generated[-1] == len(points.data)
+
+
+def test_coalesced_vectors(make_napari_viewer, star_file, monkeypatch, qtbot):
+    viewer = make_napari_viewer()
+    viewer.open(star_file, plugin="blik")
+    points, vectors = viewer.layers[:2]
+    points.visible = vectors.visible = True
+    points.data = np.random.rand(100, 3) * 10
+    _connect_points_to_vectors(points, vectors, latency=50)
+
+    generated = []
+
+    def _generate_vectors(coords, quat):
+        generated.append(len(coords))
+        return generate_vectors(coords, quat)
+
+    monkeypatch.setattr(main_widget, "generate_vectors", _generate_vectors)
+    points.events.set_data()
+    qtbot.waitUntil(lambda: len(generated) > 0, timeout=2000)
+    qtbot.wait(100)
+    generated.clear()
+
+    # a burst of edits results in a single update, generated in another thread
+    for i in range(10):
+        points.data[i] += 1
+        points.events.set_data()
+    assert generated == []
+    qtbot.waitUntil(lambda: len(generated) > 0, timeout=2000)
+    qtbot.wait(200)
+    assert generated == [10]
+    expected, _ = generate_vectors(invert_xyz(points.data), get_quaternions(points.features))
+    np.testing.assert_allclose(vectors.data, invert_xyz(expected))
@@ -0,0 +1,212 @@
+import dask.array as da
+import dynamotable
+import mrcfile
+import numpy as np
+import pandas as pd
+import pytest
+import starfile
+from cryohub.writing.star import write_star
+from cryohub.writing.tbl import write_tbl
+from scipy.spatial.transform import Rotation
+
+from blik.chunked import ChunkedArray
+from blik.container import is_container
+from blik.reader import construct_particle_layer_tuples, read_layers, read_surface, read_surface_picks
+from blik.utils import ORIENTATION_COLS, get_orientations
+from blik.writer import (
+    _generate_particle_set,
+    append_surface_picks,
+    write_image,
+    write_labels,
+    write_particles_batch,
+    write_particles_dynamo,
+    write_particles_relion_30,
+    write_particles_relion_40,
+    write_surface,
+    write_surface_picks,
+)
+
+
+def test_particles_roundtrip(star_file, tmp_path):
+    pts, vec = read_layers(star_file)[:2]
+    assert pts[1]["features"][ORIENTATION_COLS].dtypes.eq(float).all()
+
+    out = tmp_path / "out.star"
+    write_particles_relion_40(out, [pts, vec])
+    pts_new = read_layers(out)[0]
+
+    np.testing.assert_allclose(pts_new[0], pts[0])
+    ori = get_orientations(pts[1]["features"])
+    ori_new = get_orientations(pts_new[1]["features"])
+    np.testing.assert_allclose((ori_new * ori.inv()).magnitude(), 0, atol=1e-6)
+
+
+@pytest.mark.parametrize("version", ["3.0", "4.0"])
+def test_particles_star_matches_cryohub(star_file, tmp_path, version):
+    layers = read_layers(star_file)
+    write = write_particles_relion_30 if version == "3.0" else write_particles_relion_40
+    write(tmp_path / "blik.star", layers)
+    write_star(_generate_particle_set(layers), tmp_path / "cryohub.star", version=version)
+
+    blik_star = starfile.read(tmp_path / "blik.star", always_dict=True)
+    cryohub_star = starfile.read(tmp_path / "cryohub.star", always_dict=True)
+    assert blik_star.keys() == cryohub_star.keys()
+    for block in blik_star:
+        pd.testing.assert_frame_equal(blik_star[block], cryohub_star[block])
+
+
+def test_particles_tbl_matches_cryohub(star_file, tmp_path):
+    layers = read_layers(star_file)
+    # one experiment at a time, since cryohub leaves gaps when mixing in-plane and full rotations
+    for pts_vec in (layers[:2], layers[2:]):
+        write_particles_dynamo(tmp_path / "blik.tbl", pts_vec)
+        write_tbl(_generate_particle_set(pts_vec), tmp_path / "cryohub.tbl", overwrite=True)
+        blik_tbl = dynamotable.read(tmp_path / "blik.tbl")
+        cryohub_tbl = dynamotable.read(tmp_path / "cryohub.tbl")
+        pd.testing.assert_frame_equal(blik_tbl, cryohub_tbl, check_dtype=False, atol=1e-6)
+
+    # angles missing from the in-plane rotations are left empty, like dynamotable does
+    write_particles_dynamo(tmp_path / "blik.tbl", layers)
+    blik_tbl = pd.read_csv(tmp_path / "blik.tbl", sep=" ", header=None)
+    np.testing.assert_allclose(blik_tbl[[6, 7, 8]], [[np.nan, 90, np.nan], [-90, 90, 90]], atol=1e-6)
+
+
+def test_particles_tbl_full_precision(tmp_path):
+    rng = np.random.default_rng(0)
+    coords = rng.random((10, 3)) * 1000
+    features = pd.DataFrame(Rotation.random(10, random_state=0).as_quat(), columns=ORIENTATION_COLS)
+    layers = construct_particle_layer_tuples(coords, features=features, scale=1.7, exp_id="a")
+    write_particles_dynamo(tmp_path / "out.tbl", layers)
+
+    # dynamotable does not parse floats exactly, so read the x, y and z columns directly
+    tbl = pd.read_csv(tmp_path / "out.tbl", sep=" ", header=None, float_precision="round_trip")
+    np.testing.assert_array_equal(tbl[[23, 24, 25]], coords)
+
+
+def test_particles_batch(star_file, tmp_path):
+    layers = read_layers(star_file)
+    paths = write_particles_batch(tmp_path / "out", layers, file_format="dynamo", workers=2)
+    assert [path.name for path in paths] == ["a_1.tbl", "a_2.tbl"]
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["a_1.tbl", "a_2.tbl"]
+    assert len(read_layers(paths[0])) == 2
+
+    paths = write_particles_batch(tmp_path / "out", layers, per_experiment=False)
+    assert [path.name for path in paths] == ["particles.star"]
+    assert len(read_layers(paths[0])) == 4
+
+
+def _picks_attributes(surface_ids):
+    return {
+        "metadata": {"experiment_id": "test"},
+        "scale": np.array([2.0, 2.0, 2.0]),
+        "features": {"surface_id": np.array(surface_ids)},
+        "edge_color_cycle": np.random.rand(3, 4),
+    }
+
+
+def test_surface_picks_roundtrip(tmp_path):
+    lines = [np.random.rand(n, 3) for n in (3, 4, 5)]
+    path = write_surface_picks(tmp_path / "test", lines, _picks_attributes([0, 0, 1]))[0]
+    assert is_container(path)
+
+    data, attrs, _ = read_surface_picks(path)
+    assert attrs["metadata"]["experiment_id"] == "test"
+    np.testing.assert_array_equal(attrs["features"]["surface_id"], [0, 0, 1])
+    for line, line_read in zip(lines, data):
+        np.testing.assert_array_equal(line, line_read)
+    # lines are zero-copy views into the file
+    assert isinstance(data[0], np.memmap)
+
+    data, attrs, _ = read_surface_picks(path, surface_ids=[1])
+    assert len(data) == 1
+    np.testing.assert_array_equal(data[0], lines[2])
+
+    new_line = np.random.rand(2, 3)
+    append_surface_picks(path, [new_line], [2])
+    data, attrs, _ = read_surface_picks(path)
+    np.testing.assert_array_equal(attrs["features"]["surface_id"], [0, 0, 1, 2])
+    np.testing.assert_array_equal(data[2], lines[2])
+    np.testing.assert_array_equal(data[3], new_line)
+
+
+def test_surface_picks_legacy(tmp_path):
+    lines = [np.random.rand(n, 3) for n in (3, 4)]
+    attributes = _picks_attributes([0, 1])
+    path = tmp_path / "legacy.picks"
+    with open(path, "wb") as f:
+        np.save(f, attributes["scale"])
+        np.save(f, attributes["features"]["surface_id"])
+        np.save(f, attributes["edge_color_cycle"])
+        for line in lines:
+            np.save(f, line)
+        f.write(b"test")
+
+    data, attrs, _ = read_surface_picks(path)
+    assert attrs["metadata"]["experiment_id"] == "test"
+    np.testing.assert_array_equal(data[1], lines[1])
+
+
+def test_surface_roundtrip(tmp_path):
+    vert = np.random.rand(7, 3)
+    faces = np.array([[0, 1, 2], [2, 1, 0], [3, 4, 5], [6, 5, 4]])
+    values = np.array([0, 0, 0, 1, 1, 1, 1], dtype=float)
+    attributes = {
+        "metadata": {"experiment_id": "test", "surface_vertex_ranges": [[0, 3], [3, 7]]},
+        "scale": np.array([2.0, 2.0, 2.0]),
+    }
+
+    path = write_surface(tmp_path / "test", (vert, faces, values), attributes, chunk_rows=2, compression="zlib")[0]
+    (v, f, val), attrs, _ = read_surface(path)
+    np.testing.assert_allclose(v, vert, rtol=1e-6)
+    assert f.dtype == np.int32
+    np.testing.assert_array_equal(f, faces)
+    np.testing.assert_array_equal(val, values)
+
+    (v, f, val), attrs, _ = read_surface(path, surfaces=[1])
+    np.testing.assert_allclose(v, vert[3:], rtol=1e-6)
+    np.testing.assert_array_equal(f, faces[2:] - 3)
+    np.testing.assert_array_equal(attrs["metadata"]["surface_vertex_ranges"], [[0, 4]])
+
+
+def test_write_image_streaming(tmp_path):
+    data = da.random.random((20, 30, 40), chunks=(7, 30, 40))
+    attrs = {"metadata": {"experiment_id": "a"}, "scale": (2, 2, 2)}
+    # tiny slabs, so data is written across many of them
+    path = write_image(tmp_path / "a", data, attrs, slab_bytes=5000)[0]
+    with mrcfile.open(path) as mrc:
+        np.testing.assert_allclose(mrc.data, data.compute().astype(np.float32))
+        assert mrc.voxel_size.x == 2
+        assert np.isclose(mrc.header.dmax, data.max().compute())
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+@pytest.mark.parametrize(
+    ("high", "dtype"),
+    [(5, np.int8), (1000, np.int16), (40000, np.uint16)],
+)
+def test_write_labels_downcast(tmp_path, high, dtype):
+    data = np.zeros((10, 10, 10), dtype=np.int64)
+    data[2:4, 3:5, 4:6] = high
+    attrs = {"metadata": {"experiment_id": "a"}, "scale": (1, 1, 1)}
+    path = write_labels(tmp_path / "a.mrc", data, attrs, slab_bytes=1000)[0]
+    with mrcfile.open(path) as mrc:
+        assert mrc.data.dtype == dtype
+        np.testing.assert_array_equal(mrc.data, data)
+
+
+def test_write_labels_too_large(tmp_path):
+    data = np.full((2, 2, 2), 70000)
+    with pytest.raises(ValueError, match="cannot be stored"):
+        write_labels(tmp_path / "a.mrc", data, {"metadata": {"experiment_id": "a"}, "scale": (1, 1, 1)})
+
+
+def test_write_chunked_labels(tmp_path):
+    data = ChunkedArray((40, 40, 40), dtype=np.int32, chunks=(16, 16, 16))
+    data[20:30, 5, 5] = 7
+    attrs = {"metadata": {"experiment_id": "a"}, "scale": (1, 1, 1)}
+    path = write_labels(tmp_path / "a.mrc", data, attrs)[0]
+    with mrcfile.open(path) as mrc:
+        assert mrc.data.dtype == np.int8
+        np.testing.assert_array_equal(mrc.data, np.asarray(data))
+        assert mrc.header.dmax == 7
+        assert np.isclose(mrc.header.dmean, np.asarray(data).mean())